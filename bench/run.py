@@ -0,0 +1,285 @@
+# bench/run.py — throughput and tail-latency benchmark for the composite
+#
+# Starts the stub downstreams (bench/stubs.py) and the real `main:app` under
+# uvicorn, drives it with a weighted traffic mix at fixed concurrency levels,
+# and reports RPS and p50/p95/p99 per route. Results are written as JSON so a
+# later run can be compared against a saved baseline:
+#
+#   python -m bench.run --concurrency 16,64 --duration 20 --out bench/baselines/main.json
+#   python -m bench.run --compare bench/baselines/main.json --max-regression 0.15
+#
+# A comparison exits with status 1 when any route's p99 grew, or its RPS
+# dropped, by more than --max-regression.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Route name -> relative weight; see _request(). Tokens starting with "prof"
+# are faculty for the stub Auth service.
+DEFAULT_MIX = {
+    "search": 40,
+    "search_next_page": 10,
+    "video": 20,
+    "offerings": 8,
+    "courses": 5,
+    "profs": 5,
+    "dashboard": 7,
+    "start_upload": 5,
+}
+
+USERS = 200
+
+
+def _request(name, rng):
+    """
+    (method, url, json body, token) for one call of the named route.
+    """
+    user = rng.randrange(USERS)
+    student = f"student{user}"
+    prof = f"prof{user % 50}"
+    if name == "search":
+        return "GET", f"/videos/search?course_id=COMS{4000 + user % 20}&limit=20", None, student
+    if name == "search_next_page":
+        offset = 20 * rng.randrange(1, 10)
+        return "GET", f"/videos/search?course_id=COMS{4000 + user % 20}&limit=20&offset={offset}", None, student
+    if name == "video":
+        return "GET", f"/videos/v{rng.randrange(1000)}", None, student
+    if name == "offerings":
+        return "GET", "/offerings", None, None
+    if name == "courses":
+        return "GET", "/courses", None, None
+    if name == "profs":
+        return "GET", "/auth/get-profs", None, None
+    if name == "dashboard":
+        return "GET", f"/dashboard/prof/pr{user % 300:04d}", None, prof
+    if name == "start_upload":
+        body = {"offering_id": user % 200, "prof_uni": f"pr{user % 300:04d}", "videoTitle": "Bench lecture"}
+        return "POST", "/start_upload", body, prof
+    raise ValueError(name)
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def _wait_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def run_level(base_url, mix, concurrency, duration, warmup, seed):
+    """
+    Runs `concurrency` closed-loop clients for warmup + duration seconds and
+    returns per-route stats for the measured part.
+    """
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    samples = {n: [] for n in names}
+    errors = {n: 0 for n in names}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        start = time.monotonic()
+        measure_from = start + warmup
+        stop_at = measure_from + duration
+
+        async def worker(index):
+            rng = random.Random(seed * 1000 + index)
+            while True:
+                started = time.monotonic()
+                if started >= stop_at:
+                    return
+                name = rng.choices(names, weights)[0]
+                method, url, body, token = _request(name, rng)
+                headers = {"Authorization": f"Bearer {token}"} if token else None
+                t0 = time.perf_counter()
+                try:
+                    res = await client.request(method, url, json=body, headers=headers)
+                    failed = res.status_code >= 500
+                except httpx.HTTPError:
+                    failed = True
+                elapsed = time.perf_counter() - t0
+                if started >= measure_from:
+                    samples[name].append(elapsed)
+                    errors[name] += failed
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+    routes = {}
+    total = 0
+    for name in names:
+        ordered = sorted(samples[name])
+        total += len(ordered)
+        routes[name] = {
+            "requests": len(ordered),
+            "rps": round(len(ordered) / duration, 1),
+            "errors": errors[name],
+            "p50_ms": _ms(percentile(ordered, 0.50)),
+            "p95_ms": _ms(percentile(ordered, 0.95)),
+            "p99_ms": _ms(percentile(ordered, 0.99)),
+        }
+    return {"concurrency": concurrency, "rps": round(total / duration, 1), "routes": routes}
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def compare(result, baseline, max_regression):
+    """
+    Regressions of `result` against `baseline`, as readable strings.
+    """
+    problems = []
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in result["levels"]:
+        base = previous.get(level["concurrency"])
+        if base is None:
+            continue
+        for name, stats in level["routes"].items():
+            old = base["routes"].get(name)
+            if not old or not old["requests"] or not stats["requests"]:
+                continue
+            if old["p99_ms"] and stats["p99_ms"] > old["p99_ms"] * (1 + max_regression):
+                problems.append(f"c={level['concurrency']} {name}: p99 {old['p99_ms']}ms -> {stats['p99_ms']}ms")
+            if stats["rps"] < old["rps"] * (1 - max_regression):
+                problems.append(f"c={level['concurrency']} {name}: rps {old['rps']} -> {stats['rps']}")
+    return problems
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def _print(level):
+    print(f"\nconcurrency {level['concurrency']}: {level['rps']} req/s")
+    print(f"  {'route':<18}{'reqs':>8}{'rps':>9}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, s in level["routes"].items():
+        print(f"  {name:<18}{s['requests']:>8}{s['rps']:>9}{s['errors']:>6}"
+              f"{s['p50_ms'] or 0:>9}{s['p95_ms'] or 0:>9}{s['p99_ms'] or 0:>9}")
+
+
+async def main_async(args):
+    stub_port = args.stub_port
+    env = {
+        **os.environ,
+        "AUTH_SERVICE_URL": f"http://127.0.0.1:{stub_port}",
+        "SEARCH_SERVICE_URL": f"http://127.0.0.1:{stub_port + 1}",
+        "UPLOAD_SERVICE_URL": f"http://127.0.0.1:{stub_port + 2}",
+        "VIDEO_COMPOSITE_URL": f"http://127.0.0.1:{stub_port + 3}",
+        "GCS_UPLOAD_URL": f"http://127.0.0.1:{stub_port + 4}",
+        "GCS_AUTH": "none",
+        "AUTH_VERIFY_MODE": "remote",
+        "LOG_LEVEL": args.log_level,
+    }
+    for pair in args.env:
+        key, _, value = pair.partition("=")
+        env[key] = value
+
+    stub_cmd = [sys.executable, "-m", "bench.stubs", "--port", str(stub_port)]
+    if args.profile:
+        stub_cmd += ["--profile", args.profile]
+    app_cmd = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+    ]
+
+    stubs = subprocess.Popen(stub_cmd, cwd=ROOT, env=env)
+    app = subprocess.Popen(app_cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    try:
+        await _wait_ready(f"http://127.0.0.1:{stub_port}/docs")
+        base_url = f"http://127.0.0.1:{args.port}"
+        await _wait_ready(f"{base_url}/healthz")
+
+        mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+        levels = []
+        for concurrency in args.concurrency:
+            level = await run_level(base_url, mix, concurrency, args.duration, args.warmup, args.seed)
+            _print(level)
+            levels.append(level)
+    finally:
+        for proc in (app, stubs):
+            proc.terminate()
+        for proc in (app, stubs):
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "workers": args.workers,
+            "profile": args.profile,
+            "mix": mix,
+            "env": args.env,
+        },
+        "levels": levels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Composite load test against stub downstreams")
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[16, 64])
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the composite")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--profile", help="stub latency/error/payload profile (JSON)")
+    parser.add_argument("--mix", help='traffic mix as JSON, e.g. \'{"search": 3, "video": 1}\'')
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the composite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--out", help="write results as JSON (a new baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15)
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nresults written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(result, json.load(f), args.max_regression)
+        if problems:
+            print("\nREGRESSIONS:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"\nno regressions beyond {args.max_regression:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
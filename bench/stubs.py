@@ -0,0 +1,292 @@
+# bench/stubs.py — local stand-ins for the downstream services
+#
+# One process serves stub versions of Auth, Search, Upload, the video
+# composite and a GCS-style resumable upload target, each on its own port.
+# Every route's latency distribution, error rate and payload size comes from a
+# profile (see DEFAULT_PROFILE), so the composite can be benchmarked against
+# fast, slow or flaky downstreams without touching the real VMs.
+#
+#   python -m bench.stubs --port 9100 [--profile slow.json]
+#
+# Ports: auth 9100, search 9101, upload 9102, video 9103, gcs 9104.
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import uuid
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+SERVICES = ("auth", "search", "upload", "video", "gcs")
+
+# Per route: latency in ms, fraction of 500s, and payload size in items.
+# Latency dists: {"dist": "fixed", "ms": x}, {"dist": "uniform", "min_ms", "max_ms"},
+# {"dist": "lognormal", "p50_ms", "p99_ms"}.
+DEFAULT_PROFILE = {
+    "auth": {
+        "/auth/verify-token": {"latency": {"dist": "lognormal", "p50_ms": 15, "p99_ms": 80}, "error_rate": 0.0},
+        "/auth/get-user": {"latency": {"dist": "lognormal", "p50_ms": 20, "p99_ms": 100}, "error_rate": 0.0},
+        "/auth/get-profs": {"latency": {"dist": "lognormal", "p50_ms": 40, "p99_ms": 200}, "error_rate": 0.0, "items": 300},
+    },
+    "search": {
+        "/search/videos": {"latency": {"dist": "lognormal", "p50_ms": 35, "p99_ms": 250}, "error_rate": 0.005, "items": 1000},
+    },
+    "upload": {
+        "/videos/offer": {"latency": {"dist": "lognormal", "p50_ms": 30, "p99_ms": 150}, "error_rate": 0.0, "items": 200},
+        "/videos/courses": {"latency": {"dist": "lognormal", "p50_ms": 30, "p99_ms": 150}, "error_rate": 0.0, "items": 100},
+        "/videos/prof_offer": {"latency": {"dist": "lognormal", "p50_ms": 25, "p99_ms": 120}, "error_rate": 0.0, "items": 10},
+        "/videos/start_upload": {"latency": {"dist": "lognormal", "p50_ms": 60, "p99_ms": 300}, "error_rate": 0.01},
+    },
+    "video": {
+        "/videos/{video_id}": {"latency": {"dist": "lognormal", "p50_ms": 10, "p99_ms": 60}, "error_rate": 0.0},
+    },
+    "gcs": {
+        "chunk": {"latency": {"dist": "fixed", "ms": 5}, "error_rate": 0.0},
+    },
+}
+
+
+def load_profile(path=None):
+    profile = json.loads(json.dumps(DEFAULT_PROFILE))
+    if path:
+        with open(path) as f:
+            for service, routes in json.load(f).items():
+                for route, settings in routes.items():
+                    profile.setdefault(service, {}).setdefault(route, {}).update(settings)
+    return profile
+
+
+def sample_latency(latency):
+    """
+    Seconds to sleep for one call.
+    """
+    dist = latency.get("dist", "fixed")
+    if dist == "uniform":
+        return random.uniform(latency["min_ms"], latency["max_ms"]) / 1000
+    if dist == "lognormal":
+        # Lognormal with the given median and 99th percentile
+        mu = math.log(latency["p50_ms"])
+        sigma = max(1e-9, (math.log(latency["p99_ms"]) - mu) / 2.326)
+        return random.lognormvariate(mu, sigma) / 1000
+    return latency.get("ms", 0) / 1000
+
+
+async def behave(settings):
+    """
+    Sleeps per the route's latency; returns an error response if this call
+    should fail, else None.
+    """
+    await asyncio.sleep(sample_latency(settings.get("latency", {})))
+    if random.random() < settings.get("error_rate", 0.0):
+        return JSONResponse({"detail": "stub failure"}, status_code=500)
+    return None
+
+
+def _video(i):
+    return {
+        "video_id": f"v{i}",
+        "title": f"Lecture {i}",
+        "gcs_path": f"gs://lectures/v{i}.mp4",
+        "uploaded_at": "2025-01-01T00:00:00Z",
+        "course_id": f"COMS{4000 + i % 50}",
+        "course_name": f"Course {i % 50}",
+        "prof_uni": f"pr{i % 300:04d}",
+        "semester": "Fall",
+        "year": 2025,
+        "section": 1,
+    }
+
+
+def _prof(i):
+    return {"uni": f"pr{i:04d}", "name": f"Prof{i} Name{i * 7 % 300}", "email": f"pr{i:04d}@uni.edu", "role": "faculty"}
+
+
+def auth_app(profile):
+    app = FastAPI()
+    routes = profile["auth"]
+
+    @app.get("/auth/verify-token")
+    async def verify_token(request: Request):
+        failure = await behave(routes["/auth/verify-token"])
+        if failure:
+            return failure
+        token = request.headers.get("authorization", "").removeprefix("Bearer ")
+        if not token or token == "bad":
+            return JSONResponse({"detail": "invalid token"}, status_code=401)
+        role = "faculty" if token.startswith("prof") else "student"
+        return {"uid": token, "email": f"{token}@uni.edu", "role": role}
+
+    @app.get("/auth/get-user")
+    async def get_user(uni: str):
+        failure = await behave(routes["/auth/get-user"])
+        if failure:
+            return failure
+        role = "faculty" if uni.startswith("pr") else "student"
+        return {"user": [{"uni": uni, "email": f"{uni}@uni.edu", "role": role}]}
+
+    @app.get("/auth/get-profs")
+    async def get_profs():
+        settings = routes["/auth/get-profs"]
+        failure = await behave(settings)
+        if failure:
+            return failure
+        return {"profs": [_prof(i) for i in range(settings.get("items", 300))]}
+
+    return app
+
+
+def search_app(profile):
+    app = FastAPI()
+    settings = profile["search"]["/search/videos"]
+
+    @app.get("/search/videos")
+    async def search(limit: int = 20, offset: int = 0):
+        failure = await behave(settings)
+        if failure:
+            return failure
+        total = settings.get("items", 1000)
+        items = [_video(i) for i in range(offset, min(offset + limit, total))]
+        return {"items": items, "page_size": len(items), "offset": offset, "links": []}
+
+    return app
+
+
+def upload_app(profile):
+    app = FastAPI()
+    routes = profile["upload"]
+
+    async def listing(route, make):
+        settings = routes[route]
+        failure = await behave(settings)
+        if failure:
+            return failure
+        return {"items": [make(i) for i in range(settings.get("items", 50))]}
+
+    @app.post("/videos/offer")
+    async def offerings():
+        return await listing("/videos/offer", lambda i: {"offering_id": i, "course_id": f"COMS{4000 + i}", "semester": "Fall", "year": 2025})
+
+    @app.post("/videos/courses")
+    async def courses():
+        return await listing("/videos/courses", lambda i: {"course_id": f"COMS{4000 + i}", "name": f"Course {i}"})
+
+    @app.post("/videos/prof_offer/{prof_uni}")
+    async def prof_offer(prof_uni: str):
+        return await listing("/videos/prof_offer", lambda i: {"offering_id": i, "prof_uni": prof_uni})
+
+    @app.post("/videos/start_upload")
+    async def start_upload(request: Request):
+        failure = await behave(routes["/videos/start_upload"])
+        if failure:
+            return failure
+        body = await request.json()
+        return {"video_id": uuid.uuid4().hex[:12], "status": "started", **body}
+
+    return app
+
+
+def video_app(profile):
+    app = FastAPI()
+    settings = profile["video"]["/videos/{video_id}"]
+
+    @app.get("/videos/{video_id}")
+    async def video(video_id: str):
+        failure = await behave(settings)
+        if failure:
+            return failure
+        index = int(video_id[1:]) if video_id[1:].isdigit() else 0
+        return {**_video(index), "video_id": video_id}
+
+    return app
+
+
+def gcs_app(profile):
+    """
+    GCS-style resumable uploads: POST opens a session and returns its URL in
+    Location; each PUT carries `Content-Range: bytes a-b/total` (total may be
+    `*` until the last chunk). Incomplete uploads answer 308 with the
+    committed Range; `bytes */total` with an empty body queries progress.
+    Only sizes and a running MD5 are kept, never the data.
+    """
+    app = FastAPI()
+    settings = profile["gcs"]["chunk"]
+    sessions = {}
+
+    @app.post("/upload/storage/v1/b/{bucket}/o")
+    async def open_session(bucket: str, request: Request, name: str = "object"):
+        session_id = uuid.uuid4().hex
+        sessions[session_id] = {"bucket": bucket, "name": name, "received": 0, "md5": hashlib.md5(), "done": False}
+        location = f"{request.base_url}upload/resumable/{session_id}"
+        return Response(status_code=200, headers={"Location": location})
+
+    @app.put("/upload/resumable/{session_id}")
+    async def put_chunk(session_id: str, request: Request):
+        session = sessions.get(session_id)
+        if session is None:
+            return JSONResponse({"detail": "no such session"}, status_code=404)
+        failure = await behave(settings)
+        if failure:
+            # Drain the body so the client sees the error, not a reset
+            async for _ in request.stream():
+                pass
+            return JSONResponse({"detail": "stub failure"}, status_code=503)
+
+        content_range = request.headers.get("content-range", "")
+        unit, _, spec = content_range.partition(" ")
+        span, _, total = spec.partition("/")
+
+        if span != "*":
+            start = int(span.split("-")[0])
+            if start != session["received"]:
+                return _progress(session, status=400)
+            async for chunk in request.stream():
+                session["md5"].update(chunk)
+                session["received"] += len(chunk)
+
+        if total != "*" and session["received"] == int(total):
+            session["done"] = True
+            return {
+                "bucket": session["bucket"],
+                "name": session["name"],
+                "size": str(session["received"]),
+                "md5Hash": base64.b64encode(session["md5"].digest()).decode(),
+            }
+        return _progress(session)
+
+    return app
+
+
+def _progress(session, status=308):
+    headers = {}
+    if session["received"]:
+        headers["Range"] = f"bytes=0-{session['received'] - 1}"
+    return Response(status_code=status, headers=headers)
+
+
+APPS = {"auth": auth_app, "search": search_app, "upload": upload_app, "video": video_app, "gcs": gcs_app}
+
+
+async def serve(port, profile):
+    import uvicorn
+
+    servers = [
+        uvicorn.Server(uvicorn.Config(APPS[name](profile), host="127.0.0.1", port=port + i, log_level="warning"))
+        for i, name in enumerate(SERVICES)
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub downstream services for benchmarks")
+    parser.add_argument("--port", type=int, default=9100, help="first port (auth); the others follow")
+    parser.add_argument("--profile", help="JSON file overriding DEFAULT_PROFILE per service/route")
+    args = parser.parse_args()
+    asyncio.run(serve(args.port, load_profile(args.profile)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,60 @@
 # main.py  — Composite Microservice (delegator/orchestrator)
 
+import time
+
+_BOOT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
-import os
+from fastapi.responses import PlainTextResponse
+
+# Reads .env and validates every setting once, before anything else is imported
+from utils.settings import get_settings
+
+settings = get_settings()
+
+from utils import http_client, circuit_breaker, metrics, log, compression, tracing, profiling
+
+logger = log.get_logger("main")
+
+# Boot phases in ms, reported by /healthz against STARTUP_BUDGET_MS
+startup_report = {"budget_ms": settings.startup_budget_ms}
 
-env_path = os.path.join(os.path.dirname(__file__), ".env")
-load_dotenv(dotenv_path=env_path)
 
-print(f"[DEBUG] Loaded AUTH_SERVICE_URL = {os.getenv('AUTH_SERVICE_URL')}")
-print(f"[DEBUG] Loaded SEARCH_SERVICE_URL = {os.getenv('SEARCH_SERVICE_URL')}")
-print(f"[DEBUG] Loaded UPLOAD_SERVICE_URL = {os.getenv('UPLOAD_SERVICE_URL')}")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log.setup_logging()
+    tracing.setup_tracing()
 
-app = FastAPI(title="Composite Service", version="1.0.0")
+    # Open the pooled downstream clients once, close them on shutdown
+    started = time.perf_counter()
+    warmed = await http_client.startup()
+    if settings.auth_service_url:
+        prof_index.start()
+    if warmed is not None:
+        startup_report["prewarm_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        startup_report["prewarmed"] = warmed
+
+    total = round((time.perf_counter() - _BOOT_STARTED) * 1000, 1)
+    startup_report["total_ms"] = total
+    startup_report["within_budget"] = total <= settings.startup_budget_ms
+    logger.info(
+        "Started in %.1fms (budget %.0fms), downstreams %s",
+        total, settings.startup_budget_ms,
+        {service: http_client.service_url(service) for service in http_client.SERVICES},
+    )
+    if not startup_report["within_budget"]:
+        logger.warning("Startup over budget: %s", startup_report)
+
+    yield
+    await prof_index.stop()
+    await http_client.shutdown()
+    tracing.shutdown_tracing()
+    log.shutdown_logging()
+
+
+app = FastAPI(title="Composite Service", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,13 +63,26 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+if profiling.enabled():
+    # Inside the tracing middleware, so it sees every span of the request
+    app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(log.RequestContextMiddleware)
 
 from resources.video_resource import router as video_router
-from resources.auth_resource import router as auth_router
+from resources.auth_resource import router as auth_router, prof_index
 from resources.upload_resource import router as upload_router
+from resources.admin_resource import router as admin_router
+from resources.dashboard_resource import router as dashboard_router
 app.include_router(video_router)
 app.include_router(auth_router)
 app.include_router(upload_router)
+app.include_router(dashboard_router)
+app.include_router(admin_router)
+
+startup_report["import_ms"] = round((time.perf_counter() - _BOOT_STARTED) * 1000, 1)
 
 @app.get("/")
 def root():
@@ -35,4 +90,15 @@ def root():
 
 @app.get("/healthz")
 def health():
-    return {"ok": True}
+    downstreams = circuit_breaker.snapshot()
+    return {
+        "ok": True,
+        "degraded": [name for name, state in downstreams.items() if state.get("state", "closed") != "closed"],
+        "downstreams": downstreams,
+        "startup": startup_report,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
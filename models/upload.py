@@ -1,5 +1,31 @@
-from pydantic import BaseModel
+import base64
+import binascii
+from typing import Optional
+from pydantic import BaseModel, Field, field_validator
 class VideoUpload(BaseModel):
     offering_id: int
     prof_uni: str
-    videoTitle: str
\ No newline at end of file
+    videoTitle: str
+
+
+class UploadSessionRequest(BaseModel):
+    offering_id: int
+    prof_uni: str
+    videoTitle: str
+    size: int = Field(gt=0)
+    content_type: str = "video/mp4"
+    # Base64 MD5 of the whole file; checked against the stored object's md5Hash
+    md5: Optional[str] = None
+
+    @field_validator("md5")
+    @classmethod
+    def _md5(cls, value):
+        if value is None:
+            return value
+        try:
+            digest = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            digest = b""
+        if len(digest) != 16:
+            raise ValueError("md5 must be the base64 encoding of a 16-byte MD5 digest")
+        return value
\ No newline at end of file
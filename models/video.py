@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 
 class Video(BaseModel):
@@ -15,3 +15,7 @@ class Video(BaseModel):
     semester: Optional[str] = None
     year: Optional[int] = None
     section: Optional[int] = None
+
+
+class VideoBatchRequest(BaseModel):
+    video_ids: List[str]
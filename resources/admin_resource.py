@@ -0,0 +1,114 @@
+from fastapi import APIRouter, Depends, Header, Query, HTTPException
+from fastapi.responses import PlainTextResponse
+from utils import cache, http_client, profiling, retry
+from utils.settings import Settings, get_settings
+from resources.auth_resource import prof_index
+
+router = APIRouter()
+
+
+def require_admin(x_admin_token: str = Header(None), settings: Settings = Depends(get_settings)):
+    """
+    Guards operational endpoints with the shared ADMIN_TOKEN.
+    Admin endpoints are disabled entirely when ADMIN_TOKEN is not set.
+    """
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints disabled (ADMIN_TOKEN not set)")
+    if not settings.is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.get("/admin/caches", dependencies=[Depends(require_admin)])
+async def cache_stats():
+    """
+    Hit/miss/eviction counters for every in-process cache.
+    """
+    return cache.all_stats()
+
+
+@router.post("/admin/cache/purge", dependencies=[Depends(require_admin)])
+async def purge_cache(name: str = Query("catalog"), prefix: str = Query(None)):
+    """
+    Purges a cache (default: the catalog response cache), optionally only
+    the keys starting with `prefix` (e.g. prefix=prof_offer:).
+    """
+    target = cache.get_cache(name)
+    if target is None:
+        raise HTTPException(status_code=404, detail=f"Unknown cache '{name}'")
+    return {"cache": name, "purged": target.purge(prefix)}
+
+
+@router.get("/admin/coalescing", dependencies=[Depends(require_admin)])
+async def coalescing_stats():
+    """
+    How many downstream GETs were collapsed into an already in-flight call.
+    """
+    return http_client.coalescer.stats()
+
+
+@router.get("/admin/retries", dependencies=[Depends(require_admin)])
+async def retry_stats():
+    """
+    Retry budget balance plus retry / hedge counters.
+    """
+    return retry.budget.stats()
+
+
+@router.post("/admin/profile/arm", dependencies=[Depends(require_admin)])
+async def arm_profile(path: str = Query(...), count: int = Query(1, ge=1, le=100)):
+    """
+    Profiles the next `count` requests whose path starts with `path`.
+    """
+    profiling.require_profiling()
+    return {"armed": profiling.arm(path, count)}
+
+
+@router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """
+    Recent per-request profiles, newest last, without their reports.
+    """
+    profiling.require_profiling()
+    return [
+        {k: v for k, v in entry.items() if k != "report"}
+        for entry in profiling.profiles.values()
+    ]
+
+
+@router.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """
+    One cProfile report, sorted by cumulative time.
+    """
+    profiling.require_profiling()
+    entry = profiling.profiles.get(profile_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Unknown profile '{profile_id}'")
+    return PlainTextResponse(entry["report"])
+
+
+@router.post("/admin/profile/sample", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def sample_stacks(seconds: float = Query(10, gt=0), interval_ms: float = Query(None, gt=0)):
+    """
+    Samples the event loop for `seconds` and returns collapsed stacks, one
+    "frame;frame;frame count" line per distinct stack (flamegraph.pl input).
+    """
+    profiling.require_profiling()
+    sampler = await profiling.sample(seconds, interval_ms)
+    return PlainTextResponse(sampler.collapsed(), headers={"X-Samples": str(sampler.samples)})
+
+
+@router.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def slow_requests():
+    """
+    Timing breakdowns of recent requests over SLOW_REQUEST_MS.
+    """
+    return {"threshold_ms": profiling.SLOW_REQUEST_MS or None, "items": list(profiling.slow_requests)}
+
+
+@router.get("/admin/prof-index", dependencies=[Depends(require_admin)])
+async def prof_index_stats():
+    """
+    Size and age of the /profs/suggest index.
+    """
+    return prof_index.stats()
@@ -1,25 +1,36 @@
-from fastapi import APIRouter, Header, Query, HTTPException
-from utils.auth import verify_token
-import requests
-import os
+from fastapi import APIRouter, Depends, Header, Query, HTTPException, Request, Response
+from utils import http_client
+from utils.response_cache import catalog_cache, route_ttl
+from utils.etag import Representation, conditional_response, cache_control
+from utils.log import get_logger, summarize
+from utils.cache import make_cache
+from utils.settings import Settings, get_settings
+from utils.prof_index import ProfIndex
+import httpx
 import json
 from models.auth import SignupRequest, LoginRequest, UserDetailsRequest, UpdateRoleRequest
 
 router = APIRouter()
+logger = get_logger("auth")
 
-AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL")
+# Users (and their role) by UNI, for the faculty check on uploads.
+# Invalidated by /auth/update-role; concurrent lookups of one UNI share a call
+# (across workers too when the cache backend is shared).
+USER_CACHE_TTL = get_settings().user_cache_ttl
+user_cache = make_cache("users", max_entries=get_settings().user_cache_size, default_ttl=USER_CACHE_TTL)
 
 
 @router.post("/auth/signup")
-def signup_user(
-    user: SignupRequest
+async def signup_user(
+    user: SignupRequest,
+    settings: Settings = Depends(get_settings),
 ):
     """
     Composite layer Auth endpoint.
     request forwarded to Auth Microservice.
     """
 
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
     body = {
@@ -30,10 +41,9 @@ def signup_user(
     }
     try:
         # Call Search Microservice
-        res = requests.post(
-            f"{AUTH_SERVICE_URL}/auth/signup",
+        res = await http_client.request(
+            "auth", "POST", "/auth/signup",
             json=body,
-            timeout=5
         )
 
         if res.status_code != 200:
@@ -56,21 +66,21 @@ def signup_user(
             )
         return res.json()
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Auth microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Auth microservice unavailable")
 
 
 @router.post("/auth/login")
-def login_user(user: LoginRequest):
+async def login_user(user: LoginRequest, settings: Settings = Depends(get_settings)):
     """
     Composite layer Auth endpoint.
     request forwarded to Auth Microservice.
     """
 
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
     body = {
@@ -79,45 +89,43 @@ def login_user(user: LoginRequest):
     }
     try:
         # Call Search Microservice
-        res = requests.post(
-            f"{AUTH_SERVICE_URL}/auth/login",
+        res = await http_client.request(
+            "auth", "POST", "/auth/login",
             json=body,
-            timeout=5
         )
         if res.status_code != 200:
             raise HTTPException(status_code=res.status_code, detail="Login Failed")
-        print(res.json())
+        logger.debug("Login response: %s", summarize(res))
         return res.json()
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Auth microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Auth microservice unavailable")
 
 @router.post("/auth/handle-oauth")
-def handle_oauth(
-    authorization: str = Header(None)
+async def handle_oauth(
+    authorization: str = Header(None),
+    settings: Settings = Depends(get_settings),
 ):
     """
     Composite layer Auth endpoint.
     request forwarded to Auth Microservice.
     """
-    print(f"[DEBUG] Received Authorization header:{AUTH_SERVICE_URL}")
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
     
     try:
         # Call Search Microservice
-        res = requests.post(
-            f"{AUTH_SERVICE_URL}/auth/handle-oauth",
+        res = await http_client.request(
+            "auth", "POST", "/auth/handle-oauth",
             headers={"Authorization": authorization},
-            timeout=5
         )
 
         if res.status_code != 200 and res.status_code != 201:
-            print(f"[DEBUG] OAuth handling failed with status: {res.status_code == 201}")
+            logger.info("OAuth handling failed with status %s", res.status_code)
             # 2. Extract the response text (which should be the Auth Service's JSON error)
             error_text = res.text 
             
@@ -134,18 +142,19 @@ def handle_oauth(
                 status_code=res.status_code,
                 detail=error_detail.get("detail", "Unknown error during user google oauth.")
             )
-        print(res.json())
+        logger.debug("OAuth response: %s", summarize(res))
         return res.json()
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Auth microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Auth microservice unavailable")
 
 @router.put("/auth/update-role")
-def update_role(
-    user: UpdateRoleRequest
+async def update_role(
+    user: UpdateRoleRequest,
+    settings: Settings = Depends(get_settings),
 ):
    
     """
@@ -153,7 +162,7 @@ def update_role(
     request forwarded to Auth Microservice.
     """
 
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
     body = {
@@ -162,75 +171,185 @@ def update_role(
     }
     try:
         # Call Search Microservice
-        res = requests.put(
-            f"{AUTH_SERVICE_URL}/auth/update-role",
+        res = await http_client.request(
+            "auth", "PUT", "/auth/update-role",
             json=body,
-            timeout=5
         )
 
-        
+        if res.status_code == 200:
+            invalidate_user(email=user.email)
+
         return res.json()
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Auth microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Auth microservice unavailable")
 
 
 @router.get("/auth/get-user")
-def get_user(user: UserDetailsRequest):
+async def get_user(user: UserDetailsRequest, settings: Settings = Depends(get_settings)):
     """
     Composite layer Auth endpoint.
     request forwarded to Auth Microservice.
     """
 
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
     body = {
-        uni: user.uni
+        "uni": user.uni
     }
     try:
         # Call Search Microservice
-        res = requests.post(
-            f"{AUTH_SERVICE_URL}/auth/get-user",
+        res = await http_client.request(
+            "auth", "POST", "/auth/get-user",
             json=body,
-            timeout=5
         )
 
         
         return res.json()
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Auth microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Auth microservice unavailable")
 
 
+async def fetch_user(uni):
+    """
+    Looks a user up by UNI in the Auth Microservice.
+    Returns the user dict, or raises HTTPException (404 if the UNI is unknown).
+    """
+    if not get_settings().auth_service_url:
+        raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
+
+    try:
+        res = await http_client.request(
+            "auth", "GET", "/auth/get-user",
+            params={"uni": uni},
+        )
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Auth microservice timeout during user check.")
+    except httpx.TransportError:
+        raise HTTPException(status_code=503, detail="Auth microservice unavailable.")
+
+    if res.status_code == 404:
+        raise HTTPException(status_code=404, detail=f"UNI '{uni}' not found in authentication system.")
+    if res.status_code != 200:
+        raise HTTPException(status_code=500, detail=f"Auth Service error: {res.text}")
+
+    user_list = res.json().get("user")
+    if not isinstance(user_list, list):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Auth Service returned an invalid or missing 'user' list for UNI '{uni}'.",
+        )
+    if len(user_list) == 0:
+        raise HTTPException(status_code=404, detail=f"UNI '{uni}' not found in authentication system.")
+
+    return user_list[0]
+
+
+async def get_cached_user(uni):
+    """
+    fetch_user() behind the per-UNI user cache (USER_CACHE_TTL seconds).
+    """
+    async def lookup():
+        user = await fetch_user(uni)
+        if user.get("email"):
+            # Lets a role update (keyed by email) find the entry in any worker
+            user_cache.set(f"email:{user['email'].lower()}", uni)
+        return user
+
+    return await user_cache.get_or_compute(uni, lookup)
+
+
+def invalidate_user(uni=None, email=None):
+    """
+    Drops a cached user after their role changed. Role updates are keyed by
+    email; if the email was never seen, the whole cache is dropped to be safe.
+    """
+    if email is not None:
+        uni = user_cache.get(f"email:{email.lower()}")
+        user_cache.delete(f"email:{email.lower()}")
+        if uni is None:
+            user_cache.clear()
+            return
+    if uni is not None:
+        user_cache.delete(uni)
+
+
+async def _fetch_profs(previous=None):
+    """
+    Fetches the faculty list as a Representation, revalidating `previous`
+    with If-None-Match when the Auth service gave an ETag.
+    """
+    headers = None
+    if previous is not None and previous.upstream_etag:
+        headers = {"If-None-Match": previous.upstream_etag}
+
+    res = await http_client.request(
+        "auth", "GET", "/auth/get-profs",
+        priority=http_client.PRIORITY_LOW, headers=headers,
+    )
+    if res.status_code == 304 and previous is not None:
+        return previous
+    if res.status_code != 200:
+        raise HTTPException(status_code=res.status_code, detail=res.text)
+    return Representation(res.json(), upstream_etag=res.headers.get("etag"))
+
+
 @router.get("/auth/get-profs")
-def get_profs():
+async def get_profs(request: Request, settings: Settings = Depends(get_settings)):
     """
     Composite layer Auth endpoint.
-    request forwarded to Auth Microservice.
+    request forwarded to Auth Microservice (cached, see utils/response_cache).
     """
 
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
-    
     try:
-        res = requests.get(
-            f"{AUTH_SERVICE_URL}/auth/get-profs",
-            timeout=5
-        )
+        representation = await catalog_cache.get_or_fetch("profs", _fetch_profs, ttl=route_ttl("profs"))
+        return conditional_response(request, representation, "profs")
 
-        
-        return res.json()
-
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Auth microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Auth microservice unavailable")
+
+
+async def _load_profs(previous_etag):
+    """
+    Faculty list for the professor index, through the same catalog cache as
+    /auth/get-profs; (etag, None) when it has not changed.
+    """
+    representation = await catalog_cache.get_or_fetch("profs", _fetch_profs, ttl=route_ttl("profs"))
+    if representation.etag == previous_etag:
+        return previous_etag, None
+    data = representation.data
+    profs = data.get("profs", []) if isinstance(data, dict) else data
+    return representation.etag, profs
+
+
+# In-memory typeahead index, refreshed in the background (started by main.py)
+prof_index = ProfIndex(_load_profs)
+
+
+@router.get("/profs/suggest")
+async def suggest_profs(
+    response: Response,
+    prefix: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+):
+    """
+    Professors whose UNI, name or email starts with `prefix`, best match
+    first. Served from the in-memory index, never from the Auth service.
+    """
+    items = prof_index.suggest(prefix, limit)
+    response.headers["Cache-Control"] = cache_control("prof_suggest")
+    return {"prefix": prefix, "items": items}
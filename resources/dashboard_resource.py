@@ -0,0 +1,65 @@
+from fastapi import APIRouter, Depends, HTTPException
+from utils.auth import verify_token
+from utils.log import get_logger
+from utils.settings import get_settings
+from resources.auth_resource import get_cached_user
+from resources.upload_resource import load_prof_offers
+from resources.video_resource import search_videos
+import asyncio
+
+router = APIRouter()
+logger = get_logger("dashboard")
+
+# Per-section time limits (seconds); a section that misses its limit is reported
+# in "errors" and the rest of the dashboard is still returned.
+DASHBOARD_USER_TIMEOUT = get_settings().dashboard_user_timeout
+DASHBOARD_OFFERINGS_TIMEOUT = get_settings().dashboard_offerings_timeout
+DASHBOARD_VIDEOS_TIMEOUT = get_settings().dashboard_videos_timeout
+DASHBOARD_VIDEOS_LIMIT = get_settings().dashboard_videos_limit
+
+
+async def _section(coro, timeout):
+    """
+    Runs one dashboard section. Returns (data, error) instead of raising;
+    unexpected failures are logged and reported as a 502.
+    """
+    try:
+        return await asyncio.wait_for(coro, timeout), None
+    except asyncio.TimeoutError:
+        return None, {"status": 504, "detail": f"Section timed out after {timeout}s"}
+    except HTTPException as e:
+        return None, {"status": e.status_code, "detail": e.detail}
+    except Exception as e:
+        logger.exception("Dashboard section failed: %r", e)
+        return None, {"status": 502, "detail": "Section failed"}
+
+
+async def _offerings_data(prof_uni):
+    return (await load_prof_offers(prof_uni)).data
+
+
+@router.get("/dashboard/prof/{prof_uni}")
+async def get_prof_dashboard(prof_uni: str, user=Depends(verify_token)):
+    """
+    Everything a professor page needs in one call: the Auth user record,
+    the professor's offerings (same shape as /prof_offer/{prof_uni}) and their
+    videos (same shape as /videos/search?prof=...), fetched concurrently.
+    """
+
+    sections = {
+        "user": _section(get_cached_user(prof_uni), DASHBOARD_USER_TIMEOUT),
+        "offerings": _section(_offerings_data(prof_uni), DASHBOARD_OFFERINGS_TIMEOUT),
+        "videos": _section(
+            search_videos(prof=prof_uni, limit=DASHBOARD_VIDEOS_LIMIT, offset=0, user=user),
+            DASHBOARD_VIDEOS_TIMEOUT,
+        ),
+    }
+    results = await asyncio.gather(*sections.values())
+
+    dashboard = {"prof_uni": prof_uni, "errors": {}}
+    for name, (data, error) in zip(sections, results):
+        dashboard[name] = data
+        if error is not None:
+            dashboard["errors"][name] = error
+
+    return dashboard
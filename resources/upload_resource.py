@@ -1,18 +1,28 @@
-from fastapi import APIRouter, Depends, Query, HTTPException, Form, status
-# from utils.auth import verify_token
-import requests
-import os
-from models.upload import VideoUpload
+from fastapi import APIRouter, Depends, Query, HTTPException, Form, Request, status
+from starlette.requests import ClientDisconnect
+from utils.auth import verify_token
+from utils import http_client, resumable
+from utils.cache import make_cache
+from utils.response_cache import catalog_cache, route_ttl
+from utils.etag import Representation, conditional_response
+from utils.log import get_logger, summarize
+from utils.settings import Settings, get_settings
+from resources.auth_resource import get_cached_user
+import asyncio
+import httpx
+import time
+import uuid
+from models.upload import VideoUpload, UploadSessionRequest
 
 router = APIRouter()
+logger = get_logger("upload")
 
-UPLOAD_SERVICE_URL = os.getenv("UPLOAD_SERVICE_URL")
-AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL")
 
 @router.post("/start_upload")
 async def upload_video(
     # file: UploadFile,
-    uploadBody: VideoUpload
+    uploadBody: VideoUpload,
+    settings: Settings = Depends(get_settings),
 ):
     """
     Composite layer Upload endpoint.
@@ -21,73 +31,28 @@ async def upload_video(
     prof_uni = uploadBody.prof_uni
     offering_id = uploadBody.offering_id
     videoTitle = uploadBody.videoTitle
-    if not UPLOAD_SERVICE_URL:
+    if not settings.upload_service_url:
         raise HTTPException(status_code=500, detail="UPLOAD_SERVICE_URL not set")
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
-    # Checking if user is in Users Table (FK constraint in Upload Microservice)
-    bodyUni = {
-        'uni': prof_uni
-    }
-    user_data = None
-
+    # Checking if user is in Users Table (FK constraint in Upload Microservice).
+    # Served from the per-UNI user cache, so repeat uploads skip the Auth round-trip.
     try:
-        auth_res = requests.get(
-            f"{AUTH_SERVICE_URL}/auth/get-user",
-            params=bodyUni,
-            timeout=5
-        )
-        auth_res.raise_for_status()
-        
-        # 1b. Parse response into Pydantic Model for strict access
-        user_data_wrapper = auth_res.json() # Renamed to avoid immediate collision
-
-        # 1b. Validate the structure and content
-        user_list = user_data_wrapper.get("user")
-
-        # 1. Check if 'user' key is missing, or is not a list
-        if not user_list or not isinstance(user_list, list):
-            # This covers cases where the key might be missing, or the value is None/unexpected type
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Auth Service returned an invalid or missing 'user' list for UNI '{prof_uni}'. Response: {user_data_wrapper}"
-            )
-
-        # 2. Check if the 'user' list is empty (no result found)
-        if len(user_list) == 0:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Professor UNI '{prof_uni}' not found in authentication system."
-            )
-
-        # 3. If all checks pass, assign the first element (the user object)
-        # Assuming the query logic guarantees only one result per UNI
-        user_data = user_list[0]
-        # 2. AUTHORIZATION CHECK: Ensure the user is faculty
-        if user_data.get('role') != 'faculty':
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"User '{prof_uni}' is registered as '{user_data.role}' and is not authorized to upload videos. Only 'faculty' users are allowed."
-            )
-        print(f"[DEBUG] Retrieved user data: {user_data}")
-        
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="Auth microservice timeout during user check.")
-    except requests.exceptions.ConnectionError:
-        raise HTTPException(status_code=503, detail="Auth microservice unavailable.")
-    except requests.exceptions.HTTPError as e:
-        # User not found (404) or general Auth error
-        if e.response.status_code == status.HTTP_404_NOT_FOUND:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Professor UNI '{prof_uni}' not found in authentication system.")
-        raise HTTPException(status_code=500, detail=f"Auth Service error: {e.response.text}")
+        user_data = await get_cached_user(prof_uni)
+    except HTTPException:
+        raise
     except Exception as e:
         # General JSON parsing error or unexpected failure
         raise HTTPException(status_code=500, detail=f"Internal error during user validation: {str(e)}")
 
-    
-
-
+    # AUTHORIZATION CHECK: Ensure the user is faculty
+    if user_data.get('role') != 'faculty':
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"User '{prof_uni}' is registered as '{user_data.get('role')}' and is not authorized to upload videos. Only 'faculty' users are allowed."
+        )
+    logger.debug("Retrieved user data: %s", summarize(user_data))
 
     body = {
         "offering_id": offering_id,
@@ -96,104 +61,376 @@ async def upload_video(
     }
     try:
         # Call Search Microservice
-        res = requests.post(
-            f"{UPLOAD_SERVICE_URL}/videos/start_upload",
+        res = await http_client.request(
+            "upload", "POST", "/videos/start_upload",
             json=body,
-            timeout=5
         )
-        print(f"[DEBUG] Upload response: {res.json()}")
-        
+        logger.debug("Upload response %s: %s", res.status_code, summarize(res))
+        if res.status_code in (200, 201):
+            # The professor's offerings listing is cached; drop it so the new upload shows up
+            catalog_cache.invalidate(f"prof_offer:{prof_uni}")
+
         return res.json()
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Upload microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Upload microservice unavailable")
 
 
+async def _fetch_catalog(path, previous=None, route=None):
+    """
+    Fetches a catalog listing from the Upload Microservice as a Representation.
+    Revalidates `previous` with If-None-Match when the upstream gave an ETag.
+    Raises on non-200 so failures are never cached.
+    """
+    headers = None
+    if previous is not None and previous.upstream_etag:
+        headers = {"If-None-Match": previous.upstream_etag}
+
+    res = await http_client.request(
+        "upload", "POST", path,
+        route=route, priority=http_client.PRIORITY_LOW, headers=headers,
+    )
+    if res.status_code == 304 and previous is not None:
+        return previous
+    if res.status_code != 200:
+        raise HTTPException(status_code=res.status_code, detail=res.text)
+    return Representation(res.json(), upstream_etag=res.headers.get("etag"))
+
+
 @router.get("/offerings")
-async def get_offerings():
+async def get_offerings(request: Request, settings: Settings = Depends(get_settings)):
     """
     Composite layer Upload endpoint.
-    request forwarded to Upload Microservice.
+    request forwarded to Upload Microservice (cached, see utils/response_cache).
     """
 
-    if not UPLOAD_SERVICE_URL:
+    if not settings.upload_service_url:
         raise HTTPException(status_code=500, detail="UPLOAD_SERVICE_URL not set")
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
-    print(f"{UPLOAD_SERVICE_URL}/videos/offer")
     try:
-        # Call Search Microservice
-        res = requests.post(
-            f"{UPLOAD_SERVICE_URL}/videos/offer",
-            timeout=5
+        # Call Upload Microservice
+        representation = await catalog_cache.get_or_fetch(
+            "offerings",
+            lambda previous: _fetch_catalog("/videos/offer", previous),
+            ttl=route_ttl("offerings"),
         )
+        return conditional_response(request, representation, "offerings")
 
-        print(f"[DEBUG] Offerings response: {res.json()}")
-        return res.json()
-
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Upload microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Upload microservice unavailable")
 
 
 @router.get("/courses")
-async def get_courses():
+async def get_courses(request: Request, settings: Settings = Depends(get_settings)):
     """
     Composite layer Upload endpoint.
-    request forwarded to Upload Microservice.
+    request forwarded to Upload Microservice (cached, see utils/response_cache).
     """
 
-    if not UPLOAD_SERVICE_URL:
+    if not settings.upload_service_url:
         raise HTTPException(status_code=500, detail="UPLOAD_SERVICE_URL not set")
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
-    print(f"{UPLOAD_SERVICE_URL}/videos/courses")
     try:
         # Call Upload Microservice
-        res = requests.post(
-            f"{UPLOAD_SERVICE_URL}/videos/courses",
-            timeout=5
+        representation = await catalog_cache.get_or_fetch(
+            "courses",
+            lambda previous: _fetch_catalog("/videos/courses", previous),
+            ttl=route_ttl("courses"),
         )
+        return conditional_response(request, representation, "courses")
 
-        print(f"[DEBUG] Courses response: {res.json()}")
-        return res.json()
-
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Upload microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Upload microservice unavailable")
 
 
-@router.get("/prof_offer/{prof_uni}")
-async def get_prof_offers(prof_uni: str):
+async def load_prof_offers(prof_uni, settings=None):
     """
-    Composite layer Upload endpoint.
-    request forwarded to Upload Microservice.
+    The professor's offerings as a cached Representation
+    (invalidated by /start_upload). Shared with the professor dashboard.
     """
+    settings = settings or get_settings()
 
-    if not UPLOAD_SERVICE_URL:
+    if not settings.upload_service_url:
         raise HTTPException(status_code=500, detail="UPLOAD_SERVICE_URL not set")
-    if not AUTH_SERVICE_URL:
+    if not settings.auth_service_url:
         raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
-    print(f"{UPLOAD_SERVICE_URL}/videos/prof_offer")
     try:
         # Call Upload Microservice
-        res = requests.post(
-            f"{UPLOAD_SERVICE_URL}/videos/prof_offer/{prof_uni}",
-            timeout=5
+        return await catalog_cache.get_or_fetch(
+            f"prof_offer:{prof_uni}",
+            lambda previous: _fetch_catalog(
+                f"/videos/prof_offer/{prof_uni}", previous, route="/videos/prof_offer/{prof_uni}"
+            ),
+            ttl=route_ttl("prof_offer"),
         )
 
-        print(f"[DEBUG] Prof Offers response: {res.json()}")
-        return res.json()
-
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Upload microservice timeout")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
+        raise HTTPException(status_code=503, detail="Upload microservice unavailable")
+
+
+@router.get("/prof_offer/{prof_uni}")
+async def get_prof_offers(prof_uni: str, request: Request, settings: Settings = Depends(get_settings)):
+    """
+    Composite layer Upload endpoint.
+    request forwarded to Upload Microservice (cached, invalidated by /start_upload).
+    """
+    representation = await load_prof_offers(prof_uni, settings)
+    return conditional_response(request, representation, "prof_offer")
+
+
+# ---------------------------------------------------------
+# Streaming chunked uploads
+# ---------------------------------------------------------
+# POST /uploads checks the faculty role once, registers the video with the
+# Upload service and opens a resumable session (the `upload_url` the Upload
+# service returns, else a GCS session on GCS_BUCKET_NAME). PUT /uploads/{id}
+# then streams the file through in fixed-size chunks (see utils/resumable)
+# and may be repeated from the returned offset to resume; GET reports
+# progress and the per-chunk checksums.
+#
+# Integrity: the client may declare the file's MD5 when opening the upload.
+# On completion it is compared with the md5Hash the target computed over the
+# stored object; a mismatch is answered with 422 and the upload is marked
+# `verified: false` so it is never treated as good.
+
+UPLOAD_MAX_BYTES = get_settings().upload_max_bytes
+UPLOAD_SESSION_TTL = get_settings().upload_session_ttl
+
+upload_sessions = make_cache("upload_sessions", max_entries=10000, default_ttl=UPLOAD_SESSION_TTL)
+_upload_locks = {}
+
+
+def _owner(user):
+    # Tokens are refreshed during long uploads; the uid is stable
+    return user.get("uid") or user.get("email")
+
+
+def _is_caller(user, prof_uni, user_data):
+    """
+    Whether the verified caller is the professor `prof_uni` (by uid, or by
+    the email the Auth service has on file for that UNI).
+    """
+    if user.get("uid") and user["uid"] == prof_uni:
+        return True
+    email = user_data.get("email")
+    return bool(email and user.get("email") and user["email"].lower() == email.lower())
+
+
+def _upload_offset(value, default):
+    """
+    Byte offset from an Upload-Offset header; 400 unless it is a plain
+    non-negative integer.
+    """
+    if value is None:
+        return default
+    value = value.strip()
+    if not (value.isascii() and value.isdigit()):
+        raise HTTPException(status_code=400, detail="Upload-Offset must be a non-negative integer")
+    return int(value)
+
+
+def _complete(session, result):
+    session["result"] = result
+    if result is not None:
+        session["verified"] = resumable.verify_result(result, session.get("md5"))
+
+
+def _check_verified(upload_id, session):
+    if session.get("verified") is False:
+        logger.error("Upload %s does not match its declared MD5: %s", upload_id, session["result"])
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "message": "Stored object does not match the declared md5",
+                "expected": session["md5"],
+                "actual": session["result"].get("md5Hash"),
+            },
+        )
+
+
+def _load_session(upload_id, user):
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired upload")
+    if session["owner"] != _owner(user):
+        raise HTTPException(status_code=403, detail="Upload belongs to another user")
+    return session
+
+
+def _status(upload_id, session):
+    return {
+        "upload_id": upload_id,
+        "size": session["size"],
+        "offset": session["offset"],
+        "complete": session["result"] is not None,
+        "chunk_size": resumable.UPLOAD_CHUNK_SIZE,
+        "chunks": session["chunks"],
+        "result": session["result"],
+        "verified": session.get("verified"),
+    }
+
+
+@router.post("/uploads", status_code=201)
+async def create_upload(
+    uploadBody: UploadSessionRequest,
+    user=Depends(verify_token),
+    settings: Settings = Depends(get_settings),
+):
+    """
+    Starts a streamed upload: faculty check, registration with the Upload
+    microservice, and a resumable session for the file bytes.
+    """
+    if not settings.upload_service_url:
+        raise HTTPException(status_code=500, detail="UPLOAD_SERVICE_URL not set")
+    if uploadBody.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {UPLOAD_MAX_BYTES} byte limit")
+
+    if user.get("role") != "faculty":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only 'faculty' users are allowed to upload videos."
+        )
+    user_data = await get_cached_user(uploadBody.prof_uni)
+    if user_data.get('role') != 'faculty':
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"User '{uploadBody.prof_uni}' is not authorized to upload videos. Only 'faculty' users are allowed."
+        )
+    if not _is_caller(user, uploadBody.prof_uni, user_data):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Uploads can only be started for yourself")
+
+    try:
+        res = await http_client.request(
+            "upload", "POST", "/videos/start_upload",
+            json={
+                "offering_id": uploadBody.offering_id,
+                "prof_uni": uploadBody.prof_uni,
+                "videoTitle": uploadBody.videoTitle,
+            },
+        )
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Upload microservice timeout")
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Upload microservice unavailable")
+    if res.status_code not in (200, 201):
+        raise HTTPException(status_code=res.status_code, detail=res.text)
+
+    registration = res.json()
+    upload_id = uuid.uuid4().hex
+    session_url = registration.get("upload_url")
+    # Only sessions opened here get GCS credentials on their chunk PUTs
+    gcs_opened = not session_url
+    if gcs_opened:
+        if not settings.gcs_bucket_name:
+            raise HTTPException(status_code=500, detail="GCS_BUCKET_NAME not set")
+        name = registration.get("gcs_path") or f"videos/{uploadBody.prof_uni}/{registration.get('video_id') or upload_id}"
+        session_url = await resumable.open_session(
+            settings.gcs_bucket_name, name, uploadBody.size, uploadBody.content_type
+        )
+
+    session = {
+        "owner": _owner(user),
+        "prof_uni": uploadBody.prof_uni,
+        "registration": registration,
+        "session_url": session_url,
+        "gcs_auth": gcs_opened,
+        "size": uploadBody.size,
+        "offset": 0,
+        "chunks": [],
+        "result": None,
+        "md5": uploadBody.md5,
+        "verified": None,
+    }
+    upload_sessions.set(upload_id, session)
+    return {**_status(upload_id, session), "location": f"/uploads/{upload_id}"}
+
+
+@router.put("/uploads/{upload_id}")
+async def put_upload(upload_id: str, request: Request, user=Depends(verify_token)):
+    """
+    Streams the request body into the upload from `Upload-Offset` (default:
+    the current offset). Memory use is one chunk, whatever the file size.
+    """
+    session = _load_session(upload_id, user)
+    if session["result"] is not None:
+        _check_verified(upload_id, session)
+        return _status(upload_id, session)
+
+    offset = _upload_offset(request.headers.get("upload-offset"), session["offset"])
+    if offset != session["offset"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Upload-Offset does not match the committed offset", "offset": session["offset"]},
+        )
+
+    lock = _upload_locks.setdefault(upload_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="Upload already in progress")
+
+    async def on_chunk(chunk_offset, length, checksum, result):
+        # Persisted after every chunk, so a dropped connection resumes here
+        session["offset"] = chunk_offset + length
+        session["chunks"].append({"offset": chunk_offset, "length": length, "md5": checksum})
+        _complete(session, result)
+        upload_sessions.set(upload_id, session)
+
+    async with lock:
+        started = time.perf_counter()
+        try:
+            await resumable.pipe(
+                session["session_url"], session["size"], offset, request.stream(), on_chunk,
+                authorized=session.get("gcs_auth", False),
+            )
+        except ClientDisconnect:
+            logger.info("Upload %s interrupted at %d bytes", upload_id, session["offset"])
+        finally:
+            _upload_locks.pop(upload_id, None)
+        elapsed = time.perf_counter() - started
+
+    sent = session["offset"] - offset
+    if sent and elapsed > 0:
+        resumable.UPLOAD_THROUGHPUT.observe(sent / elapsed)
+    _check_verified(upload_id, session)
+    if session["result"] is not None:
+        # The professor's offerings listing is cached; drop it so the new upload shows up
+        catalog_cache.invalidate(f"prof_offer:{session['prof_uni']}")
+
+    return {
+        **_status(upload_id, session),
+        "bytes": sent,
+        "seconds": round(elapsed, 3),
+        "throughput_bps": round(sent / elapsed) if elapsed > 0 else None,
+    }
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, sync: bool = Query(False), user=Depends(verify_token)):
+    """
+    Progress of a streamed upload. sync=true asks the upload target for the
+    committed offset first (e.g. after the composite restarted mid-chunk).
+    """
+    session = _load_session(upload_id, user)
+    if sync and session["result"] is None:
+        offset, result = await resumable.query_offset(
+            session["session_url"], session["size"], session.get("gcs_auth", False)
+        )
+        if offset != session["offset"] or result is not None:
+            session["offset"] = offset
+            _complete(session, result)
+            upload_sessions.set(upload_id, session)
+    _check_verified(upload_id, session)
+    return _status(upload_id, session)
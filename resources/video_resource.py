@@ -1,18 +1,51 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from utils.auth import verify_token
-import requests
-import os
+from utils import http_client
+from utils.cache import make_cache
+from utils.settings import Settings, get_settings
+from utils.etag import Representation, conditional_response, cache_control
+from utils.json_stream import LinksSplicer, fast_loads
+from utils.page_cache import search_pages, normalize_filters, encode_cursor, decode_cursor, SEARCH_PAGE_CACHE
+from utils.projection import compile_fields, PROJECTED
+from utils import metrics
+from models.video import VideoBatchRequest
+import asyncio
+import httpx
+from urllib.parse import quote
 
 router = APIRouter()
 
-SEARCH_SERVICE_URL = os.getenv("SEARCH_SERVICE_URL")
-VIDEO_COMPOSITE_URL = os.getenv("VIDEO_COMPOSITE_URL")
+# Batch fan-out limits for /videos/batch and /videos/search?include=metadata
+VIDEO_BATCH_MAX = get_settings().video_batch_max
+VIDEO_BATCH_CONCURRENCY = get_settings().video_batch_concurrency
+
+# Pass-through mode: stream the Search body to the client and splice our
+# "self" link in, instead of decoding and re-encoding the whole page
+SEARCH_PASSTHROUGH = get_settings().search_passthrough
+
+# The Search service understands fields= itself; otherwise projection is
+# done here, and pass-through is skipped for projected requests
+SEARCH_FIELDS_UPSTREAM = get_settings().search_fields_upstream
+
+SEARCH_STREAMED = metrics.Counter(
+    "search_passthrough_total", "Search responses streamed through.", ("spliced",)
+)
+
+# Last representation seen per (video, caller), used to revalidate upstream
+# with If-None-Match instead of re-downloading and re-encoding unchanged metadata
+video_validators = make_cache("video_validators", max_entries=4096, default_ttl=300)
+
+# Projected video bodies per (full representation ETag, field set), so a
+# repeated ?fields= request is neither re-projected nor re-encoded
+video_projections = make_cache("video_projections", max_entries=4096, default_ttl=300)
 
 # ---------------------------------------------------------
 # 1. SEARCH ENDPOINT
 # ---------------------------------------------------------
 @router.get("/videos/search")
-def search_videos_proxy(
+async def search_videos_proxy(
+    request: Request,
     q: str = Query(None),
     course_id: str = Query(None),
     offering_id: int = Query(None),
@@ -21,16 +54,51 @@ def search_videos_proxy(
     semester: str = Query(None),        # NEW
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    user=Depends(verify_token)
+    cursor: str = Query(None),          # opaque alternative to the filters + offset
+    include: str = Query(None),         # "metadata" inlines each video's metadata
+    fields: str = Query(None),          # comma list of item keys to return
+    user=Depends(verify_token),
+    settings: Settings = Depends(get_settings),
 ):
     """
     Composite layer search endpoint.
-    Supports q, course_id, offering_id, prof, year, semester, limit, offset.
+    Supports q, course_id, offering_id, prof, year, semester, limit, offset,
+    or a `cursor` taken from a previous page's next_cursor.
+    include=metadata also fetches every result's metadata in the same round-trip.
+    fields=video_id,title,... trims every item to those keys.
+    With SEARCH_PASSTHROUGH=1 the upstream body is streamed through instead.
     """
+    projection = compile_fields(fields)
+    if cursor is not None:
+        filters, offset, limit = decode_cursor(cursor)
+        q, course_id, offering_id, prof, year, semester = (
+            filters.get(name) for name in SEARCH_FILTERS
+        )
 
-    if not SEARCH_SERVICE_URL:
-        raise HTTPException(status_code=500, detail="SEARCH_SERVICE_URL not set")
+    if SEARCH_PASSTHROUGH and include != "metadata" and (projection is None or SEARCH_FIELDS_UPSTREAM):
+        params = _search_params(q, course_id, offering_id, prof, year, semester, limit, offset)
+        if projection is not None:
+            params["fields"] = projection.key
+        return await _stream_search(
+            request,
+            params,
+            _self_link(q, course_id, offering_id, prof, year, semester, limit, offset),
+            user,
+            settings,
+        )
+
+    flattened = await search_videos(
+        q=q, course_id=course_id, offering_id=offering_id, prof=prof,
+        year=year, semester=semester, limit=limit, offset=offset,
+        include=include, fields=fields, user=user, settings=settings,
+    )
+    return conditional_response(request, Representation(flattened), "search")
+
+
+SEARCH_FILTERS = ("q", "course_id", "offering_id", "prof", "year", "semester")
 
+
+def _search_params(q, course_id, offering_id, prof, year, semester, limit, offset):
     # Build downstream params
     params = {
         "q": q,
@@ -44,20 +112,124 @@ def search_videos_proxy(
     }
 
     # Drop None values
-    params = {k: v for k, v in params.items() if v is not None}
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def _self_link(q, course_id, offering_id, prof, year, semester, limit, offset):
+    return {
+        "rel": "self",
+        "href": (
+            f"/videos/search?"
+            f"q={q or ''}&"
+            f"course_id={course_id or ''}&"
+            f"offering_id={offering_id or ''}&"
+            f"prof={prof or ''}&"
+            f"year={year or ''}&"
+            f"semester={semester or ''}&"
+            f"limit={limit}&offset={offset}"
+        )
+    }
+
+
+async def _stream_search(request, params, link, user, settings):
+    """
+    Pass-through search: forwards the upstream body chunk by chunk with the
+    self link spliced into its "links" (see utils/json_stream). The body is
+    never decoded, so memory stays at one chunk plus a small tail.
+    If-None-Match is forwarded so the Search service can answer 304 itself.
+    """
+
+    if not settings.search_service_url:
+        raise HTTPException(status_code=500, detail="SEARCH_SERVICE_URL not set")
+
+    headers = {"Authorization": f"Bearer {user['token']}"}
+    if request.headers.get("if-none-match"):
+        headers["If-None-Match"] = request.headers["if-none-match"]
 
     try:
-        res = requests.get(
-            f"{SEARCH_SERVICE_URL}/search/videos",
+        upstream = await http_client.open_stream(
+            "search", "GET", "/search/videos",
             params=params,
-            headers={"Authorization": f"Bearer {user['token']}"},
-            timeout=5
+            headers=headers,
         )
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Search microservice timeout")
+    except httpx.TransportError:
+        raise HTTPException(status_code=503, detail="Search microservice unavailable")
 
-        if res.status_code != 200:
-            raise HTTPException(status_code=res.status_code, detail=res.text)
+    res = upstream.response
+    response_headers = {"Cache-Control": cache_control("search")}
+    if res.headers.get("etag"):
+        # Our body differs from the upstream bytes by the spliced link
+        etag = res.headers["etag"]
+        response_headers["ETag"] = etag if etag.startswith("W/") else f"W/{etag}"
+
+    if res.status_code == 304:
+        await upstream.aclose()
+        return Response(status_code=304, headers=response_headers)
+
+    if res.status_code != 200 or "json" not in res.headers.get("content-type", ""):
+        try:
+            detail = (await res.aread()).decode("utf-8", "replace")
+        finally:
+            await upstream.aclose()
+        raise HTTPException(status_code=res.status_code if res.status_code != 200 else 502, detail=detail)
+
+    splicer = LinksSplicer(link)
+
+    async def body():
+        try:
+            async for chunk in res.aiter_bytes():
+                out = splicer.feed(chunk)
+                if out:
+                    yield out
+            yield splicer.finish()
+            SEARCH_STREAMED.inc("true" if splicer.spliced else "false")
+        finally:
+            await upstream.aclose()
+
+    return StreamingResponse(body(), media_type="application/json", headers=response_headers)
 
-        data = res.json()
+
+async def search_videos(
+    q=None, course_id=None, offering_id=None, prof=None, year=None,
+    semester=None, limit=20, offset=0, include=None, fields=None, user=None,
+    settings=None,
+):
+    """
+    Runs a search against the Search microservice and returns the normalized
+    {items, page_size, offset, links, next_cursor} dict. Shared with the
+    professor dashboard. With SEARCH_PAGE_CACHE=1 pages are served from the
+    block page cache (without the upstream links); cached blocks hold whole
+    items and are projected per request.
+    """
+    settings = settings or get_settings()
+
+    if not settings.search_service_url:
+        raise HTTPException(status_code=500, detail="SEARCH_SERVICE_URL not set")
+
+    keep = ("metadata", "metadata_error") if include == "metadata" else ()
+    projection = compile_fields(fields, keep=keep)
+
+    filters = normalize_filters({
+        "q": q, "course_id": course_id, "offering_id": offering_id,
+        "prof": prof, "year": year, "semester": semester,
+    })
+
+    if SEARCH_PAGE_CACHE:
+        async def fetch_block(block_offset, block_size):
+            data = await _search_upstream({**filters, "limit": block_size, "offset": block_offset}, user)
+            return data.get("items", []) if isinstance(data, dict) else data
+
+        items, more = await search_pages.get_page(
+            filters, http_client.scope_hash(user["token"]), offset, limit, fetch_block
+        )
+        flattened = {"items": items, "page_size": len(items), "offset": offset, "links": []}
+    else:
+        params = _search_params(q, course_id, offering_id, prof, year, semester, limit, offset)
+        if projection is not None and SEARCH_FIELDS_UPSTREAM:
+            params["fields"] = projection.key
+        data = await _search_upstream(params, user)
 
         # Normalize output
         if isinstance(data, dict) and "items" in data:
@@ -69,54 +241,173 @@ def search_videos_proxy(
             }
         else:
             flattened = {"items": data, "links": []}
+        more = len(flattened["items"]) >= limit
 
-        flattened["links"].append({
-            "rel": "self",
-            "href": (
-                f"/videos/search?"
-                f"q={q or ''}&"
-                f"course_id={course_id or ''}&"
-                f"offering_id={offering_id or ''}&"
-                f"prof={prof or ''}&"
-                f"year={year or ''}&"
-                f"semester={semester or ''}&"
-                f"limit={limit}&offset={offset}"
-            )
-        })
-
-        return flattened
-
-    except requests.exceptions.Timeout:
+    flattened["links"].append(
+        _self_link(q, course_id, offering_id, prof, year, semester, limit, offset)
+    )
+    flattened["next_cursor"] = encode_cursor(filters, offset + limit, limit) if more else None
+    if flattened["next_cursor"]:
+        href = f"/videos/search?cursor={flattened['next_cursor']}"
+        if fields:
+            href += f"&fields={quote(fields, safe=',.')}"
+        flattened["links"].append({"rel": "next", "href": href})
+
+    if include == "metadata" and settings.video_composite_url:
+        # Copies: page items may be shared with the page cache
+        flattened["items"] = [dict(item) if isinstance(item, dict) else item for item in flattened["items"]]
+        items = [item for item in flattened["items"] if isinstance(item, dict) and item.get("video_id")]
+        results = await _fetch_videos([item["video_id"] for item in items], user["token"])
+        for item, result in zip(items, results):
+            if "data" in result:
+                item["metadata"] = result["data"]
+            else:
+                item["metadata_error"] = {"status": result["status"], "detail": result["error"]}
+
+    if projection is not None:
+        # New dicts, so cached page items are never modified
+        flattened["items"] = projection.apply_all(flattened["items"])
+        PROJECTED.inc("search")
+
+    return flattened
+
+
+async def _search_upstream(params, user):
+    """
+    One Search microservice query; returns the decoded body.
+    """
+    try:
+        res = await http_client.request(
+            "search", "GET", "/search/videos",
+            hedge=True,
+            params=params,
+            headers={"Authorization": f"Bearer {user['token']}"},
+        )
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Search microservice timeout")
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Search microservice unavailable")
 
+    if res.status_code != 200:
+        raise HTTPException(status_code=res.status_code, detail=res.text)
+    return fast_loads(res.content)
+
 
 # ---------------------------------------------------------
-# 2. GET SINGLE VIDEO METADATA
+# 2. VIDEO METADATA (single + batch)
 # ---------------------------------------------------------
-@router.get("/videos/{video_id}")
-def get_single_video(video_id: str, user=Depends(verify_token)):
+async def _fetch_video_representation(video_id, token):
     """
-    Fetch metadata for a single video.
+    Fetches one video's metadata from the video composite as a Representation,
+    revalidating the last copy this caller saw when the upstream sent an ETag.
+    Raises HTTPException on any failure.
     """
+    if not video_id or video_id in (".", ".."):
+        raise HTTPException(status_code=400, detail="Invalid video_id")
 
-    if not VIDEO_COMPOSITE_URL:
-        raise HTTPException(status_code=500, detail="VIDEO_COMPOSITE_URL not set")
+    validator_key = f"{video_id}:{http_client.scope_hash(token)}"
+    previous = video_validators.get(validator_key)
+    headers = {"Authorization": f"Bearer {token}"}
+    if previous is not None:
+        headers["If-None-Match"] = previous.upstream_etag
 
     try:
-        res = requests.get(
-            f"{VIDEO_COMPOSITE_URL}/videos/{video_id}",
-            headers={"Authorization": f"Bearer {user['token']}"},
-            timeout=5,
+        res = await http_client.request(
+            # Ids come from request bodies and search results too: one path segment only
+            "video", "GET", f"/videos/{quote(video_id, safe='')}",
+            route="/videos/{video_id}",
+            hedge=True,
+            headers=headers,
         )
 
+        if res.status_code == 304 and previous is not None:
+            return previous
+
         if res.status_code != 200:
             raise HTTPException(status_code=res.status_code, detail=res.text)
 
-        return res.json()
+        representation = Representation(res.json(), upstream_etag=res.headers.get("etag"))
+        if representation.upstream_etag:
+            video_validators.set(validator_key, representation)
+        return representation
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Video composite timeout")
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Video composite unavailable")
+
+
+async def _fetch_video(video_id, token):
+    return (await _fetch_video_representation(video_id, token)).data
+
+
+async def _fetch_videos(video_ids, token):
+    """
+    Fetches many videos concurrently (at most VIDEO_BATCH_CONCURRENCY at once).
+    Returns one result per id, in order; failures are reported per item.
+    """
+    semaphore = asyncio.Semaphore(VIDEO_BATCH_CONCURRENCY)
+
+    async def fetch_one(video_id):
+        async with semaphore:
+            try:
+                data = await _fetch_video(video_id, token)
+                return {"video_id": video_id, "status": 200, "data": data}
+            except HTTPException as e:
+                return {"video_id": video_id, "status": e.status_code, "error": e.detail}
+
+    return await asyncio.gather(*(fetch_one(video_id) for video_id in video_ids))
+
+
+@router.post("/videos/batch")
+async def get_videos_batch(
+    body: VideoBatchRequest,
+    user=Depends(verify_token),
+    settings: Settings = Depends(get_settings),
+):
+    """
+    Fetch metadata for several videos in one call.
+    The token is verified once; each item carries its own status/error.
+    """
+
+    if not settings.video_composite_url:
+        raise HTTPException(status_code=500, detail="VIDEO_COMPOSITE_URL not set")
+
+    # Drop duplicates but keep the caller's order
+    video_ids = list(dict.fromkeys(body.video_ids))
+    if len(video_ids) > VIDEO_BATCH_MAX:
+        raise HTTPException(status_code=422, detail=f"At most {VIDEO_BATCH_MAX} video_ids per batch")
+
+    items = await _fetch_videos(video_ids, user["token"])
+    return {
+        "items": items,
+        "errors": sum(1 for item in items if "error" in item),
+    }
+
+
+@router.get("/videos/{video_id}")
+async def get_single_video(
+    video_id: str,
+    request: Request,
+    fields: str = Query(None),
+    user=Depends(verify_token),
+    settings: Settings = Depends(get_settings),
+):
+    """
+    Fetch metadata for a single video, optionally trimmed to `fields`.
+    """
+
+    if not settings.video_composite_url:
+        raise HTTPException(status_code=500, detail="VIDEO_COMPOSITE_URL not set")
+
+    projection = compile_fields(fields)
+    representation = await _fetch_video_representation(video_id, user["token"])
+    if projection is not None:
+        key = f"{representation.etag}:{projection.key}"
+        projected = video_projections.get(key)
+        if projected is None:
+            projected = Representation(projection.apply(representation.data))
+            video_projections.set(key, projected)
+        representation = projected
+        PROJECTED.inc("video")
+    return conditional_response(request, representation, "video")
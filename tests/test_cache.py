@@ -0,0 +1,61 @@
+import os
+import stat
+import tempfile
+import pytest
+from utils import cache
+
+
+@pytest.fixture
+def tmpdir_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    return tmp_path
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_default_database_is_private(tmpdir_root):
+    path = cache._default_path()
+    cache._claim_database(path)
+
+    assert os.path.dirname(path) == str(tmpdir_root / f"composite-cache-{os.getuid()}")
+    assert mode(os.path.dirname(path)) == 0o700
+    assert mode(path) == 0o600
+
+
+def test_shared_default_directory_is_refused(tmpdir_root):
+    directory = tmpdir_root / f"composite-cache-{os.getuid()}"
+    directory.mkdir()
+    directory.chmod(0o777)
+
+    with pytest.raises(PermissionError):
+        cache._default_path()
+
+
+def test_own_database_is_made_private(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    path.touch()
+    path.chmod(0o666)
+
+    cache._claim_database(str(path))
+
+    assert mode(path) == 0o600
+
+
+def test_database_of_another_user_is_refused(tmp_path, monkeypatch):
+    path = tmp_path / "cache.sqlite3"
+    path.touch()
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(path).st_uid + 1)
+
+    with pytest.raises(PermissionError):
+        cache._claim_database(str(path))
+
+
+def test_sqlite_cache_round_trips_in_a_private_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    shared = cache.SQLiteCache("test_private", path=path)
+    shared.set("key", {"value": 1})
+
+    assert shared.get("key") == {"value": 1}
+    assert mode(path) == 0o600
@@ -0,0 +1,117 @@
+import time
+import pytest
+from utils import circuit_breaker
+from utils.circuit_breaker import CLOSED, OPEN, HALF_OPEN, CircuitBreaker, LatencyTracker
+from utils.errors import DownstreamRejected
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "BREAKER_MIN_CALLS", 4)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_WINDOW_SECONDS", 30)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_OPEN_SECONDS", 10)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_HALF_OPEN_PROBES", 2)
+    return CircuitBreaker("search")
+
+
+def calls(breaker, *outcomes):
+    for ok in outcomes:
+        breaker.record(ok, breaker.before_call())
+
+
+def open_elapsed(breaker):
+    breaker.opened_at -= circuit_breaker.BREAKER_OPEN_SECONDS
+
+
+def test_stays_closed_below_min_calls(breaker):
+    calls(breaker, False, False, False)
+    assert breaker.state == CLOSED
+
+
+def test_opens_at_the_error_rate(breaker):
+    calls(breaker, True, True, False)
+    assert breaker.state == CLOSED
+    calls(breaker, False)
+    assert breaker.state == OPEN
+    assert breaker.snapshot()["opened"] == 1
+
+
+def test_open_breaker_fails_fast_with_retry_after(breaker):
+    calls(breaker, False, False, False, False)
+
+    with pytest.raises(DownstreamRejected) as e:
+        breaker.before_call()
+    assert e.value.status_code == 503
+    assert 1 <= int(e.value.headers["Retry-After"]) <= 10
+    assert breaker.rejected == 1
+
+
+def test_old_failures_leave_the_window(breaker):
+    calls(breaker, False, False)
+    breaker._calls = type(breaker._calls)((t - 60, ok) for t, ok in breaker._calls)
+    calls(breaker, True, True)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["window_calls"] == 2
+
+
+def test_half_open_admits_a_few_probes(breaker):
+    calls(breaker, False, False, False, False)
+    open_elapsed(breaker)
+
+    assert breaker.before_call() is True
+    assert breaker.state == HALF_OPEN
+    assert breaker.before_call() is True
+    with pytest.raises(DownstreamRejected):
+        breaker.before_call()
+
+
+def test_successful_probes_close_the_breaker(breaker):
+    calls(breaker, False, False, False, False)
+    open_elapsed(breaker)
+
+    calls(breaker, True, True)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["window_calls"] == 0
+
+
+def test_failed_probe_reopens(breaker):
+    calls(breaker, False, False, False, False)
+    open_elapsed(breaker)
+
+    calls(breaker, False)
+    assert breaker.state == OPEN
+    assert breaker.opened_at > time.monotonic() - 1
+
+
+def test_released_probe_frees_its_place(breaker):
+    calls(breaker, False, False, False, False)
+    open_elapsed(breaker)
+
+    breaker.release(breaker.before_call())
+    breaker.release(breaker.before_call())
+    assert breaker.before_call() is True
+
+
+def test_timeout_adapts_to_p99(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "ADAPTIVE_TIMEOUTS", True)
+    monkeypatch.setattr(circuit_breaker, "ADAPTIVE_TIMEOUT_MULTIPLIER", 3)
+    monkeypatch.setattr(circuit_breaker, "ADAPTIVE_TIMEOUT_MIN", 0.1)
+    tracker = LatencyTracker()
+
+    assert tracker.timeout(10) == 10
+    for _ in range(64):
+        tracker.observe(0.2)
+    assert tracker.p99 == 0.2
+    assert tracker.timeout(10) == pytest.approx(0.6)
+    # Never above the configured timeout
+    assert tracker.timeout(0.5) == 0.5
+
+
+def test_adaptive_timeout_has_a_floor(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "ADAPTIVE_TIMEOUTS", True)
+    monkeypatch.setattr(circuit_breaker, "ADAPTIVE_TIMEOUT_MIN", 1.0)
+    tracker = LatencyTracker()
+    for _ in range(64):
+        tracker.observe(0.01)
+    assert tracker.timeout(10) == 1.0
@@ -0,0 +1,130 @@
+import asyncio
+import gzip
+import json
+import pytest
+from utils import compression
+
+BIG = json.dumps({"items": [{"video_id": f"v{n}", "title": "Lecture"} for n in range(200)]}).encode()
+
+
+@pytest.fixture(autouse=True)
+def gzip_only(monkeypatch):
+    # Deterministic whether or not brotli is installed
+    monkeypatch.setattr(compression, "brotli", None)
+    monkeypatch.setattr(compression, "COMPRESS_MIN_BYTES", 1024)
+    monkeypatch.setattr(compression, "COMPRESS_RULES", {})
+
+
+def app_sending(*bodies, status=200, headers=()):
+    async def app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), *headers],
+        })
+        for n, body in enumerate(bodies):
+            await send({"type": "http.response.body", "body": body, "more_body": n < len(bodies) - 1})
+    return app
+
+
+def call(app, accept=b"gzip", path="/videos/search"):
+    scope = {"type": "http", "method": "GET", "path": path, "headers": [(b"accept-encoding", accept)]}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(compression.CompressionMiddleware(app)(scope, receive, send))
+    headers = dict(sent[0]["headers"])
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return sent[0]["status"], headers, body
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("identity", None),
+    ("*", "gzip"),
+    ("deflate, gzip;q=0.5", "gzip"),
+])
+def test_negotiate(accept, expected):
+    assert compression.negotiate(accept) == expected
+
+
+def test_large_json_is_gzipped():
+    status, headers, body = call(app_sending(BIG))
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert int(headers[b"content-length"]) == len(body) < len(BIG)
+    assert gzip.decompress(body) == BIG
+
+
+def test_small_body_is_sent_as_is():
+    status, headers, body = call(app_sending(b'{"ok": true}'))
+
+    assert b"content-encoding" not in headers
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert body == b'{"ok": true}'
+
+
+def test_route_rule_lowers_the_threshold(monkeypatch):
+    monkeypatch.setattr(compression, "COMPRESS_RULES", compression._parse_rules("/videos/search=8:9"))
+    status, headers, body = call(app_sending(b'{"ok": true, "n": 1}'))
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert gzip.decompress(body) == b'{"ok": true, "n": 1}'
+
+
+def test_client_without_gzip_gets_identity():
+    status, headers, body = call(app_sending(BIG), accept=b"br;q=0, gzip;q=0")
+    assert b"content-encoding" not in headers
+    assert body == BIG
+
+
+@pytest.mark.parametrize("status, headers", [
+    (304, ()),
+    (200, ((b"content-encoding", b"br"),)),
+])
+def test_responses_that_must_not_be_compressed(status, headers):
+    _, sent_headers, body = call(app_sending(BIG, status=status, headers=headers))
+    assert sent_headers.get(b"content-encoding") in (None, b"br")
+    assert body == BIG
+
+
+def test_strong_etag_is_weakened_and_compressed_once(monkeypatch):
+    compressions = []
+    real = compression.compress
+
+    def counting(body, encoding, level):
+        compressions.append(encoding)
+        return real(body, encoding, level)
+
+    monkeypatch.setattr(compression, "compress", counting)
+    compression.compressed_cache.clear()
+    etag = (b"etag", b'"test-etag-1"')
+    first = call(app_sending(BIG, headers=(etag,)))
+    second = call(app_sending(BIG, headers=(etag,)))
+
+    assert first[1][b"etag"] == b'W/"test-etag-1"'
+    assert first[2] == second[2]
+    assert compressions == ["gzip"]
+
+
+def test_streamed_body_is_compressed_incrementally():
+    chunks = [BIG[:1000], BIG[1000:3000], BIG[3000:]]
+    status, headers, body = call(app_sending(*chunks))
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    assert gzip.decompress(body) == BIG
+
+
+def test_parse_rules():
+    assert compression._parse_rules("/videos/search=512:6, /offerings=256") == {
+        "/videos/search": (512, 6),
+        "/offerings": (256, None),
+    }
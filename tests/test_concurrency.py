@@ -0,0 +1,160 @@
+import asyncio
+import pytest
+from utils.concurrency import ServiceLimiter, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from utils.errors import DownstreamRejected
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setenv("TESTSVC_MAX_CONCURRENCY", "2")
+    monkeypatch.setenv("TESTSVC_MAX_QUEUE", "4")
+    monkeypatch.setenv("TESTSVC_QUEUE_TIMEOUT", "0.05")
+    return ServiceLimiter("testsvc")
+
+
+def counts(limiter):
+    return limiter.active, limiter.queued, limiter.shed, limiter.queue_timeouts
+
+
+async def settle():
+    # Lets woken waiters run (wait_for needs more than one loop iteration)
+    await asyncio.sleep(0.005)
+
+
+def test_reads_per_service_overrides(limiter):
+    assert (limiter.max_concurrency, limiter.max_queue, limiter.queue_timeout) == (2, 4, 0.05)
+
+
+def test_slots_are_handed_over_in_priority_order(limiter):
+    async def main():
+        await limiter.acquire()
+        await limiter.acquire()
+        assert counts(limiter) == (2, 0, 0, 0)
+
+        order = []
+
+        async def wait(priority, name):
+            await limiter.acquire(priority)
+            order.append(name)
+
+        tasks = [
+            asyncio.create_task(wait(PRIORITY_LOW, "low")),
+            asyncio.create_task(wait(PRIORITY_NORMAL, "normal")),
+            asyncio.create_task(wait(PRIORITY_HIGH, "high")),
+        ]
+        await settle()
+        assert counts(limiter) == (2, 3, 0, 0)
+
+        limiter.release()
+        await settle()
+        assert order == ["high"]
+        limiter.release()
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == ["high", "normal", "low"]
+        # Slots were handed over, never freed in between
+        assert counts(limiter) == (2, 0, 0, 0)
+
+        limiter.release()
+        limiter.release()
+        assert counts(limiter) == (0, 0, 0, 0)
+
+    asyncio.run(main())
+
+
+def test_sheds_when_the_queue_is_full(limiter):
+    async def main():
+        await limiter.acquire()
+        await limiter.acquire()
+        low = [asyncio.create_task(limiter.acquire(PRIORITY_LOW)) for _ in range(2)]
+        await settle()
+
+        # LOW may only fill half of the queue
+        with pytest.raises(DownstreamRejected) as e:
+            await limiter.acquire(PRIORITY_LOW)
+        assert e.value.status_code == 503
+        assert e.value.headers["Retry-After"] == "1"
+
+        normal = [asyncio.create_task(limiter.acquire()) for _ in range(2)]
+        await settle()
+        with pytest.raises(DownstreamRejected):
+            await limiter.acquire(PRIORITY_HIGH)
+        assert counts(limiter) == (2, 4, 2, 0)
+
+        for _ in range(6):
+            limiter.release()
+        await asyncio.gather(*low, *normal)
+        assert counts(limiter) == (0, 0, 2, 0)
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_is_counted_and_sheds(limiter):
+    async def main():
+        await limiter.acquire()
+        await limiter.acquire()
+        with pytest.raises(DownstreamRejected):
+            await limiter.acquire()
+        assert counts(limiter) == (2, 0, 1, 1)
+
+        # The timed-out waiter does not swallow a released slot
+        limiter.release()
+        limiter.release()
+        assert counts(limiter) == (0, 0, 1, 1)
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue(limiter):
+    async def main():
+        await limiter.acquire()
+        await limiter.acquire()
+        task = asyncio.create_task(limiter.acquire())
+        await settle()
+        assert limiter.queued == 1
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert counts(limiter) == (2, 0, 0, 0)
+
+        limiter.release()
+        limiter.release()
+        assert counts(limiter) == (0, 0, 0, 0)
+
+    asyncio.run(main())
+
+
+def test_cancel_racing_a_handover_loses_no_slot(limiter):
+    async def main():
+        await limiter.acquire()
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire())
+        second = asyncio.create_task(limiter.acquire())
+        await settle()
+
+        # The slot is handed to `first`, which is cancelled before it runs.
+        # Depending on the Python version wait_for either raises, and the
+        # slot must move on to `second`, or returns with the slot held.
+        limiter.release()
+        first.cancel()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        else:
+            limiter.release()
+        await second
+        assert counts(limiter) == (2, 0, 0, 0)
+
+        limiter.release()
+        limiter.release()
+        assert counts(limiter) == (0, 0, 0, 0)
+
+    asyncio.run(main())
+
+
+def test_bad_override_names_the_variable(monkeypatch):
+    monkeypatch.setenv("TESTSVC_MAX_QUEUE", "lots")
+    with pytest.raises(ValueError, match="TESTSVC_MAX_QUEUE"):
+        ServiceLimiter("testsvc")
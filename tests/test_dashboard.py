@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from resources import dashboard_resource
+
+USER = {"uid": "u1", "role": "faculty", "token": "t"}
+
+
+@pytest.fixture
+def sections(monkeypatch):
+    async def user(prof_uni):
+        return {"uni": prof_uni}
+
+    async def offers(prof_uni):
+        return SimpleNamespace(data=[{"offering_id": 1}])
+
+    async def videos(**kwargs):
+        return {"items": [{"video_id": "v1"}]}
+
+    monkeypatch.setattr(dashboard_resource, "get_cached_user", user)
+    monkeypatch.setattr(dashboard_resource, "load_prof_offers", offers)
+    monkeypatch.setattr(dashboard_resource, "search_videos", videos)
+    return monkeypatch
+
+
+def dashboard():
+    return asyncio.run(dashboard_resource.get_prof_dashboard("ab1234", user=USER))
+
+
+def test_all_sections(sections):
+    result = dashboard()
+    assert result["user"] == {"uni": "ab1234"}
+    assert result["offerings"] == [{"offering_id": 1}]
+    assert result["videos"]["items"] == [{"video_id": "v1"}]
+    assert result["errors"] == {}
+
+
+def test_http_error_is_reported_per_section(sections):
+    async def missing(prof_uni):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    sections.setattr(dashboard_resource, "get_cached_user", missing)
+    result = dashboard()
+    assert result["user"] is None
+    assert result["errors"] == {"user": {"status": 404, "detail": "User not found"}}
+    assert result["offerings"] == [{"offering_id": 1}]
+
+
+def test_unexpected_error_is_reported_as_502(sections):
+    async def broken(**kwargs):
+        raise KeyError("items")
+
+    sections.setattr(dashboard_resource, "search_videos", broken)
+    result = dashboard()
+    assert result["videos"] is None
+    assert result["errors"] == {"videos": {"status": 502, "detail": "Section failed"}}
+    assert result["user"] == {"uni": "ab1234"}
+
+
+def test_timeout_is_reported_as_504(sections):
+    async def slow(prof_uni):
+        await asyncio.sleep(1)
+
+    sections.setattr(dashboard_resource, "load_prof_offers", slow)
+    sections.setattr(dashboard_resource, "DASHBOARD_OFFERINGS_TIMEOUT", 0.01)
+    result = dashboard()
+    assert result["errors"]["offerings"]["status"] == 504
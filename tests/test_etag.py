@@ -0,0 +1,110 @@
+import asyncio
+import httpx
+import pytest
+from fastapi import FastAPI
+from resources import upload_resource
+from utils import http_client
+from utils.etag import Representation, cache_control, compute_etag, etag_matches
+from utils.response_cache import catalog_cache
+from utils.settings import Settings, get_settings
+
+
+def test_representation_is_encoded_once_with_a_strong_etag():
+    first = Representation({"b": 1, "a": [1, 2]})
+    second = Representation({"b": 1, "a": [1, 2]})
+
+    assert first.etag == second.etag == compute_etag(first.body)
+    assert not first.etag.startswith("W/")
+    assert Representation({"b": 2}).etag != first.etag
+
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ("*", True),
+    ('"abcd"', False),
+    ("", False),
+    (None, False),
+])
+def test_etag_matches_uses_weak_comparison(if_none_match, matches):
+    assert etag_matches(if_none_match, '"abc"') is matches
+    assert etag_matches(if_none_match, 'W/"abc"') is matches
+
+
+def test_cache_control_per_route(monkeypatch):
+    assert cache_control("courses") == "public, max-age=60"
+    assert cache_control("unknown") == "no-cache"
+    monkeypatch.setenv("COURSES_CACHE_CONTROL", "public, max-age=300")
+    assert cache_control("courses") == "public, max-age=300"
+
+
+class Upload:
+    """Upload service stub answering /videos/courses with an ETag."""
+
+    def __init__(self):
+        self.body = [{"course_id": "C1"}]
+        self.requests = []
+
+    def handler(self, request):
+        etag = '"v%d"' % len(self.body)
+        self.requests.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, json=self.body, headers={"ETag": etag})
+
+
+@pytest.fixture
+def api(monkeypatch):
+    upstream = Upload()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler), base_url="http://upload")
+    monkeypatch.setitem(http_client._clients, "upload", client)
+    catalog_cache.invalidate("courses")
+
+    app = FastAPI()
+    app.include_router(upload_resource.router)
+    settings = Settings(upload_service_url="http://upload", auth_service_url="http://auth")
+    app.dependency_overrides[get_settings] = lambda: settings
+    yield app, upstream
+    catalog_cache.invalidate("courses")
+
+
+def run(app, scenario):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+def test_conditional_get_returns_304(api):
+    app, _ = api
+
+    async def scenario(client):
+        first = await client.get("/courses")
+        again = await client.get("/courses", headers={"If-None-Match": first.headers["etag"]})
+        other = await client.get("/courses", headers={"If-None-Match": '"stale"'})
+        return first, again, other
+
+    first, again, other = run(app, scenario)
+    assert first.status_code == 200
+    assert first.json() == [{"course_id": "C1"}]
+    assert first.headers["cache-control"] == "public, max-age=60"
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == first.headers["etag"]
+    assert other.status_code == 200
+
+
+def test_refresh_revalidates_with_the_upstream_etag(api):
+    app, upstream = api
+
+    async def scenario(client):
+        etag = (await client.get("/courses")).headers["etag"]
+        previous = catalog_cache.entries.get("courses")["value"]
+        refreshed = await upload_resource._fetch_catalog("/videos/courses", previous)
+        return etag, previous, refreshed
+
+    etag, previous, refreshed = run(app, scenario)
+    assert refreshed is previous
+    assert upstream.requests == [None, '"v1"']
+    assert refreshed.etag == etag
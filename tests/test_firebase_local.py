@@ -0,0 +1,143 @@
+import asyncio
+import json
+import time
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from utils import auth, firebase
+from utils.settings import Settings, get_settings
+
+PROJECT = "test-project"
+
+
+def _keypair():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return key, pem
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return {"k1": _keypair(), "k2": _keypair()}
+
+
+@pytest.fixture
+def certs(tmp_path, monkeypatch, keys):
+    """
+    FIREBASE_CERTS_FILE holding the public half of k1.
+    """
+    path = tmp_path / "certs.json"
+    path.write_text(json.dumps({"k1": keys["k1"][1]}))
+    monkeypatch.setenv("FIREBASE_CERTS_FILE", str(path))
+    monkeypatch.setenv("FIREBASE_PROJECT_ID", PROJECT)
+    monkeypatch.setattr(firebase, "_key_source", None)
+    monkeypatch.setattr(firebase, "_forced_refresh_at", float("-inf"))
+    get_settings.cache_clear()
+    yield path
+    get_settings.cache_clear()
+
+
+def token(keys, kid="k1", **claims):
+    now = int(time.time())
+    payload = {
+        "iss": f"https://securetoken.google.com/{PROJECT}",
+        "aud": PROJECT,
+        "sub": "u1",
+        "user_id": "u1",
+        "email": "u1@uni.edu",
+        "iat": now,
+        "exp": now + 600,
+    }
+    payload.update(claims)
+    return jwt.encode(payload, keys[kid][0], algorithm="RS256", headers={"kid": kid})
+
+
+def verify(id_token):
+    return asyncio.run(firebase.verify_id_token(id_token))
+
+
+def rejected(id_token):
+    with pytest.raises(HTTPException) as e:
+        verify(id_token)
+    return e.value
+
+
+def test_valid_token(certs, keys):
+    claims = verify(token(keys, role="faculty"))
+    assert claims["sub"] == "u1"
+    assert claims["role"] == "faculty"
+    assert isinstance(firebase.get_key_source(), firebase.FileKeySource)
+
+
+@pytest.mark.parametrize("claims, reason", [
+    ({"aud": "other-project"}, "Audience"),
+    ({"iss": "https://securetoken.google.com/other-project"}, "issuer"),
+    ({"exp": int(time.time()) - 3600}, "token expired"),
+    ({"sub": ""}, "subject"),
+])
+def test_rejected_claims(certs, keys, claims, reason):
+    error = rejected(token(keys, **claims))
+    assert error.status_code == 401
+    assert reason in error.detail
+
+
+def test_clock_skew_is_tolerated(certs, keys):
+    assert verify(token(keys, exp=int(time.time()) - 2))["sub"] == "u1"
+
+
+def test_tampered_signature(certs, keys):
+    header, payload, signature = token(keys).split(".")
+    forged = token(keys, kid="k2").split(".")[2]
+    assert rejected(f"{header}.{payload}.{forged}").status_code == 401
+
+
+def test_unexpected_algorithm(certs):
+    hs = jwt.encode({"sub": "u1"}, "secret-secret-secret-secret-1234", algorithm="HS256", headers={"kid": "k1"})
+    assert "unexpected signing algorithm" in rejected(hs).detail
+
+
+def test_malformed_token(certs):
+    assert "malformed token" in rejected("not-a-jwt").detail
+
+
+def test_unknown_kid_until_the_keys_rotate(certs, keys):
+    assert "unknown signing key" in rejected(token(keys, kid="k2")).detail
+
+    certs.write_text(json.dumps({"k1": keys["k1"][1], "k2": keys["k2"][1]}))
+    assert verify(token(keys, kid="k2"))["sub"] == "u1"
+
+
+def test_forced_refreshes_are_rate_limited(certs, keys, monkeypatch):
+    forced = []
+    source = firebase.get_key_source()
+    get_keys = source.get_keys
+
+    async def counting(force=False):
+        if force:
+            forced.append(time.monotonic())
+        return await get_keys(force)
+
+    monkeypatch.setattr(source, "get_keys", counting)
+    for _ in range(3):
+        assert "unknown signing key" in rejected(token(keys, kid="k2")).detail
+    assert len(forced) == 1
+
+    monkeypatch.setattr(firebase, "_forced_refresh_at", time.monotonic() - firebase.FORCED_REFRESH_INTERVAL)
+    rejected(token(keys, kid="k2"))
+    assert len(forced) == 2
+
+
+def test_missing_project_id(certs, keys, monkeypatch):
+    monkeypatch.setattr(firebase, "get_settings", lambda: Settings())
+    assert rejected(token(keys)).status_code == 500
+
+
+def test_verify_token_local_mode(certs, keys):
+    settings = Settings(auth_verify_mode="local", firebase_project_id=PROJECT)
+    id_token = token(keys, role="student")
+    user = asyncio.run(auth.verify_token(f"Bearer {id_token}", settings=settings))
+    assert user == {"uid": "u1", "email": "u1@uni.edu", "role": "student", "token": id_token}
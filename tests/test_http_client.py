@@ -0,0 +1,142 @@
+import asyncio
+import httpx
+import pytest
+from utils import circuit_breaker, concurrency, http_client
+
+SERVICE = "teststream"
+
+
+@pytest.fixture
+def service(monkeypatch):
+    def handler(request):
+        return httpx.Response(200, content=b"body")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://upstream")
+    breaker = circuit_breaker.CircuitBreaker(SERVICE)
+    limiter = concurrency.ServiceLimiter(SERVICE)
+    monkeypatch.setitem(http_client._clients, SERVICE, client)
+    monkeypatch.setitem(circuit_breaker.breakers, SERVICE, breaker)
+    monkeypatch.setitem(concurrency.limiters, SERVICE, limiter)
+    return breaker, limiter
+
+
+def test_stream_holds_its_slot_until_closed(service):
+    breaker, limiter = service
+
+    async def main():
+        stream = await http_client.open_stream(SERVICE, "GET", "/file")
+        held = limiter.active
+        await stream.aclose()
+        return stream.response.status_code, held
+
+    assert asyncio.run(main()) == (200, 1)
+    assert limiter.active == 0
+
+
+def test_failure_before_sending_releases_slot_and_probe(service, monkeypatch):
+    breaker, limiter = service
+    breaker._transition(circuit_breaker.HALF_OPEN)
+
+    def broken(*args):
+        raise RuntimeError("prepare failed")
+
+    monkeypatch.setattr(http_client, "_prepare", broken)
+    with pytest.raises(RuntimeError):
+        asyncio.run(http_client.open_stream(SERVICE, "GET", "/file"))
+
+    assert limiter.active == 0
+    assert breaker._probes_in_flight == 0
+    assert breaker.state == circuit_breaker.HALF_OPEN
+
+
+def test_request_failing_before_sending_releases_slot_and_probe(service, monkeypatch):
+    breaker, limiter = service
+    breaker._transition(circuit_breaker.HALF_OPEN)
+
+    def broken(*args):
+        raise RuntimeError("prepare failed")
+
+    monkeypatch.setattr(http_client, "_prepare", broken)
+    with pytest.raises(RuntimeError):
+        asyncio.run(http_client.request(SERVICE, "GET", "/file", coalesce=False, retries=False))
+
+    assert limiter.active == 0
+    assert breaker._probes_in_flight == 0
+
+
+def test_transport_error_releases_slot_once(service, monkeypatch):
+    breaker, limiter = service
+
+    def handler(request):
+        raise httpx.ConnectError("refused")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://upstream")
+    monkeypatch.setitem(http_client._clients, SERVICE, client)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(http_client.open_stream(SERVICE, "GET", "/file"))
+
+    assert limiter.active == 0
+
+
+def gated_service(monkeypatch, seen):
+    gate = asyncio.Event()
+
+    async def handler(request):
+        seen.append((request.url.params.get("q"), request.headers.get("Authorization")))
+        await gate.wait()
+        return httpx.Response(200, json={"q": request.url.params.get("q")})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://upstream")
+    monkeypatch.setitem(http_client._clients, SERVICE, client)
+    monkeypatch.setattr(http_client, "COALESCE_GETS", True)
+    return gate
+
+
+def test_identical_gets_are_coalesced(service, monkeypatch):
+    seen = []
+
+    async def main():
+        gate = gated_service(monkeypatch, seen)
+        calls = [
+            http_client.request(SERVICE, "GET", "/search", params={"q": "a", "unset": None},
+                                headers={"Authorization": "Bearer t1"})
+            for _ in range(3)
+        ]
+        tasks = [asyncio.ensure_future(call) for call in calls]
+        await asyncio.sleep(0.01)
+        gate.set()
+        return [res.json() for res in await asyncio.gather(*tasks)]
+
+    assert asyncio.run(main()) == [{"q": "a"}] * 3
+    assert seen == [("a", "Bearer t1")]
+
+
+def test_gets_of_different_callers_or_params_are_not_coalesced(service, monkeypatch):
+    seen = []
+
+    async def main():
+        gate = gated_service(monkeypatch, seen)
+        tasks = [
+            asyncio.ensure_future(http_client.request(SERVICE, "GET", "/search", params={"q": q}, headers={"Authorization": auth}))
+            for q, auth in [("a", "Bearer t1"), ("a", "Bearer t2"), ("b", "Bearer t1")]
+        ]
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert sorted(seen) == [("a", "Bearer t1"), ("a", "Bearer t2"), ("b", "Bearer t1")]
+
+
+def test_writes_are_never_coalesced(service, monkeypatch):
+    seen = []
+
+    async def main():
+        gate = gated_service(monkeypatch, seen)
+        tasks = [asyncio.ensure_future(http_client.request(SERVICE, "POST", "/search", params={"q": "a"})) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert len(seen) == 2
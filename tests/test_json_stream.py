@@ -0,0 +1,101 @@
+import json
+import pytest
+from utils import json_stream
+from utils.json_stream import LinksSplicer
+
+LINK = {"rel": "self", "href": "/videos/search?limit=2&offset=0"}
+
+
+def splice(body, chunk_size):
+    splicer = LinksSplicer(LINK)
+    out = b""
+    for i in range(0, len(body), chunk_size):
+        out += splicer.feed(body[i:i + chunk_size])
+    out += splicer.finish()
+    return out, splicer.spliced
+
+
+@pytest.fixture(params=[1, 3, 1000], ids=lambda n: f"chunk{n}")
+def chunk_size(request):
+    return request.param
+
+
+def test_appends_to_top_level_links(chunk_size):
+    body = json.dumps({
+        "items": [{"video_id": "v1"}],
+        "links": [{"rel": "next", "href": "/next"}],
+    }).encode()
+    out, spliced = splice(body, chunk_size)
+    assert spliced
+    assert json.loads(out)["links"] == [{"rel": "next", "href": "/next"}, LINK]
+
+
+def test_fills_empty_links(chunk_size):
+    out, spliced = splice(b'{"items": [], "links": [ ]}', chunk_size)
+    assert spliced
+    assert json.loads(out) == {"items": [], "links": [LINK]}
+
+
+def test_adds_links_member_when_missing(chunk_size):
+    out, spliced = splice(b'  {"items": [{"video_id": "v1"}], "page_size": 1}\n', chunk_size)
+    assert spliced
+    assert json.loads(out) == {"items": [{"video_id": "v1"}], "page_size": 1, "links": [LINK]}
+
+
+def test_empty_object(chunk_size):
+    out, spliced = splice(b"{}", chunk_size)
+    assert spliced
+    assert json.loads(out) == {"links": [LINK]}
+
+
+def test_escaped_quotes_and_backslashes(chunk_size):
+    data = {
+        "items": [{"title": 'say "links": [1]', "path": "C:\\dir\\"}],
+        "note": '\\"}',
+        "links": [{"rel": "next", "href": "/q?x=\"a\""}],
+    }
+    out, spliced = splice(json.dumps(data).encode(), chunk_size)
+    assert spliced
+    assert json.loads(out) == {**data, "links": data["links"] + [LINK]}
+
+
+def test_bare_list_body_is_wrapped(chunk_size):
+    out, spliced = splice(b' [{"video_id": "v1"}, {"video_id": "v2"}]', chunk_size)
+    assert spliced
+    assert json.loads(out) == {"items": [{"video_id": "v1"}, {"video_id": "v2"}], "links": [LINK]}
+
+
+def test_nested_links_are_left_alone(chunk_size):
+    data = {"items": [{"video_id": "v1", "links": [{"rel": "self", "href": "/videos/v1"}]}], "offset": 0}
+    out, spliced = splice(json.dumps(data).encode(), chunk_size)
+    assert spliced
+    assert json.loads(out) == {**data, "links": [LINK]}
+
+
+def test_links_out_of_reach_is_forwarded_unchanged(monkeypatch):
+    monkeypatch.setattr(json_stream, "TAIL_BYTES", 64)
+    data = {"links": [], "items": [{"video_id": f"v{i}"} for i in range(20)]}
+    body = json.dumps(data).encode()
+    out, spliced = splice(body, 7)
+    assert not spliced
+    assert out == body
+
+
+def test_non_array_links_is_forwarded_unchanged(chunk_size):
+    body = b'{"items": [], "links": {"self": "/x"}}'
+    out, spliced = splice(body, chunk_size)
+    assert not spliced
+    assert out == body
+
+
+def test_long_body_keeps_only_the_tail(monkeypatch):
+    monkeypatch.setattr(json_stream, "TAIL_BYTES", 128)
+    data = {"items": [{"video_id": f"v{i}", "title": "x" * 50} for i in range(50)], "links": []}
+    splicer = LinksSplicer(LINK)
+    body = json.dumps(data).encode()
+    out = b""
+    for i in range(0, len(body), 1000):
+        out += splicer.feed(body[i:i + 1000])
+        assert len(splicer._tail) <= 128
+    out += splicer.finish()
+    assert json.loads(out) == {**data, "links": [LINK]}
@@ -0,0 +1,152 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from utils import http_client
+from utils.page_cache import BlockPageCache, decode_cursor, encode_cursor, normalize_filters
+
+BLOCK = 10
+
+
+@pytest.fixture
+def pages(request):
+    return BlockPageCache(f"test_pages_{request.node.name}", BLOCK, ttl=30)
+
+
+class Upstream:
+    """Search stub: `total` results, each tagged with the token it was fetched for."""
+
+    def __init__(self, total):
+        self.total = total
+        self.calls = []
+
+    def fetcher(self, token):
+        async def fetch_block(offset, limit):
+            self.calls.append((token, offset, limit))
+            end = min(offset + limit, self.total)
+            return [{"n": n, "for": token} for n in range(offset, end)]
+        return fetch_block
+
+
+def test_blocks_are_not_shared_between_callers(pages):
+    upstream = Upstream(25)
+    filters = {"q": "intro"}
+
+    async def page_for(token):
+        scope = http_client.scope_hash(token)
+        return await pages.get_page(filters, scope, 0, 5, upstream.fetcher(token))
+
+    async def main():
+        alice, _ = await page_for("alice-token")
+        bob, _ = await page_for("bob-token")
+        again, _ = await page_for("alice-token")
+        return alice, bob, again
+
+    alice, bob, again = asyncio.run(main())
+    assert {item["for"] for item in alice} == {"alice-token"}
+    assert {item["for"] for item in bob} == {"bob-token"}
+    assert again == alice
+    assert [call[0] for call in upstream.calls] == ["alice-token", "bob-token"]
+
+
+def run_pages(pages, upstream, requests, token="t"):
+    """get_page for each (offset, limit), letting prefetches finish in between."""
+    fetch = upstream.fetcher(token)
+    scope = http_client.scope_hash(token)
+
+    async def main():
+        results = []
+        for offset, limit in requests:
+            results.append(await pages.get_page({"q": "x"}, scope, offset, limit, fetch))
+            await asyncio.gather(*pages._prefetching.values())
+        return results
+
+    return asyncio.run(main())
+
+
+def numbers(page):
+    return [item["n"] for item in page]
+
+
+def test_consecutive_pages_come_from_one_block(pages):
+    upstream = Upstream(25)
+    (first, more1), (second, more2) = run_pages(pages, upstream, [(0, 3), (3, 3)])
+
+    assert numbers(first) == [0, 1, 2] and more1
+    assert numbers(second) == [3, 4, 5] and more2
+    assert upstream.calls == [("t", 0, BLOCK)]
+
+
+def test_page_spanning_blocks(pages):
+    upstream = Upstream(25)
+    [(page, more)] = run_pages(pages, upstream, [(8, 5)])
+
+    assert numbers(page) == [8, 9, 10, 11, 12] and more
+    assert [call[1] for call in upstream.calls] == [0, 10]
+
+
+def test_short_block_ends_the_results(pages):
+    upstream = Upstream(25)
+    (page, more), (past, past_more) = run_pages(pages, upstream, [(20, 5), (25, 5)])
+
+    assert numbers(page) == [20, 21, 22, 23, 24] and not more
+    assert past == [] and not past_more
+
+
+def test_next_block_is_prefetched_near_the_boundary(pages):
+    upstream = Upstream(25)
+    run_pages(pages, upstream, [(0, 5)])
+    assert [call[1] for call in upstream.calls] == [0]
+
+    run_pages(pages, upstream, [(5, 3)])
+    assert [call[1] for call in upstream.calls] == [0, 10]
+
+    # The page after the boundary is served without another upstream call
+    [(page, _)] = run_pages(pages, upstream, [(10, 5)])
+    assert numbers(page) == [10, 11, 12, 13, 14]
+    assert [call[1] for call in upstream.calls] == [0, 10]
+
+
+def test_failed_prefetch_is_fetched_on_demand(pages):
+    upstream = Upstream(25)
+    fetch = upstream.fetcher("t")
+    failures = []
+
+    async def flaky(offset, limit):
+        if offset == 10 and not failures:
+            failures.append(offset)
+            raise RuntimeError("search down")
+        return await fetch(offset, limit)
+
+    async def main():
+        scope = http_client.scope_hash("t")
+        await pages.get_page({"q": "x"}, scope, 0, 8, flaky)
+        await asyncio.gather(*pages._prefetching.values())
+        return await pages.get_page({"q": "x"}, scope, 10, 5, flaky)
+
+    page, _ = asyncio.run(main())
+    assert failures == [10]
+    assert numbers(page) == [10, 11, 12, 13, 14]
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor({"q": "intro", "year": 2024}, 40, 20)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == ({"q": "intro", "year": 2024}, 40, 20)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor",
+    encode_cursor({"q": "x"}, -1, 20),
+    encode_cursor({"q": "x"}, 0, 500),
+    encode_cursor(["q"], 0, 20),
+])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+def test_equivalent_filters_share_blocks():
+    assert normalize_filters({"q": "  intro   to  ml ", "prof": "", "year": None, "course_id": "C1"}) == {
+        "q": "intro to ml", "course_id": "C1",
+    }
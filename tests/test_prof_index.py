@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from utils.prof_index import ProfIndex, _keys
+
+PROFS = [
+    {"uni": "ab1234", "name": "Alice Brown", "email": "alice@uni.edu"},
+    {"uni": "bb2345", "first_name": "Bob", "last_name": "Brownstone", "email": "bob@uni.edu"},
+    {"uni": "cd3456", "name": "Chloé Dupont", "email": "cdupont@uni.edu"},
+    {"uni": "br0001", "name": "Brown", "email": "brown@uni.edu"},
+]
+
+
+class Directory:
+    """Auth stub: serves `profs` with an ETag that changes with the list."""
+
+    def __init__(self, profs):
+        self.profs = list(profs)
+        self.version = 1
+        self.loads = []
+
+    async def load(self, previous_etag):
+        etag = f'"v{self.version}"'
+        self.loads.append(previous_etag)
+        if previous_etag == etag:
+            return etag, None
+        return etag, list(self.profs)
+
+
+@pytest.fixture
+def index():
+    directory = Directory(PROFS)
+    index = ProfIndex(directory.load)
+    asyncio.run(index.refresh())
+    return index, directory
+
+
+def unis(results):
+    return [result["uni"] for result in results]
+
+
+def test_not_ready_is_a_503():
+    with pytest.raises(HTTPException) as e:
+        ProfIndex(Directory(PROFS).load).suggest("al")
+    assert e.value.status_code == 503
+
+
+def test_matches_uni_name_words_and_email(index):
+    index, _ = index
+    assert unis(index.suggest("ab12")) == ["ab1234"]
+    assert unis(index.suggest("alice")) == ["ab1234"]
+    assert unis(index.suggest("cdupont@")) == ["cd3456"]
+    assert index.suggest("bob")[0] == {"uni": "bb2345", "name": "Bob Brownstone", "email": "bob@uni.edu", "matched": "name"}
+
+
+def test_case_and_accents_are_folded(index):
+    index, _ = index
+    assert unis(index.suggest("CHLOE")) == ["cd3456"]
+    assert unis(index.suggest("  chloé   du")) == ["cd3456"]
+
+
+def test_exact_token_ranks_first_then_field_then_length(index):
+    index, _ = index
+    # "brown" is the whole name of br0001, a later name word of Alice and a
+    # prefix of Brownstone
+    assert unis(index.suggest("brown")) == ["br0001", "ab1234", "bb2345"]
+    assert unis(index.suggest("brown", limit=1)) == ["br0001"]
+
+
+def test_each_professor_is_listed_once(index):
+    index, _ = index
+    assert unis(index.suggest("b")).count("bb2345") == 1
+
+
+def test_empty_or_separator_prefix(index):
+    index, _ = index
+    assert index.suggest("") == []
+    assert index.suggest("a\0b") == []
+
+
+def test_unchanged_list_is_not_reapplied(index):
+    index, directory = index
+    keys = index.keys
+    asyncio.run(index.refresh())
+
+    assert directory.loads == [None, '"v1"']
+    assert index.keys is keys
+    assert index.changes == len(PROFS)
+
+
+def test_incremental_update_matches_a_rebuild(index):
+    index, _ = index
+    profs = PROFS + [{"uni": f"zz{n:04d}", "name": f"Prof Number{n}"} for n in range(20)]
+    index.apply(profs)
+    index.changes = 0
+
+    changed = [dict(p) for p in profs]
+    changed[0]["name"] = "Alice Green"
+    del changed[2]
+    changed.append({"uni": "ef5678", "name": "Eve Fisher"})
+    assert index.apply(changed) == 3
+
+    expected = sorted(key for prof in changed for key in _keys(prof["uni"], prof))
+    assert index.keys == expected
+    assert unis(index.suggest("green")) == ["ab1234"]
+    assert index.suggest("chloe") == []
+    assert unis(index.suggest("fish")) == ["ef5678"]
+
+
+def test_failed_refresh_keeps_the_last_list(index):
+    index, _ = index
+
+    async def failing(previous_etag):
+        raise RuntimeError("auth down")
+
+    index.load = failing
+    index.refresh_every = 0
+
+    async def main():
+        task = asyncio.create_task(index._run())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert unis(index.suggest("alice")) == ["ab1234"]
@@ -0,0 +1,99 @@
+import asyncio
+import httpx
+import pytest
+from fastapi import HTTPException
+from resources import video_resource
+from utils import http_client, projection
+from utils.page_cache import BlockPageCache
+from utils.projection import compile_fields
+from utils.settings import Settings
+
+VIDEO = {
+    "video_id": "v1",
+    "title": "Lecture 1",
+    "course_id": "C1",
+    "duration": 3600,
+    "metadata": {"title": "Lecture 1", "codec": "h264", "size": 10},
+}
+
+
+def test_no_fields_means_no_projection():
+    assert compile_fields(None) is None
+    assert compile_fields(" , ") is None
+
+
+def test_keeps_listed_keys_and_video_id():
+    plan = compile_fields("title,course_id")
+    assert plan.apply(VIDEO) == {"video_id": "v1", "title": "Lecture 1", "course_id": "C1"}
+
+
+def test_order_duplicates_and_spaces_share_one_plan():
+    assert compile_fields("title, course_id") is compile_fields("course_id,title,title")
+
+
+def test_dotted_names_select_inside_objects():
+    plan = compile_fields("metadata.codec,title")
+    assert plan.apply(VIDEO) == {"video_id": "v1", "title": "Lecture 1", "metadata": {"codec": "h264"}}
+
+
+def test_whole_object_wins_over_parts():
+    plan = compile_fields("metadata,metadata.codec")
+    assert plan.apply(VIDEO)["metadata"] == VIDEO["metadata"]
+
+
+def test_unknown_keys_are_absent():
+    assert compile_fields("nope,metadata.nope").apply(VIDEO) == {"video_id": "v1", "metadata": {}}
+
+
+def test_keep_survives_unless_parts_were_picked():
+    assert compile_fields("title", keep=("metadata",)).apply(VIDEO)["metadata"] == VIDEO["metadata"]
+    assert compile_fields("metadata.size", keep=("metadata",)).apply(VIDEO)["metadata"] == {"size": 10}
+
+
+def test_items_are_copied_not_modified():
+    item = dict(VIDEO)
+    [trimmed] = compile_fields("title").apply_all([item])
+    trimmed["title"] = "changed"
+    assert item == VIDEO
+
+
+def test_non_dict_items_pass_through():
+    assert compile_fields("title").apply_all(["v1", None]) == ["v1", None]
+
+
+@pytest.mark.parametrize("fields", ["title,1abc", "metadata..codec", "title;drop"])
+def test_invalid_names_are_a_400(fields):
+    with pytest.raises(HTTPException) as e:
+        compile_fields(fields)
+    assert e.value.status_code == 400
+
+
+def test_too_many_names_are_a_400(monkeypatch):
+    monkeypatch.setattr(projection, "PROJECTION_MAX_FIELDS", 2)
+    with pytest.raises(HTTPException) as e:
+        compile_fields("a,b,c")
+    assert e.value.status_code == 400
+
+
+def test_search_projects_pages_without_touching_cached_blocks(monkeypatch, request):
+    def handler(req):
+        offset, limit = int(req.url.params["offset"]), int(req.url.params["limit"])
+        return httpx.Response(200, json={"items": [dict(VIDEO, video_id=f"v{n}") for n in range(offset, offset + limit)]})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://search")
+    pages = BlockPageCache(f"test_pages_{request.node.name}", 10, ttl=30)
+    monkeypatch.setitem(http_client._clients, "search", client)
+    monkeypatch.setattr(video_resource, "SEARCH_PAGE_CACHE", True)
+    monkeypatch.setattr(video_resource, "search_pages", pages)
+    settings = Settings(search_service_url="http://search")
+    user = {"uid": "u1", "role": "student", "token": "t1"}
+
+    async def main():
+        trimmed = await video_resource.search_videos(q="x", limit=2, fields="title", user=user, settings=settings)
+        whole = await video_resource.search_videos(q="x", limit=2, user=user, settings=settings)
+        return trimmed, whole
+
+    trimmed, whole = asyncio.run(main())
+    assert trimmed["items"] == [{"video_id": "v0", "title": "Lecture 1"}, {"video_id": "v1", "title": "Lecture 1"}]
+    assert whole["items"][0] == dict(VIDEO, video_id="v0")
+    assert trimmed["next_cursor"] and "fields=title" in trimmed["links"][-1]["href"]
@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from utils.response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(request):
+    return ResponseCache(f"test_swr_{request.node.name}", ttl=60, max_stale=3600)
+
+
+class Upstream:
+    def __init__(self):
+        self.version = 0
+        self.calls = 0
+        self.gate = None
+
+    async def fetch(self, previous):
+        self.calls += 1
+        version = self.version
+        if self.gate is not None:
+            await self.gate.wait()
+        return f"v{version}"
+
+
+def expire(cache, key):
+    entry = cache.entries.get(key)
+    cache.entries.set(key, {**entry, "fetched_at": entry["fetched_at"] - entry["ttl"]})
+
+
+def test_fresh_entry_is_served_from_cache(cache):
+    upstream = Upstream()
+
+    async def main():
+        first = await cache.get_or_fetch("k", upstream.fetch)
+        upstream.version = 1
+        return first, await cache.get_or_fetch("k", upstream.fetch)
+
+    assert asyncio.run(main()) == ("v0", "v0")
+    assert upstream.calls == 1
+
+
+def test_stale_entry_is_served_while_refreshing(cache):
+    upstream = Upstream()
+
+    async def main():
+        await cache.get_or_fetch("k", upstream.fetch)
+        expire(cache, "k")
+        upstream.version = 1
+        stale = await cache.get_or_fetch("k", upstream.fetch)
+        await asyncio.gather(*cache._refreshing.values())
+        return stale, cache.entries.get("k")["value"]
+
+    assert asyncio.run(main()) == ("v0", "v1")
+    assert cache.stale_served == 1
+
+
+def test_invalidate_cancels_the_pending_refresh(cache):
+    upstream = Upstream()
+
+    async def main():
+        await cache.get_or_fetch("k", upstream.fetch)
+        expire(cache, "k")
+        upstream.version = 1
+        upstream.gate = asyncio.Event()
+        await cache.get_or_fetch("k", upstream.fetch)
+        refresh = cache._refreshing["k"]
+        await asyncio.sleep(0)
+
+        cache.invalidate("k")
+        upstream.gate.set()
+        await asyncio.gather(refresh, return_exceptions=True)
+        return refresh.cancelled(), cache.entries.get("k")
+
+    assert asyncio.run(main()) == (True, None)
+
+
+def test_refresh_started_before_invalidate_is_dropped(cache):
+    upstream = Upstream()
+
+    async def main():
+        await cache.get_or_fetch("k", upstream.fetch)
+        expire(cache, "k")
+        upstream.version = 1
+        upstream.gate = asyncio.Event()
+        await cache.get_or_fetch("k", upstream.fetch)
+        refresh = cache._refreshing["k"]
+        await asyncio.sleep(0)
+
+        # The refresh outlives its cancellation (e.g. it ignores it)
+        cache._generations["k"] = 1
+        upstream.gate.set()
+        await refresh
+        return cache.entries.get("k")["value"]
+
+    assert asyncio.run(main()) == "v0"
+
+
+def test_fill_invalidated_mid_fetch_is_not_kept(cache):
+    upstream = Upstream()
+    upstream.gate = asyncio.Event()
+
+    async def main():
+        pending = asyncio.create_task(cache.get_or_fetch("k", upstream.fetch))
+        await asyncio.sleep(0)
+        cache.invalidate("k")
+        upstream.gate.set()
+        return await pending, cache.entries.get("k")
+
+    assert asyncio.run(main()) == ("v0", None)
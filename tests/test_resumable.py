@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import httpx
+import pytest
+from fastapi import HTTPException
+from bench import stubs
+from utils import gcs_auth, http_client, resumable
+
+UNIT = resumable.GRANULARITY
+SIZE = 3 * UNIT + 1000
+DATA = (hashlib.sha256(b"seed").digest() * (SIZE // 32 + 1))[:SIZE]
+
+
+class StubTransport(httpx.AsyncBaseTransport):
+    """
+    The bench GCS stub over ASGI. Chunk PUTs numbered in `lose` are
+    persisted by the stub but their response is dropped, as after a
+    network timeout.
+    """
+
+    def __init__(self, lose=()):
+        profile = stubs.load_profile()
+        profile["gcs"]["chunk"] = {"latency": {"dist": "fixed", "ms": 0}, "error_rate": 0.0}
+        self.inner = httpx.ASGITransport(app=stubs.gcs_app(profile))
+        self.lose = set(lose)
+        self.chunk_puts = 0
+        self.queries = 0
+        self.authorization = []
+
+    async def handle_async_request(self, request):
+        self.authorization.append(request.headers.get("authorization"))
+        response = await self.inner.handle_async_request(request)
+        if request.method == "PUT":
+            if request.headers["content-range"].startswith("bytes */"):
+                self.queries += 1
+            else:
+                self.chunk_puts += 1
+                if self.chunk_puts in self.lose:
+                    await response.aclose()
+                    raise httpx.ReadTimeout("response lost", request=request)
+        return response
+
+
+class FixedTokenSource(gcs_auth._TokenSource):
+    async def _fetch(self):
+        return "gcs-token", 3600
+
+
+@pytest.fixture
+def target(monkeypatch):
+    def install(lose=()):
+        transport = StubTransport(lose)
+        client = httpx.AsyncClient(base_url="http://gcs", transport=transport)
+        monkeypatch.setitem(http_client._clients, "gcs", client)
+        return transport
+
+    # open_session() authenticates; chunk PUTs only for `authorized` sessions
+    monkeypatch.setattr(gcs_auth, "_token_source", FixedTokenSource())
+    monkeypatch.setattr(resumable, "UPLOAD_CHUNK_SIZE", UNIT)
+    monkeypatch.setattr(resumable.retry, "backoff", lambda attempt: 0)
+    return install
+
+
+async def body(data, piece=100_000):
+    for i in range(0, len(data), piece):
+        yield data[i:i + piece]
+
+
+def upload(data, offset=0, session_url=None, authorized=False):
+    """
+    Pipes `data` from `offset`; returns (session_url, offset, result, chunks).
+    """
+    chunks = []
+
+    async def on_chunk(start, length, checksum, result):
+        chunks.append((start, length, checksum))
+
+    async def main():
+        url = session_url or await resumable.open_session("bucket", "v.mp4", SIZE, "video/mp4")
+        end, result = await resumable.pipe(url, SIZE, offset, body(data), on_chunk, authorized=authorized)
+        return url, end, result
+
+    url, end, result = asyncio.run(main())
+    return url, end, result, chunks
+
+
+def test_whole_file(target):
+    transport = target()
+    _, end, result, chunks = upload(DATA)
+
+    assert end == SIZE
+    assert [(start, length) for start, length, _ in chunks] == [
+        (0, UNIT), (UNIT, UNIT), (2 * UNIT, UNIT), (3 * UNIT, 1000)
+    ]
+    for start, length, checksum in chunks:
+        assert checksum == resumable.chunk_checksum(DATA[start:start + length])
+    assert result["size"] == str(SIZE)
+    assert resumable.verify_result(result, resumable.chunk_checksum(DATA)) is True
+    assert resumable.verify_result(result, resumable.chunk_checksum(b"other")) is False
+    assert transport.chunk_puts == 4
+
+
+def test_resume_after_a_short_body(target):
+    target()
+    cut = UNIT + 5000
+    url, end, result, chunks = upload(DATA[:cut])
+
+    # Only whole 256 KiB units are sent before the body ends early
+    assert (end, result) == (UNIT, None)
+    assert [(start, length) for start, length, _ in chunks] == [(0, UNIT)]
+
+    _, end, result, _ = upload(DATA[end:], offset=end, session_url=url)
+    assert end == SIZE
+    assert resumable.verify_result(result, resumable.chunk_checksum(DATA)) is True
+
+
+def test_lost_response_is_recovered_from_the_committed_offset(target):
+    transport = target(lose={2})
+    _, end, result, chunks = upload(DATA)
+
+    assert end == SIZE
+    assert resumable.verify_result(result, resumable.chunk_checksum(DATA)) is True
+    # The lost chunk was persisted, so it is not sent again
+    assert transport.chunk_puts == 4
+    assert transport.queries == 1
+    assert [start for start, _, _ in chunks] == [0, UNIT, 2 * UNIT, 3 * UNIT]
+
+
+def test_body_larger_than_declared(target):
+    target()
+    with pytest.raises(HTTPException) as e:
+        upload(DATA + b"extra")
+    assert e.value.status_code == 400
+
+
+def test_handed_out_sessions_get_no_gcs_credentials(target, monkeypatch):
+    # The default metadata-server source, unreachable here: a token fetch would fail
+    monkeypatch.setattr(gcs_auth, "_token_source", gcs_auth.MetadataTokenSource())
+    transport = target()
+
+    async def session_url():
+        res = await transport.inner.handle_async_request(
+            httpx.Request("POST", "http://gcs/upload/storage/v1/b/bucket/o?uploadType=resumable")
+        )
+        return res.headers["location"]
+
+    url = asyncio.run(session_url())
+    _, end, result, _ = upload(DATA, session_url=url)
+
+    assert end == SIZE and result is not None
+    assert transport.authorization == [None] * transport.chunk_puts
+
+
+def test_opened_sessions_carry_the_gcs_token(target):
+    transport = target()
+    _, end, _, _ = upload(DATA, authorized=True)
+
+    assert end == SIZE
+    # open_session plus every chunk PUT
+    assert transport.authorization == ["Bearer gcs-token"] * (1 + transport.chunk_puts)
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"value": 1}
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {"calls": 1, "collapsed": 4, "inflight": 0}
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight("test")
+
+    async def main():
+        async def value(v):
+            await asyncio.sleep(0)
+            return v
+        return await asyncio.gather(flight.do("a", lambda: value("a")), flight.do("b", lambda: value("b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert flight.calls == 2
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flight = SingleFlight("test")
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0)
+        raise RuntimeError("upstream down")
+
+    async def main():
+        results = await asyncio.gather(flight.do("k", failing), flight.do("k", failing), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        with pytest.raises(RuntimeError):
+            await flight.do("k", failing)
+
+    asyncio.run(main())
+    assert len(attempts) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    flight = SingleFlight("test")
+
+    async def main():
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(flight.do("k", slow))
+        second = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        return await second, first.cancelled()
+
+    assert asyncio.run(main()) == ("done", True)
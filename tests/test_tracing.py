@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from utils import tracing
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SAMPLED = f"00-{TRACE_ID}-00f067aa0ba902b7-01".encode()
+
+
+class RecordingExporter:
+    def __init__(self):
+        self.spans = []
+
+    def submit(self, span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    recording = RecordingExporter()
+    monkeypatch.setattr(tracing, "_exporter", recording)
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0.0)
+    return recording
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def call(headers):
+    scope = {"type": "http", "method": "GET", "path": "/ping", "headers": headers}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(tracing.TracingMiddleware(ok_app)(scope, receive, send))
+    return dict(sent[0]["headers"])[b"traceparent"].decode()
+
+
+def test_upstream_sampled_flag_is_ignored_by_default(exporter):
+    traceparent = call([(b"traceparent", SAMPLED)])
+
+    assert traceparent.startswith(f"00-{TRACE_ID}-")
+    assert traceparent.endswith("-00")
+    assert exporter.spans == []
+
+
+def test_upstream_sampled_flag_is_followed_when_enabled(exporter, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FOLLOW_UPSTREAM", True)
+
+    traceparent = call([(b"traceparent", SAMPLED)])
+
+    assert traceparent.endswith("-01")
+    assert [span.trace_id for span in exporter.spans] == [TRACE_ID]
+
+
+def test_sample_rate_applies_to_new_traces(exporter, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+
+    assert call([]).endswith("-01")
+    assert len(exporter.spans) == 1
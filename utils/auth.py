@@ -1,45 +1,79 @@
-from fastapi import Header, HTTPException
-import requests
-import os
-from dotenv import load_dotenv
+from fastapi import Depends, Header, HTTPException
+from utils import http_client
+from utils.cache import make_cache
+from utils import firebase
+from utils.log import get_logger, summarize
+import httpx
+import time
+import json
+import base64
+import hashlib
+from utils.settings import Settings, get_settings
+from utils import tracing
 
+# Verified tokens are cached for at most TOKEN_CACHE_TTL seconds and never past
+# the token's own `exp`. Rejected tokens are remembered for TOKEN_NEGATIVE_TTL.
+_settings = get_settings()
+TOKEN_CACHE_TTL = _settings.token_cache_ttl
+TOKEN_NEGATIVE_TTL = _settings.token_negative_ttl
+TOKEN_CACHE_SIZE = _settings.token_cache_size
 
-def verify_token(authorization: str = Header(None)):
+logger = get_logger("verify_token")
+
+token_cache = make_cache("verify_token", max_entries=TOKEN_CACHE_SIZE, default_ttl=TOKEN_CACHE_TTL)
+
+
+def _token_key(id_token):
+    # Never keep raw bearer tokens as cache keys
+    return hashlib.sha256(id_token.encode()).hexdigest()
+
+
+def _token_expiry(id_token):
     """
-    Verifies the Firebase ID token by delegating to the Auth microservice.
-    Returns UID, email, role, and the raw token.
+    Reads the `exp` claim without verifying the signature (the Auth service
+    does that). Returns None if the token is not a decodable JWT.
     """
-    # Load environment variables
-    load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "../.env"))
-    AUTH_URL = os.getenv("AUTH_SERVICE_URL")
-
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing Authorization header")
+    try:
+        payload = id_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except Exception:
+        return None
 
-    if not AUTH_URL:
-        raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
-    # Expect format: "Bearer <token>"
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid Authorization header")
+def _positive_ttl(id_token):
+    exp = _token_expiry(id_token)
+    if exp is None:
+        return TOKEN_CACHE_TTL
+    return min(TOKEN_CACHE_TTL, exp - time.time())
 
-    # Extract token
-    id_token = authorization.split(" ")[1]
 
-    print(f"[DEBUG] Verifying token via: {AUTH_URL}")
-    print(f"[DEBUG] Header being sent: {authorization[:50]}...")
+async def _verify_remote(authorization, id_token, key):
+    """
+    Delegates verification (and role lookup) to the Auth microservice.
+    """
+    if not http_client.service_url("auth"):
+        raise HTTPException(status_code=500, detail="AUTH_SERVICE_URL not set")
 
     try:
         # Call the AUTH service to verify the token
-        res = requests.get(f"{AUTH_URL}/auth/verify-token", headers={"Authorization": authorization}, timeout=5)
+        res = await http_client.request(
+            "auth", "GET", "/auth/verify-token",
+            priority=http_client.PRIORITY_HIGH,
+            headers={"Authorization": authorization},
+        )
 
-        print(f"[DEBUG] Auth responded with status: {res.status_code}")
-        print(f"[DEBUG] Auth response body: {res.text}")
+        logger.debug("Auth verify-token responded %s: %s", res.status_code, summarize(res))
 
         if res.status_code != 200:
+            detail = f"Auth verification failed: {res.text}"
+            # Only remember definite rejections, not Auth service hiccups
+            if res.status_code in (401, 403):
+                token_cache.set(key, {"error": (res.status_code, detail)}, ttl=TOKEN_NEGATIVE_TTL)
             raise HTTPException(
                 status_code=res.status_code,
-                detail=f"Auth verification failed: {res.text}",
+                detail=detail,
             )
 
         data = res.json()
@@ -49,14 +83,77 @@ def verify_token(authorization: str = Header(None)):
             "uid": data.get("uid"),
             "email": data.get("email"),
             "role": data.get("role", "faculty"),
-            "token": id_token,   # <-- this is what Search needs
         }
 
-    except requests.Timeout:
+    except HTTPException:
+        raise
+
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Auth service timeout")
 
-    except requests.ConnectionError:
+    except httpx.TransportError:
         raise HTTPException(status_code=503, detail="Auth service unavailable")
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Auth verification error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Auth verification error: {str(e)}")
+
+
+async def _verify_local(authorization, id_token, key):
+    """
+    Verifies the token in-process against Firebase's signing keys.
+    Falls back to the Auth microservice only when the token carries no
+    `role` custom claim.
+    """
+    try:
+        claims = await firebase.verify_id_token(id_token)
+    except HTTPException as e:
+        if e.status_code == 401:
+            token_cache.set(key, {"error": (e.status_code, e.detail)}, ttl=TOKEN_NEGATIVE_TTL)
+        raise
+
+    role = claims.get("role")
+    if role is None:
+        # Signature is already checked; Auth is only asked for the role
+        return await _verify_remote(authorization, id_token, key)
+
+    return {
+        "uid": claims.get("user_id") or claims["sub"],
+        "email": claims.get("email"),
+        "role": role,
+    }
+
+
+async def verify_token(authorization: str = Header(None), settings: Settings = Depends(get_settings)):
+    """
+    Verifies the Firebase ID token, either by delegating to the Auth
+    microservice ("remote") or locally when AUTH_VERIFY_MODE=local.
+    Returns UID, email, role, and the raw token.
+    Results are cached per token hash (see TOKEN_CACHE_TTL / TOKEN_NEGATIVE_TTL).
+    """
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing Authorization header")
+
+    # Expect format: "Bearer <token>"
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid Authorization header")
+
+    # Extract token
+    id_token = authorization.split(" ")[1]
+
+    with tracing.span("verify_token", mode=settings.auth_verify_mode) as span:
+        key = _token_key(id_token)
+        cached = token_cache.get(key)
+        span.set("cache", "hit" if cached is not None else "miss")
+        if cached is not None:
+            if "error" in cached:
+                status_code, detail = cached["error"]
+                raise HTTPException(status_code=status_code, detail=detail)
+            return {**cached, "token": id_token}
+
+        if settings.auth_verify_mode == "local":
+            user = await _verify_local(authorization, id_token, key)
+        else:
+            user = await _verify_remote(authorization, id_token, key)
+
+        token_cache.set(key, user, ttl=_positive_ttl(id_token))
+        return {**user, "token": id_token}   # <-- token is what Search needs
@@ -0,0 +1,488 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from utils import metrics
+from utils.singleflight import SingleFlight
+from utils.log import get_logger
+from utils.settings import get_settings, override
+
+logger = get_logger("cache")
+
+# ---------------------------------------------------------
+# Cache backends: in-process TTL + LRU, or shared SQLite (WAL)
+# ---------------------------------------------------------
+# Every composite cache (verified tokens, users, catalog entries, validators,
+# compressed bodies) is created through `make_cache()` and speaks the same
+# small interface: get / set / delete / purge / clear / stats, plus an async
+# get_or_compute() that runs the computation once per key.
+#
+# CACHE_BACKEND=memory (default) keeps one cache per process. CACHE_BACKEND=
+# sqlite stores entries in one WAL-mode SQLite file shared by every uvicorn
+# worker on the VM, so N workers share one warm cache that also survives
+# restarts. <NAME>_CACHE_BACKEND overrides the backend of a single cache
+# (e.g. COMPRESSED_CACHE_BACKEND=memory). Values in shared caches must pickle.
+#
+# Every cache registers itself by name so its counters can be reported from
+# the admin endpoints.
+#
+# CACHE_SQLITE_PATH        database file (default <tmpdir>/composite-cache-<uid>/cache.sqlite3,
+#                          a 0700 directory; files owned by another user are refused)
+# CACHE_SQLITE_LEASE       seconds a worker may hold a get_or_compute lease (10)
+# CACHE_SQLITE_BUSY_MS     longest wait for another worker's write lock (50)
+
+_settings = get_settings()
+CACHE_BACKEND = _settings.cache_backend
+CACHE_SQLITE_PATH = _settings.cache_sqlite_path
+CACHE_SQLITE_LEASE = _settings.cache_sqlite_lease
+CACHE_SQLITE_BUSY_MS = _settings.cache_sqlite_busy_ms
+
+_registry = {}
+_MISSING = object()
+
+
+class CacheBackend:
+    """
+    Shared behaviour of the backends. Subclasses implement get/set/delete/
+    purge/clear/__len__ and `_counts()`.
+    """
+
+    backend = None
+
+    def __init__(self, name, max_entries, default_ttl):
+        self.name = name
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._computing = SingleFlight(f"cache:{name}")
+        _registry[name] = self
+
+    async def get_or_compute(self, key, compute, ttl=None):
+        """
+        Returns the cached value for `key`, or awaits `compute()` (a coroutine
+        function), caches and returns its result. Concurrent callers for one
+        key share a single computation.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        async def fill():
+            value = await compute()
+            self.set(key, value, ttl)
+            return value
+
+        return await self._computing.do(key, fill)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class TTLCache(CacheBackend):
+    """
+    In-process LRU cache whose entries also expire after a per-entry TTL.
+    Not thread-safe: it is only touched from the event loop.
+    """
+
+    backend = "memory"
+
+    def __init__(self, name, max_entries=1024, default_ttl=60.0):
+        super().__init__(name, max_entries, default_ttl)
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        return self._data.pop(key, None) is not None
+
+    def purge(self, prefix=None):
+        """
+        Drops every entry (or only string keys starting with `prefix`).
+        Returns the number of entries removed.
+        """
+        if prefix is None:
+            count = len(self._data)
+            self._data.clear()
+            return count
+
+        keys = [k for k in self._data if isinstance(k, str) and k.startswith(prefix)]
+        for k in keys:
+            del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache stored in a shared SQLite database in WAL mode, so readers in other
+    workers never block on a writer. Entries expire by wall-clock time and are
+    trimmed least-recently-used first once a cache exceeds max_entries.
+    Calls are synchronous: single-row lookups on a local file take
+    microseconds, less than handing them to a thread would.
+
+    Reads never write (WAL readers do not wait for writers): expired rows are
+    left to the periodic trim and last-access times are buffered and flushed
+    with the next set. Writes wait at most CACHE_SQLITE_BUSY_MS for another
+    worker's lock. The cache fails open: any SQLite error is logged and
+    treated as a miss (get) or a no-op (set, delete), never raised into the
+    request.
+    """
+
+    backend = "sqlite"
+    TRIM_EVERY = 32          # sets between size checks
+    ACCESS_RESOLUTION = 5.0  # seconds; limits last-access writes on hot keys
+    ERROR_LOG_EVERY = 10.0   # seconds between logged SQLite errors per cache
+
+    def __init__(self, name, max_entries=1024, default_ttl=60.0, path=None):
+        super().__init__(name, max_entries, default_ttl)
+        self._db = _sqlite_connection(path or CACHE_SQLITE_PATH or _default_path())
+        self._sets = 0
+        self._touched = {}
+        self.errors = 0
+        self._error_logged_at = 0.0
+
+    @staticmethod
+    def _key(key):
+        return key if isinstance(key, str) else repr(key)
+
+    def _execute(self, sql, params=(), many=False):
+        """
+        Runs one statement; on any SQLite error (e.g. "database is locked")
+        counts and logs it and returns None instead of raising.
+        """
+        try:
+            if many:
+                return self._db.executemany(sql, params)
+            return self._db.execute(sql, params)
+        except _sqlite3().Error as e:
+            self.errors += 1
+            now = time.monotonic()
+            if now - self._error_logged_at >= self.ERROR_LOG_EVERY:
+                self._error_logged_at = now
+                logger.warning("Cache '%s' SQLite error, failing open (%d so far): %r", self.name, self.errors, e)
+            return None
+
+    def _peek(self, key):
+        cursor = self._execute(
+            "SELECT value, expires_at, accessed FROM cache WHERE name = ? AND key = ?",
+            (self.name, key),
+        )
+        row = cursor.fetchone() if cursor is not None else None
+        if row is None:
+            return _MISSING
+
+        value, expires_at, accessed = row
+        now = time.time()
+        if expires_at <= now:
+            # Removed by the next trim
+            self.expirations += 1
+            return _MISSING
+        try:
+            value = _pickle().loads(value)
+        except Exception:
+            # Written by an incompatible version of the code; overwritten on the next set
+            return _MISSING
+        if now - accessed > self.ACCESS_RESOLUTION:
+            self._touched[key] = now
+        return value
+
+    def _flush_access(self):
+        """
+        Writes buffered last-access times; False if the database is unusable.
+        """
+        if not self._touched:
+            return True
+        touched, self._touched = self._touched, {}
+        return self._execute(
+            "UPDATE cache SET accessed = ? WHERE name = ? AND key = ?",
+            [(at, self.name, key) for key, at in touched.items()],
+            many=True,
+        ) is not None
+
+    def get(self, key, default=None):
+        value = self._peek(self._key(key))
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        pickle = _pickle()
+        try:
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning("Cache '%s' cannot store %r: %r", self.name, key, e)
+            return
+
+        now = time.time()
+        if not self._flush_access():
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO cache (name, key, value, expires_at, accessed) VALUES (?, ?, ?, ?, ?)",
+            (self.name, self._key(key), blob, now + ttl, now),
+        )
+        self._sets += 1
+        if self._sets % self.TRIM_EVERY == 0:
+            self._trim(now)
+
+    def _trim(self, now):
+        self._execute(
+            "DELETE FROM cache WHERE name = ? AND expires_at <= ?", (self.name, now)
+        )
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self._execute(
+                "DELETE FROM cache WHERE name = ? AND key IN "
+                "(SELECT key FROM cache WHERE name = ? ORDER BY accessed LIMIT ?)",
+                (self.name, self.name, excess),
+            )
+            self.evictions += excess
+
+    def delete(self, key):
+        cursor = self._execute(
+            "DELETE FROM cache WHERE name = ? AND key = ?", (self.name, self._key(key))
+        )
+        return cursor is not None and cursor.rowcount > 0
+
+    def purge(self, prefix=None):
+        """
+        Drops every entry (or only keys starting with `prefix`).
+        Returns the number of entries removed.
+        """
+        if prefix is None:
+            cursor = self._execute("DELETE FROM cache WHERE name = ?", (self.name,))
+        else:
+            cursor = self._execute(
+                "DELETE FROM cache WHERE name = ? AND substr(key, 1, ?) = ?",
+                (self.name, len(prefix), prefix),
+            )
+        return cursor.rowcount if cursor is not None else 0
+
+    def clear(self):
+        self.purge()
+
+    def __len__(self):
+        cursor = self._execute("SELECT COUNT(*) FROM cache WHERE name = ?", (self.name,))
+        return cursor.fetchone()[0] if cursor is not None else 0
+
+    async def get_or_compute(self, key, compute, ttl=None):
+        """
+        Like the in-memory version, but also atomic across workers: the
+        worker that takes the lease computes, the others wait for its result
+        (or compute themselves if the lease expires first).
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        db_key = self._key(key)
+
+        async def fill():
+            delay = 0.01
+            deadline = time.time() + CACHE_SQLITE_LEASE
+            while not self._take_lease(db_key):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.2)
+                value = self._peek(db_key)
+                if value is not _MISSING:
+                    return value
+                if time.time() >= deadline:
+                    break
+            try:
+                value = await compute()
+                self.set(key, value, ttl)
+                return value
+            finally:
+                self._execute(
+                    "DELETE FROM leases WHERE name = ? AND key = ?", (self.name, db_key)
+                )
+
+        return await self._computing.do(key, fill)
+
+    def _take_lease(self, db_key):
+        now = time.time()
+        cursor = self._execute(
+            "DELETE FROM leases WHERE name = ? AND key = ? AND expires_at <= ?",
+            (self.name, db_key, now),
+        )
+        if cursor is None:
+            return True
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO leases (name, key, expires_at) VALUES (?, ?, ?)",
+            (self.name, db_key, now + CACHE_SQLITE_LEASE),
+        )
+        # Without a working database, compute locally rather than wait
+        return cursor is None or cursor.rowcount == 1
+
+    def stats(self):
+        return {**super().stats(), "errors": self.errors}
+
+
+_connections = {}
+
+
+def _sqlite3():
+    import sqlite3
+    return sqlite3
+
+
+def _pickle():
+    # Only the shared backend pickles; keep it off the import path
+    import pickle
+    return pickle
+
+
+def _default_path():
+    """
+    <tmpdir>/composite-cache-<uid>/cache.sqlite3, in a directory only this
+    user can enter (the shared tmpdir is writable by everyone).
+    """
+    import tempfile
+    directory = os.path.join(tempfile.gettempdir(), f"composite-cache-{os.getuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not os.path.isdir(directory) or os.path.islink(directory) or st.st_uid != os.getuid():
+        raise PermissionError(f"Refusing cache directory {directory}: not a directory owned by uid {os.getuid()}")
+    if st.st_mode & 0o077:
+        raise PermissionError(f"Refusing cache directory {directory}: accessible to other users")
+    return os.path.join(directory, "cache.sqlite3")
+
+
+def _claim_database(path):
+    """
+    Creates the database file 0600, or checks that an existing one (and its
+    WAL files) belongs to this user and makes it 0600: entries are unpickled,
+    so a file someone else can write is code they can run in this process.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    os.close(fd)
+    for name in (path, path + "-wal", path + "-shm"):
+        try:
+            st = os.lstat(name)
+        except FileNotFoundError:
+            continue
+        if st.st_uid != os.getuid():
+            raise PermissionError(f"Refusing cache database {name}: owned by uid {st.st_uid}, not {os.getuid()}")
+        if st.st_mode & 0o077:
+            os.chmod(name, 0o600)
+
+
+def _sqlite_connection(path):
+    """
+    One autocommit connection per database file and process.
+    """
+    db = _connections.get(path)
+    if db is None:
+        _claim_database(path)
+        import sqlite3
+        db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=CACHE_SQLITE_BUSY_MS / 1000
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " name TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+            " expires_at REAL NOT NULL, accessed REAL NOT NULL,"
+            " PRIMARY KEY (name, key)) WITHOUT ROWID"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (name, accessed)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT NOT NULL, key TEXT NOT NULL, expires_at REAL NOT NULL,"
+            " PRIMARY KEY (name, key)) WITHOUT ROWID"
+        )
+        _connections[path] = db
+    return db
+
+
+def make_cache(name, max_entries=1024, default_ttl=60.0):
+    """
+    Creates the cache `name` on the configured backend (CACHE_BACKEND, or
+    <NAME>_CACHE_BACKEND for this cache only).
+    """
+    backend = override(f"{name.upper()}_CACHE_BACKEND", str.lower, CACHE_BACKEND)
+    if backend == "sqlite":
+        return SQLiteCache(name, max_entries=max_entries, default_ttl=default_ttl)
+    if backend != "memory":
+        raise ValueError(f"Unknown cache backend '{backend}' for cache '{name}'")
+    return TTLCache(name, max_entries=max_entries, default_ttl=default_ttl)
+
+
+def get_cache(name):
+    return _registry.get(name)
+
+
+def all_stats():
+    """
+    Counters for every registered cache, keyed by cache name.
+    """
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+def _collect():
+    stats = all_stats()
+    return [
+        ("composite_cache_hits_total", "counter", "Cache hits per cache.",
+         [({"cache": name}, s["hits"]) for name, s in stats.items()]),
+        ("composite_cache_misses_total", "counter", "Cache misses per cache.",
+         [({"cache": name}, s["misses"]) for name, s in stats.items()]),
+        ("composite_cache_evictions_total", "counter", "LRU evictions per cache.",
+         [({"cache": name}, s["evictions"]) for name, s in stats.items()]),
+        ("composite_cache_hit_ratio", "gauge", "Hit ratio since start per cache.",
+         [({"cache": name}, s["hit_ratio"]) for name, s in stats.items()]),
+        ("composite_cache_entries", "gauge", "Entries currently held per cache.",
+         [({"cache": name}, s["size"]) for name, s in stats.items()]),
+    ]
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,214 @@
+import time
+from collections import deque
+from utils.errors import DownstreamRejected
+from utils import metrics
+from utils.settings import get_settings
+
+# ---------------------------------------------------------
+# Per-downstream circuit breakers and adaptive timeouts
+# ---------------------------------------------------------
+# A breaker watches a rolling window of call outcomes for one service. When the
+# error rate crosses the threshold it opens and calls fail fast with 503 instead
+# of each waiting out the full timeout. After BREAKER_OPEN_SECONDS it lets a few
+# probe calls through (half-open); if they succeed it closes again.
+#
+# Timeouts for idempotent GETs adapt per route to the observed p99 latency, so
+# a degraded upstream is given up on quickly while healthy routes keep working.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_settings = get_settings()
+BREAKER_WINDOW_SECONDS = _settings.breaker_window_seconds
+BREAKER_MIN_CALLS = _settings.breaker_min_calls
+BREAKER_ERROR_RATE = _settings.breaker_error_rate
+BREAKER_OPEN_SECONDS = _settings.breaker_open_seconds
+BREAKER_HALF_OPEN_PROBES = _settings.breaker_half_open_probes
+
+ADAPTIVE_TIMEOUTS = _settings.adaptive_timeouts
+ADAPTIVE_TIMEOUT_MULTIPLIER = _settings.adaptive_timeout_multiplier
+ADAPTIVE_TIMEOUT_MIN = _settings.adaptive_timeout_min
+ADAPTIVE_MIN_SAMPLES = 50
+
+
+class CircuitBreaker:
+    def __init__(self, service):
+        self.service = service
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.transitions = {OPEN: 0, HALF_OPEN: 0, CLOSED: 0}
+        self.rejected = 0
+        self._calls = deque()          # (timestamp, ok)
+        self._failures = 0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+    def _transition(self, state):
+        self.state = state
+        self.transitions[state] += 1
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        else:
+            self._calls.clear()
+            self._failures = 0
+
+    def before_call(self):
+        """
+        Admits a call or raises DownstreamRejected. Returns True when the call
+        is a half-open probe (it must be reported back through record()).
+        """
+        if self.state == OPEN:
+            remaining = self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise DownstreamRejected(
+                    self.service,
+                    f"{self.service.capitalize()} microservice unavailable (circuit open)",
+                    retry_after=remaining,
+                )
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= BREAKER_HALF_OPEN_PROBES:
+                self.rejected += 1
+                raise DownstreamRejected(
+                    self.service,
+                    f"{self.service.capitalize()} microservice unavailable (circuit half-open)",
+                    retry_after=1,
+                )
+            self._probes_in_flight += 1
+            return True
+
+        return False
+
+    def record(self, ok, probe=False):
+        now = time.monotonic()
+
+        if probe:
+            self._probes_in_flight -= 1
+            if self.state != HALF_OPEN:
+                return
+            if not ok:
+                self._transition(OPEN)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= BREAKER_HALF_OPEN_PROBES:
+                self._transition(CLOSED)
+            return
+
+        self._calls.append((now, ok))
+        if not ok:
+            self._failures += 1
+        while self._calls and self._calls[0][0] < now - BREAKER_WINDOW_SECONDS:
+            _, old_ok = self._calls.popleft()
+            if not old_ok:
+                self._failures -= 1
+
+        if (
+            self.state == CLOSED
+            and len(self._calls) >= BREAKER_MIN_CALLS
+            and self._failures / len(self._calls) >= BREAKER_ERROR_RATE
+        ):
+            self._transition(OPEN)
+
+    def release(self, probe):
+        """
+        Call was abandoned (e.g. cancelled) without an outcome.
+        """
+        if probe:
+            self._probes_in_flight -= 1
+
+    def snapshot(self):
+        calls = len(self._calls)
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "window_error_rate": round(self._failures / calls, 4) if calls else 0.0,
+            "rejected": self.rejected,
+            "opened": self.transitions[OPEN],
+        }
+
+
+class LatencyTracker:
+    """
+    Keeps the last few hundred latencies of one route and derives a timeout
+    from their p99. The percentile is recomputed every 32 samples, not per call.
+    """
+
+    def __init__(self, size=512):
+        self._samples = deque(maxlen=size)
+        self._since_recompute = 0
+        self.p50 = None
+        self.p95 = None
+        self.p99 = None
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+        self._since_recompute += 1
+        if self._since_recompute >= 32 and len(self._samples) >= ADAPTIVE_MIN_SAMPLES:
+            self._since_recompute = 0
+            ordered = sorted(self._samples)
+            last = len(ordered) - 1
+            self.p50 = ordered[int(last * 0.50)]
+            self.p95 = ordered[int(last * 0.95)]
+            self.p99 = ordered[int(last * 0.99)]
+
+    def timeout(self, ceiling):
+        if not ADAPTIVE_TIMEOUTS or self.p99 is None:
+            return ceiling
+        return min(ceiling, max(ADAPTIVE_TIMEOUT_MIN, self.p99 * ADAPTIVE_TIMEOUT_MULTIPLIER))
+
+
+breakers = {}
+latencies = {}
+
+
+def get_breaker(service):
+    breaker = breakers.get(service)
+    if breaker is None:
+        breaker = breakers[service] = CircuitBreaker(service)
+    return breaker
+
+
+def get_latency(service, route):
+    tracker = latencies.get((service, route))
+    if tracker is None:
+        tracker = latencies[(service, route)] = LatencyTracker()
+    return tracker
+
+
+def snapshot():
+    """
+    Breaker state plus observed latency per downstream, for /healthz.
+    """
+    result = {service: breaker.snapshot() for service, breaker in breakers.items()}
+    for (service, route), tracker in latencies.items():
+        if tracker.p99 is None:
+            continue
+        routes = result.setdefault(service, {}).setdefault("routes", {})
+        routes[route] = {
+            "p50_ms": round(tracker.p50 * 1000, 1),
+            "p99_ms": round(tracker.p99 * 1000, 1),
+        }
+    return result
+
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def _collect():
+    return [
+        ("downstream_circuit_state", "gauge", "Breaker state (0 closed, 1 half-open, 2 open).",
+         [({"service": name}, _STATE_VALUES[b.state]) for name, b in breakers.items()]),
+        ("downstream_circuit_rejected_total", "counter", "Calls failed fast by an open breaker.",
+         [({"service": name}, b.rejected) for name, b in breakers.items()]),
+        ("downstream_circuit_opened_total", "counter", "Times the breaker opened.",
+         [({"service": name}, b.transitions[OPEN]) for name, b in breakers.items()]),
+    ]
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,259 @@
+import asyncio
+import zlib
+from utils.cache import make_cache
+from utils import metrics
+from utils.settings import get_settings
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# ---------------------------------------------------------
+# Negotiated response compression
+# ---------------------------------------------------------
+# Pure ASGI middleware that compresses JSON/text bodies with the best encoding
+# the client accepts (br when the brotli package is installed, else gzip).
+# Bodies below the route's threshold are sent as-is.
+#
+# Responses that carry a strong ETag (cached catalog entries, video metadata,
+# search pages) are compressed once: the compressed bytes are kept keyed by
+# (ETag, encoding, level), so a hot cached entry is served many times without
+# being recompressed. The ETag of a compressed body is sent weak (W/"..."),
+# which still matches If-None-Match through weak comparison.
+#
+# COMPRESS_MIN_BYTES      default threshold (1024)
+# COMPRESS_LEVEL          default level (gzip 1-9, br 0-11; default 6 / 5)
+# COMPRESS_RULES          per-route overrides "path=min_bytes:level", e.g.
+#                         "/videos/search=512:6,/offerings=256:9"
+# COMPRESS_THREAD_BYTES   bodies at least this large are compressed off the
+#                         event loop (default 262144)
+# COMPRESSED_CACHE_SIZE   compressed bodies kept (default 512)
+
+_settings = get_settings()
+COMPRESS_MIN_BYTES = _settings.compress_min_bytes
+COMPRESS_LEVEL = _settings.compress_level
+COMPRESS_THREAD_BYTES = _settings.compress_thread_bytes
+
+DEFAULT_LEVELS = {"gzip": 6, "br": 5}
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+
+
+def _parse_rules(value):
+    rules = {}
+    for part in filter(None, (p.strip() for p in (value or "").split(","))):
+        route, _, rule = part.rpartition("=")
+        min_bytes, _, level = rule.partition(":")
+        rules[route] = (int(min_bytes), int(level) if level else None)
+    return rules
+
+
+COMPRESS_RULES = _parse_rules(_settings.compress_rules)
+
+compressed_cache = make_cache(
+    "compressed",
+    max_entries=_settings.compressed_cache_size,
+    default_ttl=_settings.compressed_cache_ttl,
+)
+
+COMPRESS_BYTES = metrics.Counter(
+    "http_compression_bytes_total", "Response bytes before/after compression.", ("encoding", "stage")
+)
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding):
+    """
+    Picks the encoding with the highest q-value the client accepts; on a tie
+    our own preference order (br, then gzip) wins. None means identity.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for encoding in available_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def route_rule(path):
+    min_bytes, level = COMPRESS_RULES.get(path, (COMPRESS_MIN_BYTES, None))
+    return min_bytes, level
+
+
+def _level(encoding, level):
+    if level is not None:
+        return level
+    if COMPRESS_LEVEL:
+        return int(COMPRESS_LEVEL)
+    return DEFAULT_LEVELS[encoding]
+
+
+def compress(body, encoding, level):
+    if encoding == "br":
+        return brotli.compress(body, quality=min(level, 11))
+    import gzip
+    return gzip.compress(body, compresslevel=min(max(level, 1), 9), mtime=0)
+
+
+async def compress_cached(body, encoding, level, etag=None):
+    """
+    Compressed body, reused across requests when the representation has a
+    strong ETag.
+    """
+    key = f"{etag}:{encoding}:{level}" if etag and not etag.startswith("W/") else None
+    if key is not None:
+        cached = compressed_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if len(body) >= COMPRESS_THREAD_BYTES:
+        result = await asyncio.to_thread(compress, body, encoding, level)
+    else:
+        result = compress(body, encoding, level)
+
+    COMPRESS_BYTES.inc(encoding, "in", amount=len(body))
+    COMPRESS_BYTES.inc(encoding, "out", amount=len(result))
+    if key is not None:
+        compressed_cache.set(key, result)
+    return result
+
+
+class _StreamCompressor:
+    """
+    Incremental compressor for streamed bodies (e.g. search pass-through).
+    """
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=min(level, 11))
+        else:
+            self._c = zlib.compressobj(min(max(level, 1), 9), zlib.DEFLATED, 31)  # gzip wrapper
+
+    def feed(self, chunk):
+        COMPRESS_BYTES.inc(self.encoding, "in", amount=len(chunk))
+        out = self._c.process(chunk) if self.encoding == "br" else self._c.compress(chunk)
+        COMPRESS_BYTES.inc(self.encoding, "out", amount=len(out))
+        return out
+
+    def finish(self):
+        out = self._c.finish() if self.encoding == "br" else self._c.flush()
+        COMPRESS_BYTES.inc(self.encoding, "out", amount=len(out))
+        return out
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+
+        accept = _header(scope["headers"], b"accept-encoding")
+        encoding = negotiate(accept.decode("latin-1")) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        state = {"start": None, "mode": None, "stream": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Hold the start until we know whether the body gets compressed
+                state["start"] = message
+                return
+
+            if message["type"] != "http.response.body" or state["mode"] == "identity":
+                return await send(message)
+
+            start = state["start"]
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if state["mode"] is None:
+                headers = start.get("headers", [])
+                content_type = _header(headers, b"content-type") or b""
+                route = scope.get("route")
+                min_bytes, level = route_rule(route.path if route is not None else scope["path"])
+                level = _level(encoding, level)
+                length = _header(headers, b"content-length")
+                size = int(length) if length else (None if more_body else len(body))
+
+                if (
+                    start["status"] < 200 or start["status"] in (204, 304)
+                    or _header(headers, b"content-encoding") is not None
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                ):
+                    state["mode"] = "identity"
+                    await send(start)
+                    return await send(message)
+
+                headers = [(k, v) for k, v in headers if k.lower() != b"vary"] + [
+                    (b"vary", _vary(_header(headers, b"vary")))
+                ]
+                if size is not None and size < min_bytes:
+                    state["mode"] = "identity"
+                    start["headers"] = headers
+                    await send(start)
+                    return await send(message)
+
+                etag = _header(headers, b"etag")
+                headers = [
+                    (k, v) for k, v in headers if k.lower() not in (b"content-length", b"etag")
+                ] + [(b"content-encoding", encoding.encode())]
+                if etag is not None:
+                    weak = etag if etag.startswith(b"W/") else b"W/" + etag
+                    headers.append((b"etag", weak))
+
+                if not more_body:
+                    compressed = await compress_cached(
+                        body, encoding, level, etag.decode("latin-1") if etag else None
+                    )
+                    headers.append((b"content-length", str(len(compressed)).encode()))
+                    start["headers"] = headers
+                    await send(start)
+                    return await send({"type": "http.response.body", "body": compressed})
+
+                state["mode"] = "stream"
+                state["stream"] = _StreamCompressor(encoding, level)
+                start["headers"] = headers
+                await send(start)
+
+            stream = state["stream"]
+            out = stream.feed(body)
+            if not more_body:
+                out += stream.finish()
+            if out or not more_body:
+                await send({"type": "http.response.body", "body": out, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def _vary(existing):
+    if not existing:
+        return b"Accept-Encoding"
+    if b"accept-encoding" in existing.lower():
+        return existing
+    return existing + b", Accept-Encoding"
@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import itertools
+from utils.errors import DownstreamRejected
+from utils import metrics
+from utils.settings import get_settings, override
+
+# ---------------------------------------------------------
+# Per-downstream concurrency limits and load shedding
+# ---------------------------------------------------------
+# Each service gets at most <SERVICE>_MAX_CONCURRENCY calls in flight. Further
+# calls wait in a bounded priority queue for at most DOWNSTREAM_QUEUE_TIMEOUT
+# seconds. When the queue is full, or the wait times out, the call is shed at
+# once with 503 + Retry-After instead of piling onto a struggling VM.
+#
+# Priorities: token verification (HIGH) is served before ordinary reads
+# (NORMAL), which are served before bulk catalog reads (LOW). LOW calls may
+# only fill half of the queue, so catalog bursts are shed first.
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+def _env(service, name, cast=int):
+    """
+    <SERVICE>_<NAME>, else the DOWNSTREAM_<NAME> setting.
+    """
+    return override(f"{service.upper()}_{name}", cast, getattr(get_settings(), f"downstream_{name.lower()}"))
+
+
+class ServiceLimiter:
+    def __init__(self, service):
+        self.service = service
+        self.max_concurrency = _env(service, "MAX_CONCURRENCY")
+        self.max_queue = _env(service, "MAX_QUEUE")
+        self.queue_timeout = _env(service, "QUEUE_TIMEOUT", float)
+        self.active = 0
+        self.queued = 0
+        self.shed = 0
+        self.queue_timeouts = 0
+        self._waiters = []           # heap of (priority, seq, future)
+        self._seq = itertools.count()
+
+    def _reject(self, reason):
+        self.shed += 1
+        return DownstreamRejected(
+            self.service,
+            f"{self.service.capitalize()} microservice overloaded ({reason}), retry later",
+            retry_after=max(1.0, self.queue_timeout),
+        )
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        if self.active < self.max_concurrency and self.queued == 0:
+            self.active += 1
+            return
+
+        limit = self.max_queue if priority < PRIORITY_LOW else self.max_queue // 2
+        if self.queued >= limit:
+            raise self._reject("queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.queued += 1
+        try:
+            # The slot is handed over by release(); active is already counted
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.queue_timeouts += 1
+            raise self._reject("queue timeout")
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Got a slot just as we were cancelled: pass it on
+                self.release()
+            raise
+        finally:
+            if not future.done() or future.cancelled():
+                self.queued -= 1
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.queued -= 1
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "shed": self.shed,
+            "queue_timeouts": self.queue_timeouts,
+        }
+
+
+limiters = {}
+
+
+def get_limiter(service):
+    limiter = limiters.get(service)
+    if limiter is None:
+        limiter = limiters[service] = ServiceLimiter(service)
+    return limiter
+
+
+def _collect():
+    return [
+        ("downstream_active_calls", "gauge", "Calls holding a concurrency slot.",
+         [({"service": name}, l.active) for name, l in limiters.items()]),
+        ("downstream_queue_depth", "gauge", "Calls waiting for a concurrency slot.",
+         [({"service": name}, l.queued) for name, l in limiters.items()]),
+        ("downstream_shed_total", "counter", "Calls shed with 503 (queue full or timed out).",
+         [({"service": name}, l.shed) for name, l in limiters.items()]),
+        ("downstream_queue_timeouts_total", "counter", "Calls that timed out waiting in the queue.",
+         [({"service": name}, l.queue_timeouts) for name, l in limiters.items()]),
+        ("downstream_max_concurrency", "gauge", "Configured concurrency limit.",
+         [({"service": name}, l.max_concurrency) for name, l in limiters.items()]),
+    ]
+
+
+metrics.register_collector(_collect)
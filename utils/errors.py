@@ -0,0 +1,18 @@
+import math
+from fastapi import HTTPException
+
+
+class DownstreamRejected(HTTPException):
+    """
+    Raised by the client layer when a downstream call is refused before it is
+    sent (breaker open, load shed). Being an HTTPException, it surfaces as a
+    503 with Retry-After wherever it is not handled.
+    """
+
+    def __init__(self, service, detail, retry_after=1.0):
+        self.service = service
+        super().__init__(
+            status_code=503,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
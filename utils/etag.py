@@ -0,0 +1,88 @@
+import hashlib
+import json
+from fastapi import Response
+from utils.settings import override
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+# ---------------------------------------------------------
+# ETags and conditional GET
+# ---------------------------------------------------------
+# Proxied read endpoints return a `Representation`: the decoded data, the
+# encoded JSON body and a strong ETag (blake2b of the body). The body is
+# encoded once, so cached representations are served without re-encoding,
+# and a matching If-None-Match is answered with an empty 304.
+#
+# Cache-Control defaults are per route and can be overridden with
+# <ROUTE>_CACHE_CONTROL, e.g. COURSES_CACHE_CONTROL="public, max-age=300".
+
+DEFAULT_CACHE_CONTROL = {
+    "offerings": "public, max-age=60",
+    "courses": "public, max-age=60",
+    "profs": "public, max-age=60",
+    "prof_offer": "public, max-age=30",
+    "prof_suggest": "public, max-age=60",
+    "video": "private, max-age=30",
+    "search": "private, no-cache",
+}
+
+
+def cache_control(route):
+    return override(f"{route.upper()}_CACHE_CONTROL") or DEFAULT_CACHE_CONTROL.get(route, "no-cache")
+
+
+def compute_etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def encode_json(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    # Same encoding as FastAPI's JSONResponse
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class Representation:
+    """
+    One encoded response body. `upstream_etag` is the validator the upstream
+    gave us, used to send conditional requests when refreshing.
+    """
+
+    __slots__ = ("data", "body", "etag", "upstream_etag")
+
+    def __init__(self, data, upstream_etag=None):
+        self.data = data
+        self.body = encode_json(data)
+        self.etag = compute_etag(self.body)
+        self.upstream_etag = upstream_etag
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Weak comparison as required for If-None-Match (RFC 9110 13.1.2).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def conditional_response(request, representation, route):
+    """
+    304 if the client already holds this representation, else the full body.
+    """
+    headers = {"ETag": representation.etag, "Cache-Control": cache_control(route)}
+    if etag_matches(request.headers.get("if-none-match"), representation.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=representation.body, media_type="application/json", headers=headers)
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import re
+import time
+import httpx
+from fastapi import HTTPException
+from utils.settings import get_settings
+
+# ---------------------------------------------------------
+# Local Firebase ID-token verification
+# ---------------------------------------------------------
+# Used by utils/auth.verify_token when AUTH_VERIFY_MODE=local. Signing keys
+# are the x509 certificates Google publishes for securetoken, keyed by `kid`.
+# They are fetched once and refreshed according to the Cache-Control max-age
+# of the response. FIREBASE_CERTS_FILE swaps the URL for a local JSON file in
+# the same {kid: pem} format, which makes the whole path testable offline with
+# a locally generated keypair.
+
+_settings = get_settings()
+FIREBASE_CERTS_URL = _settings.firebase_certs_url
+FIREBASE_CLOCK_SKEW = _settings.firebase_clock_skew
+
+# Refresh at least this often even if the response forgets max-age
+DEFAULT_KEYS_MAX_AGE = 3600
+# An unknown kid forces a refresh at most this often, so tokens with made-up
+# kids cannot turn every request into a certificate fetch
+FORCED_REFRESH_INTERVAL = 60.0
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+def _load_public_keys(pems):
+    """
+    Turns {kid: pem} into {kid: public key}. Accepts x509 certificates (what
+    Google serves) as well as bare PEM public keys.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+    keys = {}
+    for kid, pem in pems.items():
+        data = pem.encode()
+        if b"BEGIN CERTIFICATE" in data:
+            keys[kid] = x509.load_pem_x509_certificate(data).public_key()
+        else:
+            keys[kid] = load_pem_public_key(data)
+    return keys
+
+
+class HttpKeySource:
+    """
+    Fetches the published signing certificates and caches them for max-age.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._keys = {}
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get_keys(self, force=False):
+        if not force and self._keys and time.monotonic() < self._expires_at:
+            return self._keys
+
+        async with self._lock:
+            # Another request may have refreshed while we waited
+            if not force and self._keys and time.monotonic() < self._expires_at:
+                return self._keys
+
+            async with httpx.AsyncClient(timeout=5) as client:
+                res = await client.get(self.url)
+            res.raise_for_status()
+
+            match = _MAX_AGE_RE.search(res.headers.get("cache-control", ""))
+            max_age = int(match.group(1)) if match else DEFAULT_KEYS_MAX_AGE
+
+            self._keys = _load_public_keys(res.json())
+            self._expires_at = time.monotonic() + max_age
+            return self._keys
+
+
+class FileKeySource:
+    """
+    Reads {kid: pem} from a local JSON file, reloading it when it changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._keys = {}
+        self._mtime = None
+
+    async def get_keys(self, force=False):
+        mtime = os.path.getmtime(self.path)
+        if force or mtime != self._mtime:
+            with open(self.path) as f:
+                self._keys = _load_public_keys(json.load(f))
+            self._mtime = mtime
+        return self._keys
+
+
+_key_source = None
+_forced_refresh_at = float("-inf")
+
+
+def get_key_source():
+    global _key_source
+    if _key_source is None:
+        certs_file = get_settings().firebase_certs_file
+        _key_source = FileKeySource(certs_file) if certs_file else HttpKeySource(FIREBASE_CERTS_URL)
+    return _key_source
+
+
+def _may_force_refresh():
+    """
+    True (and starts a new interval) if no forced refresh ran in the last
+    FORCED_REFRESH_INTERVAL seconds.
+    """
+    global _forced_refresh_at
+    now = time.monotonic()
+    if now - _forced_refresh_at < FORCED_REFRESH_INTERVAL:
+        return False
+    _forced_refresh_at = now
+    return True
+
+
+def _invalid(reason):
+    return HTTPException(status_code=401, detail=f"Auth verification failed: {reason}")
+
+
+async def verify_id_token(id_token):
+    """
+    Verifies signature, audience, issuer and expiry of a Firebase ID token
+    in-process. Returns the decoded claims or raises a 401 HTTPException.
+    """
+    import jwt
+
+    project_id = get_settings().firebase_project_id
+    if not project_id:
+        raise HTTPException(status_code=500, detail="FIREBASE_PROJECT_ID not set")
+
+    try:
+        header = jwt.get_unverified_header(id_token)
+    except jwt.PyJWTError:
+        raise _invalid("malformed token")
+
+    if header.get("alg") != "RS256":
+        raise _invalid("unexpected signing algorithm")
+
+    source = get_key_source()
+    try:
+        keys = await source.get_keys()
+        if header.get("kid") not in keys and _may_force_refresh():
+            # Keys rotate; refresh once before giving up on an unknown kid
+            keys = await source.get_keys(force=True)
+    except (httpx.HTTPError, OSError, ValueError):
+        raise HTTPException(status_code=503, detail="Firebase signing keys unavailable")
+
+    key = keys.get(header.get("kid"))
+    if key is None:
+        raise _invalid("unknown signing key")
+
+    try:
+        claims = jwt.decode(
+            id_token,
+            key,
+            algorithms=["RS256"],
+            audience=project_id,
+            issuer=f"https://securetoken.google.com/{project_id}",
+            leeway=FIREBASE_CLOCK_SKEW,
+            options={"require": ["exp", "iat", "sub"]},
+        )
+    except jwt.ExpiredSignatureError:
+        raise _invalid("token expired")
+    except jwt.PyJWTError as e:
+        raise _invalid(str(e))
+
+    if not claims.get("sub"):
+        raise _invalid("missing subject")
+
+    return claims
@@ -0,0 +1,151 @@
+import abc
+import asyncio
+import json
+import time
+import httpx
+from fastapi import HTTPException
+from utils.log import get_logger
+from utils.settings import get_settings
+
+logger = get_logger("gcs_auth")
+
+# ---------------------------------------------------------
+# OAuth access tokens for the GCS upload fallback
+# ---------------------------------------------------------
+# Used by utils/resumable when the Upload service does not return an
+# `upload_url` and the composite opens the resumable session itself. Access
+# tokens expire after about an hour, so they are minted on demand and cached
+# until shortly before expiry:
+#
+#   GCS_AUTH=metadata          the VM's service account, from the GCE
+#                              metadata server (default)
+#   GCS_AUTH=service_account   a service-account JSON key at
+#                              GCS_CREDENTIALS_FILE (or
+#                              GOOGLE_APPLICATION_CREDENTIALS), exchanged via
+#                              the OAuth JWT-bearer grant
+#   GCS_AUTH=none              no Authorization header (emulators, bench stubs)
+
+SCOPE = "https://www.googleapis.com/auth/devstorage.read_write"
+METADATA_TOKEN_URL = (
+    "http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/token"
+)
+DEFAULT_TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+# Refresh this long before the token's own expiry
+REFRESH_MARGIN = 300
+
+
+class _TokenSource(abc.ABC):
+    """
+    Caches one access token and refreshes it (once, for all waiters) when it
+    is about to expire.
+    """
+
+    def __init__(self):
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def token(self):
+        if self._token and time.monotonic() < self._expires_at - REFRESH_MARGIN:
+            return self._token
+        async with self._lock:
+            if self._token and time.monotonic() < self._expires_at - REFRESH_MARGIN:
+                return self._token
+            try:
+                token, expires_in = await self._fetch()
+            except (httpx.HTTPError, OSError, ValueError, KeyError) as e:
+                logger.warning("Could not obtain a GCS access token: %r", e)
+                raise HTTPException(status_code=503, detail="GCS credentials unavailable")
+            self._token = token
+            self._expires_at = time.monotonic() + float(expires_in)
+            return self._token
+
+    def invalidate(self):
+        self._token = None
+
+    @abc.abstractmethod
+    async def _fetch(self):
+        """
+        (access token, seconds until it expires).
+        """
+
+
+class MetadataTokenSource(_TokenSource):
+    async def _fetch(self):
+        async with httpx.AsyncClient(timeout=5) as client:
+            res = await client.get(METADATA_TOKEN_URL, headers={"Metadata-Flavor": "Google"})
+        res.raise_for_status()
+        data = res.json()
+        return data["access_token"], data["expires_in"]
+
+
+class ServiceAccountTokenSource(_TokenSource):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    async def _fetch(self):
+        import jwt
+
+        with open(self.path) as f:
+            info = json.load(f)
+        token_uri = info.get("token_uri") or DEFAULT_TOKEN_URI
+        now = int(time.time())
+        assertion = jwt.encode(
+            {
+                "iss": info["client_email"],
+                "scope": SCOPE,
+                "aud": token_uri,
+                "iat": now,
+                "exp": now + 3600,
+            },
+            info["private_key"],
+            algorithm="RS256",
+            headers={"kid": info.get("private_key_id")},
+        )
+        async with httpx.AsyncClient(timeout=10) as client:
+            res = await client.post(token_uri, data={
+                "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
+                "assertion": assertion,
+            })
+        res.raise_for_status()
+        data = res.json()
+        return data["access_token"], data.get("expires_in", 3600)
+
+
+_token_source = None
+
+
+def get_token_source():
+    """
+    The configured token source, or None with GCS_AUTH=none.
+    """
+    global _token_source
+    if _token_source is None:
+        settings = get_settings()
+        if settings.gcs_auth == "none":
+            return None
+        if settings.gcs_auth == "service_account":
+            path = settings.gcs_credentials_file or settings.google_application_credentials
+            if not path:
+                raise HTTPException(status_code=500, detail="GCS_CREDENTIALS_FILE not set")
+            _token_source = ServiceAccountTokenSource(path)
+        else:
+            _token_source = MetadataTokenSource()
+    return _token_source
+
+
+async def auth_headers():
+    source = get_token_source()
+    if source is None:
+        return {}
+    return {"Authorization": f"Bearer {await source.token()}"}
+
+
+def invalidate():
+    """
+    Drops the cached token, e.g. after the target answered 401.
+    """
+    if _token_source is not None:
+        _token_source.invalidate()
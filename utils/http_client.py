@@ -0,0 +1,443 @@
+import time
+import asyncio
+import hashlib
+import httpx
+from utils.singleflight import SingleFlight
+from utils import circuit_breaker, concurrency, retry, metrics, compression
+# Re-exported: callers pass http_client.PRIORITY_HIGH / PRIORITY_LOW to request()
+from utils.concurrency import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW  # noqa: F401
+from utils.log import request_id_var
+from utils.settings import get_settings, override
+from utils import tracing
+
+# ---------------------------------------------------------
+# Shared async HTTP client layer
+# ---------------------------------------------------------
+# One pooled httpx.AsyncClient per downstream service, created once for the
+# lifetime of the app (see the lifespan hook in main.py). Every resource module
+# goes through `request()` so connections are kept alive and reused instead of
+# opening a fresh TCP/TLS connection per proxied call.
+
+SERVICES = {
+    "auth": "AUTH_SERVICE_URL",
+    "search": "SEARCH_SERVICE_URL",
+    "upload": "UPLOAD_SERVICE_URL",
+    "video": "VIDEO_COMPOSITE_URL",
+    "gcs": "GCS_UPLOAD_URL",
+}
+
+_clients = {}
+
+# Identical concurrent GETs (same service, path, params and caller) share one call
+COALESCE_GETS = get_settings().coalesce_gets
+coalescer = SingleFlight("downstream_get")
+
+
+def service_url(service):
+    """
+    Base URL of a downstream service, or None if it is not configured.
+    """
+    return get_settings().service_url(SERVICES[service])
+
+
+def _pool_config(service):
+    """
+    Pool sizes and timeouts. HTTP_* sets the default for every service,
+    <SERVICE>_HTTP_* (e.g. SEARCH_HTTP_MAX_CONNECTIONS) overrides one service.
+    """
+    settings = get_settings()
+    prefix = service.upper()
+    max_connections = override(f"{prefix}_HTTP_MAX_CONNECTIONS", int, settings.http_max_connections)
+    max_keepalive = override(f"{prefix}_HTTP_MAX_KEEPALIVE", int, settings.http_max_keepalive)
+    keepalive_expiry = settings.http_keepalive_expiry
+    timeout = override(f"{prefix}_HTTP_TIMEOUT", float, settings.http_timeout)
+    connect_timeout = settings.http_connect_timeout or min(timeout, 3.0)
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return limits, httpx.Timeout(timeout, connect=connect_timeout)
+
+
+def _default_headers():
+    """
+    Ask downstreams for compressed bodies; httpx decodes them transparently.
+    br is only offered when the brotli package is installed.
+    """
+    encoding = get_settings().downstream_accept_encoding
+    if not encoding:
+        encoding = "br, gzip, deflate" if compression.brotli is not None else "gzip, deflate"
+    return {"Accept-Encoding": encoding}
+
+
+def get_client(service):
+    """
+    Returns the pooled client for a service, creating it on first use
+    (e.g. when the app is driven without running the startup hook).
+    """
+    client = _clients.get(service)
+    if client is None or client.is_closed:
+        limits, timeout = _pool_config(service)
+        client = httpx.AsyncClient(
+            base_url=service_url(service) or "",
+            limits=limits,
+            timeout=timeout,
+            headers=_default_headers(),
+        )
+        _clients[service] = client
+    return client
+
+
+def scope_hash(credential):
+    """
+    Stable hash of a caller's credential, so tokens are never kept as keys.
+    """
+    return hashlib.sha256(credential.encode()).hexdigest() if credential else ""
+
+
+def _coalesce_key(service, path, params, headers):
+    """
+    Key for identical GETs: service, path, normalized params, the caller's
+    authorization scope and any validator being revalidated.
+    """
+    normalized = tuple(sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None))
+    headers = headers or {}
+    return (
+        service, path, normalized,
+        scope_hash(headers.get("Authorization", "")),
+        headers.get("If-None-Match"),
+    )
+
+
+async def _admit(service, priority):
+    """
+    Passes the service's circuit breaker and waits for a concurrency slot.
+    Returns (breaker, limiter, probe); the caller must release the slot.
+    """
+    breaker = circuit_breaker.get_breaker(service)
+    limiter = concurrency.get_limiter(service)
+    probe = breaker.before_call()
+    try:
+        await limiter.acquire(priority)
+    except BaseException:
+        breaker.release(probe)
+        raise
+    return breaker, limiter, probe
+
+
+def _prepare(service, client, method, route, kwargs):
+    """
+    Per-call options: adaptive timeout for GETs, the request id and the
+    trace context headers.
+    """
+    if method == "GET" and "timeout" not in kwargs:
+        tracker = circuit_breaker.get_latency(service, route)
+        kwargs = {
+            **kwargs,
+            "timeout": httpx.Timeout(
+                tracker.timeout(client.timeout.read),
+                connect=client.timeout.connect,
+            ),
+        }
+
+    headers = tracing.inject(kwargs.get("headers"))
+    request_id = request_id_var.get()
+    if request_id:
+        # Correlate downstream logs with ours
+        headers = {**(headers or {}), "X-Request-ID": request_id}
+    if headers is not None:
+        kwargs = {**kwargs, "headers": headers}
+    return kwargs
+
+
+async def _send(service, client, method, path, route, kwargs, priority):
+    """
+    One upstream call, guarded by the service's circuit breaker and
+    concurrency limit. GETs get a timeout adapted to the route's observed p99
+    (never above the configured one).
+    """
+    breaker, limiter, probe = await _admit(service, priority)
+    try:
+        return await _send_admitted(service, client, method, path, route, kwargs, breaker, probe)
+    finally:
+        limiter.release()
+
+
+async def _send_admitted(service, client, method, path, route, kwargs, breaker, probe):
+    sending = False
+    try:
+        with tracing.span(f"{method} {service} {route}", tracing.CLIENT, service=service) as span:
+            kwargs = _prepare(service, client, method, route, kwargs)
+            # From here on _send_traced settles the probe
+            sending = True
+            res = await _send_traced(service, client, method, path, route, kwargs, breaker, probe)
+            span.set("http.status_code", res.status_code)
+            return res
+    except BaseException:
+        if not sending:
+            breaker.release(probe)
+        raise
+
+
+async def _send_traced(service, client, method, path, route, kwargs, breaker, probe):
+    metrics.DOWNSTREAM_IN_FLIGHT.inc(service)
+    start = time.perf_counter()
+    try:
+        res = await client.request(method, path, **kwargs)
+    except httpx.TransportError as e:
+        breaker.record(False, probe)
+        status = "timeout" if isinstance(e, httpx.TimeoutException) else "error"
+        metrics.DOWNSTREAM_LATENCY.observe(time.perf_counter() - start, service, route, status)
+        raise
+    except BaseException:
+        breaker.release(probe)
+        raise
+    finally:
+        metrics.DOWNSTREAM_IN_FLIGHT.dec(service)
+
+    elapsed = time.perf_counter() - start
+    circuit_breaker.get_latency(service, route).observe(elapsed)
+    breaker.record(res.status_code < 500, probe)
+    metrics.DOWNSTREAM_LATENCY.observe(elapsed, service, route, res.status_code)
+    metrics.DOWNSTREAM_SIZE.observe(len(res.content), service, route)
+    return res
+
+
+class DownstreamStream:
+    """
+    An upstream response whose body has not been read yet. It holds a
+    concurrency slot until aclose() is called.
+    """
+
+    def __init__(self, response, limiter):
+        self.response = response
+        self._limiter = limiter
+        self._closed = False
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                await self.response.aclose()
+            finally:
+                self._limiter.release()
+
+
+async def open_stream(service, method, path, route=None, priority=PRIORITY_NORMAL, **kwargs):
+    """
+    Like request(), but returns as soon as the upstream headers arrive so the
+    body can be streamed. Never coalesced, retried or hedged. The caller must
+    aclose() the returned DownstreamStream.
+    Latency is recorded as time to headers.
+    """
+    client = get_client(service)
+    route = route or path
+    breaker, limiter, probe = await _admit(service, priority)
+    sending = False
+    stream = None
+    try:
+        with tracing.span(f"{method} {service} {route}", tracing.CLIENT, service=service, stream=True) as span:
+            kwargs = _prepare(service, client, method, route, kwargs)
+            # From here on _open_stream_traced releases the slot and probe if it fails
+            sending = True
+            res = await _open_stream_traced(service, client, method, path, route, kwargs, breaker, limiter, probe)
+            stream = DownstreamStream(res, limiter)
+            span.set("http.status_code", res.status_code)
+    except BaseException:
+        if stream is not None:
+            await stream.aclose()
+        elif not sending:
+            breaker.release(probe)
+            limiter.release()
+        raise
+    return stream
+
+
+async def _open_stream_traced(service, client, method, path, route, kwargs, breaker, limiter, probe):
+    start = time.perf_counter()
+    try:
+        res = await client.send(client.build_request(method, path, **kwargs), stream=True)
+    except httpx.TransportError as e:
+        breaker.record(False, probe)
+        limiter.release()
+        status = "timeout" if isinstance(e, httpx.TimeoutException) else "error"
+        metrics.DOWNSTREAM_LATENCY.observe(time.perf_counter() - start, service, route, status)
+        raise
+    except BaseException:
+        breaker.release(probe)
+        limiter.release()
+        raise
+
+    breaker.record(res.status_code < 500, probe)
+    metrics.DOWNSTREAM_LATENCY.observe(time.perf_counter() - start, service, route, res.status_code)
+    return res
+
+
+def _hedge_delay(service, route):
+    if retry.HEDGE_DELAY_MS:
+        return retry.HEDGE_DELAY_MS / 1000
+    # No hedging until the route has enough samples for a p95
+    return circuit_breaker.get_latency(service, route).p95
+
+
+async def _send_hedged(service, client, method, path, route, kwargs, priority):
+    """
+    Sends the call; if it has not answered after the hedge delay, sends a
+    second copy and returns whichever succeeds first, cancelling the other.
+    """
+    delay = _hedge_delay(service, route)
+    first = asyncio.ensure_future(_send(service, client, method, path, route, kwargs, priority))
+    if delay is None:
+        return await first
+
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done or not retry.budget.withdraw():
+        return await first
+
+    retry.budget.hedges += 1
+    second = asyncio.ensure_future(_send(service, client, method, path, route, kwargs, priority))
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        retry.budget.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _send_with_retries(service, client, method, path, route, kwargs, priority, hedge):
+    """
+    Bounded retries with jittered backoff for idempotent calls. Retries
+    timeouts, connection errors and 502/503/504 while the global retry budget
+    allows; anything else (including an open circuit) is returned at once.
+    """
+    retry.budget.deposit()
+    send = _send_hedged if hedge else _send
+    attempt = 0
+    while True:
+        try:
+            res = await send(service, client, method, path, route, kwargs, priority)
+            if res.status_code not in retry.RETRYABLE_STATUSES:
+                return res
+            if attempt >= retry.RETRY_MAX or not retry.budget.withdraw():
+                return res
+        except httpx.TransportError:
+            if attempt >= retry.RETRY_MAX or not retry.budget.withdraw():
+                raise
+
+        attempt += 1
+        retry.budget.retries += 1
+        await asyncio.sleep(retry.backoff(attempt))
+
+
+async def request(
+    service, method, path, route=None, coalesce=None, hedge=False, retries=None,
+    priority=PRIORITY_NORMAL, **kwargs
+):
+    """
+    Sends a request to a downstream service through its pooled client.
+    `route` is the path template (e.g. "/videos/{video_id}") used for
+    per-route latency tracking; it defaults to the path itself.
+    GETs are coalesced with identical in-flight GETs unless coalesce=False.
+    Idempotent methods are retried (retries=False opts out) and hedged when
+    hedge=True and HEDGE_ENABLED=1; mutating methods never are.
+    `priority` orders calls waiting for one of the service's concurrency slots.
+    Raises httpx.TimeoutException / httpx.ConnectError like a direct call would,
+    or DownstreamRejected (503) when the service's circuit is open or the call
+    is shed.
+    """
+    client = get_client(service)
+    route = route or path
+
+    idempotent = method in retry.IDEMPOTENT_METHODS
+    hedge = hedge and idempotent and retry.HEDGE_ENABLED
+    if retries is None:
+        retries = idempotent
+    retries = retries and idempotent and retry.RETRY_MAX > 0
+
+    def send():
+        if retries or hedge:
+            return _send_with_retries(service, client, method, path, route, kwargs, priority, hedge)
+        return _send(service, client, method, path, route, kwargs, priority)
+
+    if coalesce is None:
+        coalesce = COALESCE_GETS and method == "GET"
+    if not coalesce:
+        return await send()
+
+    key = _coalesce_key(service, path, kwargs.get("params"), kwargs.get("headers"))
+    return await coalescer.do(key, send)
+
+
+async def startup():
+    """
+    Creates the pooled clients for every configured downstream and, with
+    STARTUP_PREWARM=1, pre-opens their connections (returning what prewarm()
+    returns).
+    """
+    for service in SERVICES:
+        if service_url(service):
+            get_client(service)
+    if get_settings().startup_prewarm:
+        return await prewarm()
+    return None
+
+
+async def _warm(client, timeout):
+    try:
+        # Any answer will do: the point is DNS, TCP and TLS, kept in the pool
+        await client.head("/", timeout=timeout)
+        return True
+    except httpx.HTTPError:
+        return False
+
+
+async def prewarm():
+    """
+    Opens `prewarm_connections` keep-alive connections to every configured
+    downstream in parallel, bounded by `prewarm_timeout`, so the first real
+    requests skip the handshakes. Bypasses breakers and metrics; failures are
+    only reported. Returns {service: connections opened}.
+    """
+    settings = get_settings()
+    services = [s for s in SERVICES if service_url(s)]
+    results = await asyncio.gather(*[
+        _warm(get_client(service), settings.prewarm_timeout)
+        for service in services
+        for _ in range(settings.prewarm_connections)
+    ])
+    n = settings.prewarm_connections
+    return {service: sum(results[i * n:(i + 1) * n]) for i, service in enumerate(services)}
+
+
+async def shutdown():
+    """
+    Closes all pooled clients and their keep-alive connections.
+    """
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _collect():
+    stats = coalescer.stats()
+    return [
+        ("downstream_coalesced_total", "counter", "GETs that joined an identical in-flight call.",
+         [({}, stats["collapsed"])]),
+        ("downstream_coalesce_leaders_total", "counter", "GETs that were actually sent upstream.",
+         [({}, stats["calls"])]),
+    ]
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,191 @@
+import json
+import re
+
+# ---------------------------------------------------------
+# Streaming JSON splicing for pass-through proxying
+# ---------------------------------------------------------
+# `LinksSplicer` forwards an upstream JSON object chunk by chunk and adds one
+# entry to its top-level "links" array, without decoding the body. Only the
+# last TAIL_BYTES are held back; at the end they are walked backwards member
+# by member (the small trailing members such as page_size/offset/links always
+# fit in the tail) to find where the link goes:
+#   - top-level "links" array found  -> entry appended inside it
+#   - no "links" anywhere in the body -> a "links" member is added
+#   - a top-level list body           -> wrapped as {"items": [...], "links": [...]}
+# If "links" exists but is out of reach (or not an array) the body is forwarded
+# unchanged and `spliced` stays False.
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+TAIL_BYTES = 16384
+
+_STRUCTURAL = re.compile(rb'["\[\]{}]')
+_WHITESPACE = b" \t\r\n"
+
+
+def fast_loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def _skip_ws_back(buf, pos):
+    while pos >= 0 and buf[pos] in _WHITESPACE:
+        pos -= 1
+    return pos
+
+
+def _string_start(buf, quote_pos):
+    """
+    Index of the opening quote for the closing quote at `quote_pos`.
+    """
+    pos = quote_pos
+    while True:
+        pos = buf.rfind(b'"', 0, pos)
+        if pos < 0:
+            return None
+        backslashes = 0
+        while pos - 1 - backslashes >= 0 and buf[pos - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return pos
+
+
+def _value_start(buf, end):
+    """
+    Start index of the JSON value ending at `end`, walking backwards, or None
+    if the value begins before the buffer.
+    """
+    ch = buf[end]
+    if ch == 0x22:  # '"'
+        return _string_start(buf, end)
+
+    if ch not in (0x5D, 0x7D):  # scalar: number, true, false, null
+        pos = end
+        while pos >= 0 and buf[pos] not in b",:[{" and buf[pos] not in _WHITESPACE:
+            pos -= 1
+        return pos + 1 if pos >= 0 else None
+
+    # Bracketed value: match brackets backwards, skipping over strings
+    positions = [m.start() for m in _STRUCTURAL.finditer(buf, 0, end + 1)]
+    depth = 0
+    i = len(positions) - 1
+    while i >= 0:
+        pos = positions[i]
+        c = buf[pos]
+        if c == 0x22:
+            start = _string_start(buf, pos)
+            if start is None:
+                return None
+            while i >= 0 and positions[i] >= start:
+                i -= 1
+            continue
+        if c in (0x5D, 0x7D):
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+        i -= 1
+    return None
+
+
+def _trailing_members(buf, close):
+    """
+    Walks the members of the top-level object backwards from its closing
+    brace. Yields (key, value_start, value_end); stops when a member does not
+    fit in the buffer. Returns True from `.complete` if the opening brace
+    was reached.
+    """
+    members = []
+    pos = _skip_ws_back(buf, close - 1)
+    while pos >= 0:
+        if buf[pos] == 0x7B:  # reached '{' of the object
+            return members, True
+        value_end = pos
+        value_start = _value_start(buf, value_end)
+        if value_start is None:
+            break
+        pos = _skip_ws_back(buf, value_start - 1)
+        if pos < 0 or buf[pos] != 0x3A:  # ':'
+            break
+        pos = _skip_ws_back(buf, pos - 1)
+        if pos < 0 or buf[pos] != 0x22:
+            break
+        key_start = _string_start(buf, pos)
+        if key_start is None:
+            break
+        members.append((buf[key_start + 1:pos], value_start, value_end))
+        pos = _skip_ws_back(buf, key_start - 1)
+        if pos >= 0 and buf[pos] == 0x2C:  # ','
+            pos = _skip_ws_back(buf, pos - 1)
+    return members, False
+
+
+class LinksSplicer:
+    def __init__(self, link):
+        self.link = json.dumps(link, separators=(",", ":")).encode()
+        self.spliced = False
+        self._tail = b""
+        self._started = False
+        self._is_list = False
+        self._saw_links = False
+
+    def feed(self, chunk):
+        """
+        Takes an upstream chunk, returns the bytes that can be sent now.
+        """
+        out = b""
+        if not self._started:
+            stripped = chunk.lstrip()
+            if not stripped:
+                return b""
+            self._started = True
+            if stripped[:1] == b"[":
+                self._is_list = True
+                out = b'{"items":'
+            chunk = stripped
+
+        # "links" split across chunk boundaries is caught via the overlap
+        if not self._saw_links and b'"links"' in self._tail[-8:] + chunk:
+            self._saw_links = True
+
+        buf = self._tail + chunk
+        if len(buf) > TAIL_BYTES:
+            cut = len(buf) - TAIL_BYTES
+            out += buf[:cut]
+            buf = buf[cut:]
+        self._tail = buf
+        return out
+
+    def finish(self):
+        """
+        Returns the held-back tail with the link spliced in.
+        """
+        buf = self._tail
+        if self._is_list:
+            self.spliced = True
+            return buf + b',"links":[' + self.link + b"]}"
+
+        close = _skip_ws_back(buf, len(buf) - 1)
+        if close < 0 or buf[close] != 0x7D:
+            return buf
+
+        members, complete = _trailing_members(buf, close)
+        for key, value_start, value_end in members:
+            if key == b"links":
+                if buf[value_start] != 0x5B:  # not an array
+                    return buf
+                self.spliced = True
+                empty = _skip_ws_back(buf, value_end - 1) == value_start
+                sep = b"" if empty else b","
+                return buf[:value_end] + sep + self.link + buf[value_end:]
+
+        if self._saw_links and not complete:
+            # "links" sits somewhere we did not keep; leave the body as-is
+            return buf
+
+        self.spliced = True
+        sep = b"" if complete and not members else b","
+        return buf[:close] + sep + b'"links":[' + self.link + b"]" + buf[close:]
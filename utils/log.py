@@ -0,0 +1,208 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from utils.settings import get_settings
+
+# ---------------------------------------------------------
+# Structured, non-blocking logging
+# ---------------------------------------------------------
+# Records are handed to a QueueHandler on the request path and formatted and
+# written to stdout by a background QueueListener thread, so the event loop
+# never blocks on stdout. Payloads are logged through `summarize()`, which is
+# lazy: nothing is rendered unless the record is actually emitted, so DEBUG
+# payload logging costs one level check when disabled.
+#
+# LOG_LEVEL           root level for the composite (default INFO)
+# LOG_SAMPLE_RATES    per-route sampling of INFO/DEBUG, e.g.
+#                     "/videos/search=0.1,/videos/{video_id}=0.05"
+# LOG_PAYLOAD_MAX     max characters of a payload summary (default 256)
+
+_settings = get_settings()
+LOG_LEVEL = _settings.log_level
+LOG_PAYLOAD_MAX = _settings.log_payload_max
+
+
+def _parse_sample_rates(value):
+    rates = {}
+    for part in filter(None, (p.strip() for p in (value or "").split(","))):
+        route, _, rate = part.rpartition("=")
+        rates[route] = float(rate)
+    return rates
+
+
+LOG_SAMPLE_RATES = _parse_sample_rates(_settings.log_sample_rates)
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+# Set by utils.tracing so log lines can be joined with traces
+trace_id_var = contextvars.ContextVar("trace_id", default=None)
+_scope_var = contextvars.ContextVar("log_scope", default=None)
+
+_listener = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"composite.{name}")
+
+
+class summarize:
+    """
+    Size-capped, lazily rendered payload summary. Accepts an httpx.Response
+    (its body text is used as-is, never re-parsed) or any Python object.
+    """
+
+    __slots__ = ("payload", "limit")
+
+    def __init__(self, payload, limit=None):
+        self.payload = payload
+        self.limit = limit or LOG_PAYLOAD_MAX
+
+    def __str__(self):
+        payload = self.payload
+        text = getattr(payload, "text", None)
+        if not isinstance(text, str):
+            text = payload if isinstance(payload, str) else repr(payload)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text)} chars)"
+
+
+def _sampled():
+    """
+    Per-request sampling decision, drawn lazily on the first INFO/DEBUG
+    record of the request and remembered for the rest of it.
+    """
+    scope = _scope_var.get()
+    if scope is None or not LOG_SAMPLE_RATES:
+        return True
+
+    decision = scope.get("log_sampled")
+    if decision is None:
+        route = scope.get("route")
+        rate = LOG_SAMPLE_RATES.get(route.path if route is not None else scope.get("path"), 1.0)
+        decision = scope["log_sampled"] = random.random() < rate
+    return decision
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record):
+        if record.levelno < logging.WARNING and not _sampled():
+            return False
+        record.request_id = request_id_var.get()
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not the event loop
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging():
+    """
+    Installs the queue-backed handler on the "composite" logger and starts
+    the background writer. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger("composite")
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+
+
+def shutdown_logging():
+    """
+    Flushes pending records and stops the background writer.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+access_log = get_logger("access")
+
+
+class RequestContextMiddleware:
+    """
+    Pure ASGI middleware that assigns every request an id (taken from an
+    incoming X-Request-ID or generated), echoes it on the response and makes
+    it available to every log record and downstream call of the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        id_token = request_id_var.set(request_id)
+        scope_token = _scope_var.set(scope)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if access_log.isEnabledFor(logging.INFO):
+                access_log.info(
+                    "%s %s %s %.1fms",
+                    scope["method"], scope["path"], status["code"],
+                    (time.perf_counter() - start) * 1000,
+                )
+            request_id_var.reset(id_token)
+            _scope_var.reset(scope_token)
@@ -0,0 +1,166 @@
+import time
+from bisect import bisect_left
+
+# ---------------------------------------------------------
+# Minimal Prometheus metrics
+# ---------------------------------------------------------
+# Counters, gauges and histograms rendered in the Prometheus text format on
+# GET /metrics. Recording is a dict lookup plus an increment; there are no
+# locks because everything that records runs on the event loop thread.
+# Modules that already keep their own counters (caches, breakers, retry
+# budget) register a collector instead, which is only called at scrape time.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}      # labels -> [per-bucket counts..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            cumulative += series[-2]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+def register_collector(fn):
+    """
+    `fn()` returns (name, kind, help, [(labels_dict, value), ...]) tuples and
+    is called on every scrape.
+    """
+    _collectors.append(fn)
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+
+    for collector in _collectors:
+        for name, kind, help, samples in collector():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels.keys(), labels.values())} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------
+# Composite-wide series
+# ---------------------------------------------------------
+REQUESTS = Counter("composite_requests_total", "Requests served per route.", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("composite_request_seconds", "Request latency per route.", ("method", "route"))
+REQUEST_SIZE = Histogram("composite_response_bytes", "Response body size per route.", ("route",), SIZE_BUCKETS)
+IN_FLIGHT = Gauge("composite_in_flight_requests", "Requests currently being served.")
+
+DOWNSTREAM_LATENCY = Histogram(
+    "downstream_request_seconds", "Downstream call latency.", ("service", "route", "status")
+)
+DOWNSTREAM_SIZE = Histogram(
+    "downstream_response_bytes", "Downstream response body size.", ("service", "route"), SIZE_BUCKETS
+)
+DOWNSTREAM_IN_FLIGHT = Gauge("downstream_in_flight_requests", "Downstream calls in flight.", ("service",))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording per-route count, latency, response size
+    and in-flight requests. Routes are labelled by their path template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        state = {"status": 500, "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec()
+            route = scope.get("route")
+            template = route.path if route is not None else "unmatched"
+            REQUESTS.inc(scope["method"], template, state["status"])
+            REQUEST_LATENCY.observe(elapsed, scope["method"], template)
+            REQUEST_SIZE.observe(state["size"], template)
@@ -0,0 +1,157 @@
+import asyncio
+import base64
+import json
+from fastapi import HTTPException
+from utils.cache import make_cache
+from utils.log import get_logger
+from utils import metrics
+from utils.settings import get_settings
+
+logger = get_logger("page_cache")
+
+# ---------------------------------------------------------
+# Block page cache with read-ahead (search pagination)
+# ---------------------------------------------------------
+# Instead of one upstream query per page, results are fetched in blocks of
+# SEARCH_BLOCK_SIZE and cached per (normalized filters, caller, block).
+# Blocks are fetched with the caller's token, so the caller part is the
+# token's scope hash (as for coalesced GETs): nobody is served a block
+# fetched on someone else's behalf.
+# Consecutive pages are sliced from the cached block; once a reader gets past
+# SEARCH_PREFETCH_AT of a block, the next block is fetched in the background
+# so the page after the boundary is already there.
+#
+# A block shorter than the block size marks the end of the results.
+# Pages cut from blocks carry no upstream links or paging metadata (those
+# describe the block, not the page), so the cache is opt-in.
+#
+# SEARCH_PAGE_CACHE      "1" enables the cache (default: every page goes upstream)
+# SEARCH_BLOCK_SIZE      upstream page size used for blocks (default 100)
+# SEARCH_PAGE_TTL        seconds a block is served (default 30)
+# SEARCH_PREFETCH_AT     fraction of a block read before prefetching (0.75)
+# SEARCH_PAGE_CACHE_SIZE blocks kept (default 2048)
+
+_settings = get_settings()
+SEARCH_PAGE_CACHE = _settings.search_page_cache
+SEARCH_BLOCK_SIZE = _settings.search_block_size
+SEARCH_PAGE_TTL = _settings.search_page_ttl
+SEARCH_PREFETCH_AT = _settings.search_prefetch_at
+SEARCH_PAGE_CACHE_SIZE = _settings.search_page_cache_size
+
+PREFETCHES = metrics.Counter(
+    "search_prefetch_total", "Background block prefetches by outcome.", ("outcome",)
+)
+
+
+def normalize_filters(filters):
+    """
+    Drops unset filters and trims strings, so equivalent queries share blocks.
+    """
+    normalized = {}
+    for name, value in filters.items():
+        if isinstance(value, str):
+            value = " ".join(value.split())
+            if not value:
+                continue
+        if value is not None:
+            normalized[name] = value
+    return normalized
+
+
+class BlockPageCache:
+    def __init__(self, name, block_size, ttl, max_entries=2048):
+        self.name = name
+        self.block_size = block_size
+        self.blocks = make_cache(name, max_entries=max_entries, default_ttl=ttl)
+        self._prefetching = {}
+
+    def _key(self, filters, scope, index):
+        return f"{scope}:{json.dumps(filters, sort_keys=True, separators=(',', ':'))}:{index}"
+
+    async def get_page(self, filters, scope, offset, limit, fetch_block):
+        """
+        Items [offset, offset + limit) and whether more results follow.
+        `fetch_block(offset, limit)` is a coroutine function returning the
+        upstream items of one block, fetched as the caller whose `scope`
+        (http_client.scope_hash of their token) is given.
+        """
+        first = offset // self.block_size
+        last = (offset + limit - 1) // self.block_size
+
+        items = []
+        complete = True
+        for index in range(first, last + 1):
+            block = await self._block(filters, scope, index, fetch_block)
+            items.extend(block)
+            if len(block) < self.block_size:
+                complete = False
+                break
+
+        start = offset - first * self.block_size
+        page = items[start:start + limit]
+        # Past the end of the last (short) block there is nothing more
+        more = len(items) > start + limit or (complete and len(page) == limit)
+
+        if more and complete:
+            position = (offset + limit) - last * self.block_size
+            if position >= self.block_size * SEARCH_PREFETCH_AT:
+                self._prefetch(filters, scope, last + 1, fetch_block)
+        return page, more
+
+    async def _block(self, filters, scope, index, fetch_block):
+        async def fetch():
+            return await fetch_block(index * self.block_size, self.block_size)
+
+        return await self.blocks.get_or_compute(self._key(filters, scope, index), fetch)
+
+    def _prefetch(self, filters, scope, index, fetch_block):
+        key = self._key(filters, scope, index)
+        if key in self._prefetching or self.blocks.get(key) is not None:
+            return
+
+        async def prefetch():
+            try:
+                await self._block(filters, scope, index, fetch_block)
+                PREFETCHES.inc("ok")
+            except Exception as e:
+                # The page will simply be fetched on demand
+                PREFETCHES.inc("error")
+                logger.warning("Prefetch of block %d for '%s' failed: %r", index, self.name, e)
+            finally:
+                self._prefetching.pop(key, None)
+
+        self._prefetching[key] = asyncio.create_task(prefetch())
+
+    def purge(self):
+        return self.blocks.purge()
+
+
+search_pages = BlockPageCache("search_pages", SEARCH_BLOCK_SIZE, SEARCH_PAGE_TTL, SEARCH_PAGE_CACHE_SIZE)
+
+
+# ---------------------------------------------------------
+# Opaque cursors
+# ---------------------------------------------------------
+# A cursor carries the filters and position of the next page, so a client can
+# page with ?cursor=... alone. It is opaque, not secret: decoding one only
+# yields a query the caller could have made directly.
+
+
+def encode_cursor(filters, offset, limit):
+    raw = json.dumps({"f": filters, "o": offset, "l": limit}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    (filters, offset, limit) from a cursor; 400 if it is not one of ours.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        filters, offset, limit = data["f"], int(data["o"]), int(data["l"])
+        if not isinstance(filters, dict) or offset < 0 or not 1 <= limit <= 100:
+            raise ValueError(data)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return filters, offset, limit
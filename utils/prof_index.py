@@ -0,0 +1,205 @@
+import asyncio
+import heapq
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from fastapi import HTTPException
+from utils import metrics
+from utils.log import get_logger
+from utils.settings import get_settings
+
+logger = get_logger("prof_index")
+
+# ---------------------------------------------------------
+# Professor directory index (typeahead)
+# ---------------------------------------------------------
+# The faculty list is kept in memory as one sorted array of search keys:
+# "token \0 field \0 uni", where the tokens of a professor are the UNI, the
+# full name, every later name word (so "bro" finds "Alice Brown") and the
+# email, all case- and accent-folded. A prefix lookup is a bisect to the
+# first key >= prefix and a scan while keys still start with it, so
+# /profs/suggest never calls the Auth service.
+#
+# A background task reloads the list every PROF_INDEX_REFRESH seconds. An
+# unchanged list (same ETag) costs nothing; otherwise only added, changed and
+# removed professors are re-keyed and moved in the array, unless so many
+# changed that a full rebuild is cheaper.
+#
+# Ranking per professor uses its best match: an exact token first, then the
+# field (UNI, full name, other name word, email), then the shorter token.
+#
+# PROF_INDEX           "0" disables the index and its refresh task
+# PROF_INDEX_REFRESH   seconds between reloads (default 60)
+# PROF_SUGGEST_SCAN    most keys examined per lookup (default 5000)
+
+_settings = get_settings()
+PROF_INDEX = _settings.prof_index
+PROF_INDEX_REFRESH = _settings.prof_index_refresh
+PROF_SUGGEST_SCAN = _settings.prof_suggest_scan
+
+FIELDS = ("uni", "name", "name_word", "email")
+
+REBUILD_FRACTION = 0.25  # above this share of changed professors, rebuild
+
+REFRESHES = metrics.Counter("prof_index_refreshes_total", "Professor index reloads by outcome.", ("outcome",))
+
+
+def fold(text):
+    """
+    Lower-cased, accent-free text with single spaces.
+    """
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.casefold().split())
+
+
+def _display_name(prof):
+    if prof.get("name"):
+        return str(prof["name"])
+    return " ".join(str(prof[k]) for k in ("first_name", "last_name") if prof.get(k))
+
+
+def _keys(uni, prof):
+    tokens = {(fold(uni), 0)}
+    name = fold(_display_name(prof))
+    if name:
+        tokens.add((name, 1))
+        for word in name.split()[1:]:
+            tokens.add((word, 2))
+    if prof.get("email"):
+        tokens.add((fold(prof["email"]), 3))
+    return sorted(f"{token}\0{field}\0{uni}" for token, field in tokens if token)
+
+
+class ProfIndex:
+    def __init__(self, load, refresh_every=PROF_INDEX_REFRESH):
+        """
+        `load(previous_etag)` is a coroutine function returning (etag, profs),
+        with profs None when the list is unchanged.
+        """
+        self.load = load
+        self.refresh_every = refresh_every
+        self.keys = []
+        self.profs = {}
+        self._prof_keys = {}
+        self.etag = None
+        self.loaded_at = None
+        self.changes = 0
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.loaded_at is not None
+
+    def apply(self, profs):
+        """
+        Brings the index in line with the full list `profs`; returns how many
+        professors were added, changed or removed.
+        """
+        incoming = {}
+        for prof in profs:
+            if isinstance(prof, dict) and prof.get("uni"):
+                incoming[str(prof["uni"])] = prof
+
+        changed = [uni for uni, prof in incoming.items() if self.profs.get(uni) != prof]
+        removed = [uni for uni in self.profs if uni not in incoming]
+        count = len(changed) + len(removed)
+
+        if not self.keys or count > len(self.profs) * REBUILD_FRACTION:
+            prof_keys = {uni: _keys(uni, prof) for uni, prof in incoming.items()}
+            self.keys = sorted(key for keys in prof_keys.values() for key in keys)
+            self._prof_keys = prof_keys
+        else:
+            for uni in removed + changed:
+                for key in self._prof_keys.pop(uni, ()):
+                    del self.keys[bisect_left(self.keys, key)]
+            for uni in changed:
+                keys = self._prof_keys[uni] = _keys(uni, incoming[uni])
+                for key in keys:
+                    insort(self.keys, key)
+
+        self.profs = incoming
+        self.changes += count
+        return count
+
+    async def refresh(self):
+        etag, profs = await self.load(self.etag)
+        if profs is not None:
+            count = self.apply(profs)
+            if count:
+                logger.info("Professor index: %d changes, %d professors, %d keys", count, len(self.profs), len(self.keys))
+        self.etag = etag
+        self.loaded_at = time.time()
+
+    def suggest(self, prefix, limit=10):
+        """
+        Up to `limit` professors with a token starting with `prefix`, best
+        match first.
+        """
+        if not self.ready:
+            raise HTTPException(status_code=503, detail="Professor index not loaded yet")
+        prefix = fold(prefix)
+        if not prefix or "\0" in prefix:
+            return []
+
+        keys = self.keys
+        best = {}
+        i = bisect_left(keys, prefix)
+        end = min(len(keys), i + PROF_SUGGEST_SCAN)
+        while i < end and keys[i].startswith(prefix):
+            token, field, uni = keys[i].split("\0")
+            rank = (token != prefix, int(field), len(token))
+            if uni not in best or rank < best[uni]:
+                best[uni] = rank
+            i += 1
+
+        top = heapq.nsmallest(limit, best.items(), key=lambda item: (item[1], item[0]))
+        return [
+            {
+                "uni": uni,
+                "name": _display_name(self.profs[uni]),
+                "email": self.profs[uni].get("email"),
+                "matched": FIELDS[rank[1]],
+            }
+            for uni, rank in top
+        ]
+
+    # ---------------------------------------------------------
+    # Background refresh
+    # ---------------------------------------------------------
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+                REFRESHES.inc("ok")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep serving the last loaded list
+                REFRESHES.inc("error")
+                logger.warning("Professor index refresh failed: %r", e)
+            # Until the first load succeeds, retry sooner
+            await asyncio.sleep(self.refresh_every if self.ready else min(self.refresh_every, 5.0))
+
+    def start(self):
+        if PROF_INDEX and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "professors": len(self.profs),
+            "keys": len(self.keys),
+            "changes": self.changes,
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self.ready else None,
+        }
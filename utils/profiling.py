@@ -0,0 +1,329 @@
+import asyncio
+import collections
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from fastapi import HTTPException
+from utils import metrics, tracing
+from utils.log import get_logger, request_id_var, trace_id_var
+from utils.settings import get_settings
+
+logger = get_logger("profiling")
+
+# ---------------------------------------------------------
+# On-demand profiling
+# ---------------------------------------------------------
+# Three opt-in tools for finding where request time goes:
+#
+#   - Per-request cProfile: a request carrying `X-Profile: 1` plus a valid
+#     X-Admin-Token, or matching a path armed via POST /admin/profile/arm,
+#     runs under cProfile. The response carries X-Profile-Id and the report
+#     is read from GET /admin/profiles/{id}. cProfile sees the whole thread,
+#     so work of other requests interleaved on the event loop shows up too;
+#     only one request is profiled at a time.
+#   - Stack sampler: POST /admin/profile/sample?seconds=N samples the event
+#     loop thread's stack from a background thread every few ms and returns
+#     collapsed stacks (flamegraph.pl / speedscope input). Time in select()
+#     is the loop waiting on I/O.
+#   - Slow requests: with SLOW_REQUEST_MS set, every span of a request
+#     (verify_token, each downstream attempt) is collected, and a request over
+#     the threshold logs and keeps its breakdown: time spent waiting on
+#     downstreams versus in-process, span by span.
+#
+# Everything is off by default; ProfilingMiddleware is not installed at all
+# unless PROFILING=1 or SLOW_REQUEST_MS is set.
+#
+# PROFILING                  "1" enables per-request profiles and the sampler
+# PROFILE_TOP                rows kept from each cProfile report (default 40)
+# PROFILE_KEEP               reports kept for /admin/profiles (default 20)
+# PROFILE_SAMPLE_INTERVAL_MS sampler period (default 5)
+# PROFILE_SAMPLE_MAX_SECONDS longest sampler run (default 60)
+# SLOW_REQUEST_MS            capture breakdowns above this latency (0 = off)
+# SLOW_REQUEST_KEEP          breakdowns kept for /admin/slow-requests (default 50)
+
+_settings = get_settings()
+PROFILING = _settings.profiling
+PROFILE_TOP = _settings.profile_top
+PROFILE_KEEP = _settings.profile_keep
+PROFILE_SAMPLE_INTERVAL_MS = _settings.profile_sample_interval_ms
+PROFILE_SAMPLE_MAX_SECONDS = _settings.profile_sample_max_seconds
+SLOW_REQUEST_MS = _settings.slow_request_ms
+SLOW_REQUEST_KEEP = _settings.slow_request_keep
+
+SLOW_REQUEST_SPANS = 100  # spans listed per breakdown
+
+CAPTURES = metrics.Counter("profiling_captures_total", "Profiles and slow-request breakdowns taken.", ("kind",))
+
+profiles = collections.OrderedDict()
+slow_requests = collections.deque(maxlen=SLOW_REQUEST_KEEP)
+
+_armed = {}
+_profiling = False
+_sampling = False
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+def enabled():
+    """
+    Whether main.py should install ProfilingMiddleware.
+    """
+    return PROFILING or SLOW_REQUEST_MS > 0
+
+
+def require_profiling():
+    if not PROFILING:
+        raise HTTPException(status_code=404, detail="Profiling disabled (PROFILING not set)")
+
+
+# ---------------------------------------------------------
+# Per-request profiles
+# ---------------------------------------------------------
+
+
+def arm(path, count):
+    """
+    Profiles the next `count` requests whose path starts with `path`.
+    """
+    _armed[path] = count
+    return dict(_armed)
+
+
+def _trigger(scope):
+    """
+    "header" or "armed" if this request should be profiled, else None.
+    """
+    wanted = token = None
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            wanted = value
+        elif name == b"x-admin-token":
+            token = value.decode("latin-1")
+    if wanted in (b"1", b"true") and get_settings().is_admin_token(token):
+        return "header"
+
+    for path, remaining in _armed.items():
+        if scope["path"].startswith(path):
+            if remaining <= 1:
+                del _armed[path]
+            else:
+                _armed[path] = remaining - 1
+            return "armed"
+    return None
+
+
+def _report(profiler):
+    import io
+    import pstats
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    return out.getvalue()
+
+
+def _keep_profile(profile_id, entry):
+    profiles[profile_id] = entry
+    while len(profiles) > PROFILE_KEEP:
+        profiles.popitem(last=False)
+
+
+# ---------------------------------------------------------
+# Slow-request breakdowns
+# ---------------------------------------------------------
+
+
+def _collect(span):
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append(span)
+
+
+def _union_ms(intervals):
+    """
+    Total length of possibly overlapping (start_ns, end_ns) intervals, in ms.
+    """
+    total = 0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total / 1e6
+
+
+def _breakdown(scope, status, start_ns, elapsed_ms, spans):
+    finished = sorted((s for s in spans if s.end_ns is not None), key=lambda s: s.start_ns)
+    downstream_ms = _union_ms([(s.start_ns, s.end_ns) for s in finished if s.kind == tracing.CLIENT])
+    route = scope.get("route")
+    return {
+        "at": round(start_ns / 1e9, 3),
+        "method": scope["method"],
+        "route": route.path if route is not None else scope["path"],
+        "path": scope["path"],
+        "status": status,
+        "request_id": request_id_var.get(),
+        "trace_id": trace_id_var.get(),
+        "duration_ms": round(elapsed_ms, 2),
+        "downstream_ms": round(downstream_ms, 2),
+        "in_process_ms": round(max(0.0, elapsed_ms - downstream_ms), 2),
+        "spans": [
+            {
+                "name": s.name,
+                "kind": s.kind,
+                "offset_ms": round((s.start_ns - start_ns) / 1e6, 2),
+                "duration_ms": round((s.end_ns - s.start_ns) / 1e6, 2),
+                "error": s.error,
+            }
+            for s in finished[:SLOW_REQUEST_SPANS]
+        ],
+    }
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware running the per-request profiler and slow-request
+    capture. Only installed when one of them is enabled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        if SLOW_REQUEST_MS > 0:
+            tracing.set_span_hook(_collect)
+
+    async def __call__(self, scope, receive, send):
+        global _profiling
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trigger = _trigger(scope) if PROFILING and not _profiling else None
+        if trigger is None and SLOW_REQUEST_MS <= 0:
+            return await self.app(scope, receive, send)
+
+        profiler = profile_id = None
+        if trigger is not None:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profile_id = uuid.uuid4().hex[:12]
+            _profiling = True
+
+        spans = [] if SLOW_REQUEST_MS > 0 else None
+        spans_token = _request_spans.set(spans)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if profile_id is not None:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-profile-id", profile_id.encode("latin-1"))
+                    ]
+            await send(message)
+
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if profiler is not None:
+                profiler.disable()
+                _profiling = False
+                _keep_profile(profile_id, {
+                    "id": profile_id,
+                    "trigger": trigger,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status["code"],
+                    "request_id": request_id_var.get(),
+                    "duration_ms": round(elapsed_ms, 2),
+                    "at": round(start_ns / 1e9, 3),
+                    "report": _report(profiler),
+                })
+                CAPTURES.inc("profile")
+            _request_spans.reset(spans_token)
+            if spans is not None and elapsed_ms >= SLOW_REQUEST_MS:
+                entry = _breakdown(scope, status["code"], start_ns, elapsed_ms, spans)
+                slow_requests.append(entry)
+                CAPTURES.inc("slow")
+                logger.warning(
+                    "Slow request %s %s: %.1fms (downstream %.1fms, in-process %.1fms, %d spans)",
+                    entry["method"], entry["route"], entry["duration_ms"],
+                    entry["downstream_ms"], entry["in_process_ms"], len(entry["spans"]),
+                )
+
+
+# ---------------------------------------------------------
+# Stack sampler
+# ---------------------------------------------------------
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every `interval` seconds and counts
+    identical stacks, root first, as `frame;frame;frame`.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.samples = 0
+        self._labels = {}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def run(self, seconds):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.counts[";".join(stack)] += 1
+                self.samples += 1
+            del frame
+            time.sleep(self.interval)
+        return self
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+async def sample(seconds, interval_ms=None):
+    """
+    Samples the event loop thread for `seconds` and returns the sampler.
+    One run at a time (409 otherwise).
+    """
+    global _sampling
+    if _sampling:
+        raise HTTPException(status_code=409, detail="A sampler run is already in progress")
+    seconds = min(max(seconds, 0.1), PROFILE_SAMPLE_MAX_SECONDS)
+    interval = (interval_ms or PROFILE_SAMPLE_INTERVAL_MS) / 1000
+
+    _sampling = True
+    try:
+        sampler = StackSampler(threading.get_ident(), interval)
+        await asyncio.to_thread(sampler.run, seconds)
+    finally:
+        _sampling = False
+    CAPTURES.inc("sample")
+    logger.info("Sampled the event loop for %.1fs: %d samples, %d stacks", seconds, sampler.samples, len(sampler.counts))
+    return sampler
@@ -0,0 +1,97 @@
+import re
+from functools import lru_cache
+from fastapi import HTTPException
+from utils import metrics
+from utils.settings import get_settings
+
+# ---------------------------------------------------------
+# Sparse fieldsets (?fields=...)
+# ---------------------------------------------------------
+# `fields=video_id,title,course_id` trims each video down to the listed keys.
+# A dotted name selects inside a nested object, e.g. `metadata.title` with
+# include=metadata. "video_id" is always kept so items stay addressable.
+#
+# The comma list is parsed, validated and compiled into a `Projection` once
+# per distinct field set (order and duplicates do not matter); applying a
+# plan is a single dict comprehension per item. Unknown keys are not an
+# error, they are simply absent from the result.
+#
+# PROJECTION_PLANS      compiled field sets kept (default 256)
+# PROJECTION_MAX_FIELDS most names accepted in one fields= (default 32)
+
+_settings = get_settings()
+PROJECTION_PLANS = _settings.projection_plans
+PROJECTION_MAX_FIELDS = _settings.projection_max_fields
+
+ALWAYS = ("video_id",)
+
+_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+PROJECTED = metrics.Counter("projection_responses_total", "Responses trimmed with fields=.", ("route",))
+
+
+class Projection:
+    """
+    Compiled field set: top-level `keys` copied as is, and `nested` plans for
+    keys that were only asked for in part.
+    """
+
+    __slots__ = ("key", "keys", "nested")
+
+    def __init__(self, key, keys, nested):
+        self.key = key
+        self.keys = keys
+        self.nested = nested
+
+    def apply(self, item):
+        if not isinstance(item, dict):
+            return item
+        out = {k: item[k] for k in self.keys if k in item}
+        for k, plan in self.nested:
+            if k in item:
+                out[k] = plan.apply(item[k])
+        return out
+
+    def apply_all(self, items):
+        apply = self.apply
+        return [apply(item) for item in items]
+
+
+def _build(names):
+    keys = []
+    parts = {}
+    for name in names:
+        head, _, rest = name.partition(".")
+        if not rest:
+            keys.append(head)
+        else:
+            parts.setdefault(head, []).append(rest)
+    # A whole object wins over parts of it
+    nested = tuple((head, _build(sorted(rest))) for head, rest in sorted(parts.items()) if head not in keys)
+    return Projection(",".join(names), tuple(keys), nested)
+
+
+@lru_cache(maxsize=PROJECTION_PLANS)
+def _compile(key):
+    return _build(key.split(","))
+
+
+def compile_fields(fields, keep=()):
+    """
+    Projection for a raw `fields=` value (None when no projection was asked
+    for). `keep` names keys that survive anyway unless the caller picked parts
+    of them. 400 on a malformed list.
+    """
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    if not names:
+        return None
+    if len(names) > PROJECTION_MAX_FIELDS:
+        raise HTTPException(status_code=400, detail=f"At most {PROJECTION_MAX_FIELDS} names in fields")
+    for name in names:
+        if not _NAME.match(name):
+            raise HTTPException(status_code=400, detail=f"Invalid field name: {name!r}")
+    names.update(ALWAYS)
+    names.update([k for k in keep if not any(name.startswith(k + ".") for name in names)])
+    return _compile(",".join(sorted(names)))
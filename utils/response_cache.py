@@ -0,0 +1,120 @@
+import asyncio
+import time
+from utils.cache import make_cache
+from utils.log import get_logger
+from utils.settings import get_settings, override
+
+logger = get_logger("response_cache")
+
+# ---------------------------------------------------------
+# Stale-while-revalidate response cache
+# ---------------------------------------------------------
+# For slowly changing catalog data (offerings, courses, professors).
+# A fresh entry is served as-is. A stale entry is still served instantly while
+# one background task refreshes it. If the downstream is down, the last good
+# copy keeps being served until it is older than ttl + max_stale.
+#
+# invalidate()/purge() bump a per-key generation and cancel pending refreshes;
+# a fetch that started before the bump drops its result instead of writing
+# the old data back.
+
+
+def route_ttl(route):
+    """
+    Per-route TTL override, e.g. OFFERINGS_CACHE_TTL. None means the cache's
+    default (CATALOG_CACHE_TTL).
+    """
+    return override(f"{route.upper()}_CACHE_TTL", float)
+
+
+class ResponseCache:
+    def __init__(self, name, ttl=60.0, max_stale=86400.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.entries = make_cache(name, max_entries=max_entries, default_ttl=ttl + max_stale)
+        self._refreshing = {}
+        self._generations = {}
+        self._epoch = 0
+        self.stale_served = 0
+        self.refresh_failures = 0
+
+    async def get_or_fetch(self, key, fetch, ttl=None):
+        """
+        Returns the cached value for `key`, calling `fetch(previous)` (a
+        coroutine function returning the value, raising on failure) when
+        needed. `previous` is the value being refreshed, or None on a miss, so
+        the fetcher can revalidate it upstream and return it unchanged.
+        A miss is filled through the entries' get_or_compute(), so concurrent
+        misses of one key share a single fetch (across workers too when the
+        cache backend is shared), whatever the HTTP method of the fetch.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        generation = self._generation(key)
+
+        async def fill():
+            return self._entry(await fetch(None), ttl)
+
+        entry = await self.entries.get_or_compute(key, fill, ttl=ttl + self.max_stale)
+        if self._generation(key) != generation:
+            # Invalidated while being fetched: serve it this once, don't keep it
+            self.entries.delete(key)
+            return entry["value"]
+
+        if time.time() - entry["fetched_at"] >= entry["ttl"]:
+            self.stale_served += 1
+            self._refresh_in_background(key, fetch, ttl, entry["value"])
+
+        return entry["value"]
+
+    @staticmethod
+    def _entry(value, ttl):
+        return {"value": value, "fetched_at": time.time(), "ttl": ttl}
+
+    def _generation(self, key):
+        return self._epoch, self._generations.get(key, 0)
+
+    def _store(self, key, value, ttl):
+        self.entries.set(key, self._entry(value, ttl), ttl=ttl + self.max_stale)
+
+    def _refresh_in_background(self, key, fetch, ttl, previous):
+        if key in self._refreshing:
+            return
+        generation = self._generation(key)
+
+        async def refresh():
+            try:
+                value = await fetch(previous)
+                if self._generation(key) == generation:
+                    self._store(key, value, ttl)
+            except Exception as e:
+                # Downstream is unhappy; keep serving the last good copy
+                self.refresh_failures += 1
+                logger.warning("Background refresh of '%s' failed: %r", key, e)
+            finally:
+                if self._refreshing.get(key) is task:
+                    del self._refreshing[key]
+
+        task = self._refreshing[key] = asyncio.create_task(refresh())
+
+    def _cancel_refreshes(self, keys):
+        for key in keys:
+            task = self._refreshing.pop(key, None)
+            if task is not None:
+                task.cancel()
+
+    def invalidate(self, key):
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._cancel_refreshes([key])
+        return self.entries.delete(key)
+
+    def purge(self, prefix=None):
+        self._epoch += 1
+        self._cancel_refreshes([key for key in self._refreshing if prefix is None or key.startswith(prefix)])
+        return self.entries.purge(prefix)
+
+
+catalog_cache = ResponseCache(
+    "catalog",
+    ttl=get_settings().catalog_cache_ttl,
+    max_stale=get_settings().catalog_cache_max_stale,
+)
@@ -0,0 +1,229 @@
+import asyncio
+import base64
+import hashlib
+import time
+import httpx
+from fastapi import HTTPException
+from utils import gcs_auth, http_client, metrics, retry
+from utils.log import get_logger
+from utils.settings import get_settings
+
+logger = get_logger("resumable")
+
+# ---------------------------------------------------------
+# Resumable upload target (GCS resumable-upload protocol)
+# ---------------------------------------------------------
+# Large video files are piped to a resumable session in fixed-size chunks:
+# each chunk is a PUT with `Content-Range: bytes a-b/total` (total is `*`
+# until the last chunk); the target answers 308 with the committed `Range`
+# until the final chunk completes the object. The session URL either comes
+# from the Upload service or is opened directly on GCS_BUCKET_NAME, in which
+# case requests carry an OAuth token minted by utils/gcs_auth.
+#
+# Only one chunk is ever held in memory, whatever the file size. A failed
+# chunk is retried after asking the target how much it actually committed,
+# so nothing is sent twice.
+#
+# UPLOAD_CHUNK_SIZE      bytes per chunk, a multiple of 256 KiB (default 8 MiB)
+# UPLOAD_CHUNK_RETRIES   attempts per chunk after the first (default 3)
+# UPLOAD_CHUNK_TIMEOUT   seconds per chunk PUT (default 120)
+
+GRANULARITY = 256 * 1024  # GCS requires non-final chunks in multiples of this
+
+_settings = get_settings()
+UPLOAD_CHUNK_SIZE = max(
+    GRANULARITY,
+    _settings.upload_chunk_size // GRANULARITY * GRANULARITY,
+)
+UPLOAD_CHUNK_RETRIES = _settings.upload_chunk_retries
+UPLOAD_CHUNK_TIMEOUT = _settings.upload_chunk_timeout
+
+THROUGHPUT_BUCKETS = (1e5, 5e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8)
+
+UPLOAD_BYTES = metrics.Counter("upload_bytes_total", "Bytes committed to the upload target.")
+UPLOAD_CHUNKS = metrics.Counter("upload_chunks_total", "Chunk PUTs by outcome.", ("outcome",))
+UPLOAD_CHUNK_SECONDS = metrics.Histogram("upload_chunk_seconds", "Time to commit one chunk.")
+UPLOAD_THROUGHPUT = metrics.Histogram(
+    "upload_throughput_bytes_per_second", "Throughput of each upload request.", buckets=THROUGHPUT_BUCKETS
+)
+
+CHUNK_ROUTE = "/upload/resumable"
+
+
+def _committed(res):
+    """
+    Bytes the target has persisted, from a 308's `Range: bytes=0-N`.
+    """
+    value = res.headers.get("range")
+    if not value:
+        return 0
+    return int(value.rpartition("-")[2]) + 1
+
+
+def chunk_checksum(data):
+    # Same encoding as GCS' md5Hash
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+def verify_result(result, expected_md5):
+    """
+    Compares a completed object's md5Hash with the digest the client
+    declared. True or False, or None when there is nothing to compare (no
+    declared digest, or a target that reports none, e.g. composite objects).
+    """
+    actual = (result or {}).get("md5Hash")
+    if not expected_md5 or not actual:
+        return None
+    return actual == expected_md5
+
+
+async def open_session(bucket, name, size, content_type):
+    """
+    Starts a resumable upload of `size` bytes to gs://bucket/name and returns
+    the session URL.
+    """
+    try:
+        res = await http_client.request(
+            "gcs", "POST", f"/upload/storage/v1/b/{bucket}/o",
+            route="/upload/storage/v1/b/{bucket}/o",
+            params={"uploadType": "resumable", "name": name},
+            headers={
+                **await gcs_auth.auth_headers(),
+                "X-Upload-Content-Type": content_type,
+                "X-Upload-Content-Length": str(size),
+            },
+        )
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Upload target timeout")
+    except httpx.TransportError:
+        raise HTTPException(status_code=503, detail="Upload target unavailable")
+
+    if res.status_code not in (200, 201) or not res.headers.get("location"):
+        raise HTTPException(status_code=502, detail=f"Could not open upload session: {res.status_code} {res.text}")
+    return res.headers["location"]
+
+
+async def _session_headers(authorized):
+    """
+    GCS credentials only go to sessions the composite opened itself; a
+    session URL handed out by the Upload service is already authorized.
+    """
+    return await gcs_auth.auth_headers() if authorized else {}
+
+
+async def query_offset(session_url, size, authorized=False):
+    """
+    (committed bytes, result) as the target sees it; result is the final
+    object metadata once the upload is complete, else None.
+    """
+    res = await http_client.request(
+        "gcs", "PUT", session_url,
+        route=CHUNK_ROUTE,
+        headers={**await _session_headers(authorized), "Content-Range": f"bytes */{size}"},
+    )
+    if res.status_code in (200, 201):
+        return size, _result(res)
+    if res.status_code == 308:
+        return _committed(res), None
+    raise HTTPException(status_code=502, detail=f"Upload target status query failed: {res.status_code}")
+
+
+def _result(res):
+    try:
+        return res.json()
+    except ValueError:
+        return {}
+
+
+async def put_chunk(session_url, data, offset, size, authorized=False):
+    """
+    Sends one chunk starting at `offset`, retrying failures from the offset
+    the target reports. Returns (committed bytes, result or None).
+    """
+    end = offset + len(data)
+    attempt = 0
+    start = time.perf_counter()
+    while True:
+        total = size if end == size else "*"
+        try:
+            res = await http_client.request(
+                "gcs", "PUT", session_url,
+                route=CHUNK_ROUTE,
+                timeout=UPLOAD_CHUNK_TIMEOUT,
+                content=data,
+                headers={**await _session_headers(authorized), "Content-Range": f"bytes {offset}-{end - 1}/{total}"},
+            )
+            if res.status_code in (200, 201):
+                committed, result = size, _result(res)
+            elif res.status_code == 308:
+                committed, result = _committed(res), None
+            elif res.status_code == 401 and authorized:
+                # Token expired or revoked mid-upload; retry with a fresh one
+                gcs_auth.invalidate()
+                raise _Retryable(res.status_code)
+            elif res.status_code in retry.RETRYABLE_STATUSES or res.status_code in (408, 429, 500):
+                raise _Retryable(res.status_code)
+            else:
+                UPLOAD_CHUNKS.inc("error")
+                raise HTTPException(status_code=502, detail=f"Upload target rejected chunk: {res.status_code} {res.text}")
+        except (httpx.TransportError, _Retryable) as e:
+            attempt += 1
+            UPLOAD_CHUNKS.inc("retry")
+            if attempt > UPLOAD_CHUNK_RETRIES:
+                UPLOAD_CHUNKS.inc("error")
+                raise HTTPException(status_code=503, detail=f"Upload target failed after {attempt} attempts: {e!r}")
+            logger.warning("Chunk at %d failed (%r), attempt %d", offset, e, attempt)
+            await asyncio.sleep(retry.backoff(attempt))
+            try:
+                committed, result = await query_offset(session_url, size, authorized)
+            except (httpx.TransportError, HTTPException):
+                continue
+
+        if result is not None or committed >= end:
+            UPLOAD_CHUNKS.inc("ok")
+            UPLOAD_CHUNK_SECONDS.observe(time.perf_counter() - start)
+            return committed, result
+        if committed < offset:
+            raise HTTPException(status_code=502, detail=f"Upload target lost data: committed {committed} < {offset}")
+        # Partly persisted: send only what is missing
+        data = data[committed - offset:]
+        offset = committed
+
+
+class _Retryable(Exception):
+    pass
+
+
+async def pipe(session_url, size, offset, body, on_chunk, authorized=False):
+    """
+    Streams `body` (an async iterator of bytes) to the session from `offset`,
+    in UPLOAD_CHUNK_SIZE chunks. `on_chunk(offset, length, checksum, result)`
+    is awaited after every committed chunk. If the body ends before the file
+    does, the tail that does not fill a 256 KiB unit is not sent; the client
+    resumes from the returned offset. Returns (offset, result or None).
+    `authorized` sends GCS credentials, for sessions from open_session().
+    """
+    buffer = bytearray()
+    result = None
+
+    async def send(length):
+        nonlocal offset, result
+        data = bytes(buffer[:length])
+        del buffer[:length]
+        committed, result = await put_chunk(session_url, data, offset, size, authorized)
+        UPLOAD_BYTES.inc(amount=committed - offset)
+        await on_chunk(offset, committed - offset, chunk_checksum(data[:committed - offset]), result)
+        offset = committed
+
+    async for piece in body:
+        buffer += piece
+        if offset + len(buffer) > size:
+            raise HTTPException(status_code=400, detail=f"Body exceeds the declared size of {size} bytes")
+        while len(buffer) >= UPLOAD_CHUNK_SIZE:
+            await send(UPLOAD_CHUNK_SIZE)
+
+    if buffer and offset + len(buffer) == size:
+        await send(len(buffer))
+    elif len(buffer) >= GRANULARITY:
+        await send(len(buffer) // GRANULARITY * GRANULARITY)
+    return offset, result
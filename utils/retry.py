@@ -0,0 +1,88 @@
+import random
+import time
+from utils import metrics
+from utils.settings import get_settings
+
+# ---------------------------------------------------------
+# Retry budget and backoff for idempotent downstream reads
+# ---------------------------------------------------------
+# Every original request deposits RETRY_BUDGET_RATIO tokens into one global
+# bucket; every retry or hedge withdraws a whole token. When the bucket is
+# empty, failures are returned as-is instead of being retried, so a struggling
+# upstream sees at most ~RETRY_BUDGET_RATIO extra load, never a retry storm.
+
+_settings = get_settings()
+RETRY_MAX = _settings.retry_max
+RETRY_BACKOFF_BASE_MS = _settings.retry_backoff_base_ms
+RETRY_BACKOFF_MAX_MS = _settings.retry_backoff_max_ms
+RETRY_BUDGET_RATIO = _settings.retry_budget_ratio
+RETRY_BUDGET_MIN_PER_SEC = _settings.retry_budget_min_per_sec
+
+HEDGE_ENABLED = _settings.hedge_enabled
+# Fixed hedge delay; when unset the route's observed p95 is used
+HEDGE_DELAY_MS = _settings.hedge_delay_ms
+
+# Upstream answers worth retrying on another attempt
+RETRYABLE_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class RetryBudget:
+    def __init__(self, ratio, min_per_sec, max_tokens=100.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._last_refill = time.monotonic()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        now = time.monotonic()
+        # A small floor keeps retries possible at very low traffic
+        refill = self.ratio + (now - self._last_refill) * self.min_per_sec
+        self._last_refill = now
+        self.tokens = min(self.max_tokens, self.tokens + refill)
+
+    def withdraw(self):
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def stats(self):
+        return {
+            "tokens": round(self.tokens, 2),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.exhausted,
+        }
+
+
+def backoff(attempt):
+    """
+    Full-jitter exponential backoff in seconds for the given retry attempt (1-based).
+    """
+    ceiling = min(RETRY_BACKOFF_MAX_MS, RETRY_BACKOFF_BASE_MS * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling) / 1000
+
+
+budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SEC)
+
+
+def _collect():
+    return [
+        ("downstream_retries_total", "counter", "Downstream retries sent.", [({}, budget.retries)]),
+        ("downstream_hedges_total", "counter", "Hedged duplicate requests sent.", [({}, budget.hedges)]),
+        ("downstream_hedge_wins_total", "counter", "Hedges that answered first.", [({}, budget.hedge_wins)]),
+        ("downstream_retry_budget_exhausted_total", "counter", "Retries skipped for lack of budget.",
+         [({}, budget.exhausted)]),
+        ("downstream_retry_budget_tokens", "gauge", "Retry budget balance.", [({}, budget.tokens)]),
+    ]
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,250 @@
+import hmac
+import os
+from functools import lru_cache
+from typing import Literal, Optional
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+# ---------------------------------------------------------
+# Composite settings
+# ---------------------------------------------------------
+# `.env` is read exactly once, by the first get_settings() call. Every setting
+# of the composite is a field below, read from the environment variable of
+# the same name upper-cased (RETRY_MAX -> retry_max), and validated up front:
+# a bad URL, mode or number fails the boot with the variable named instead of
+# failing the first request.
+#
+# Route handlers receive settings through `Depends(get_settings)`, which tests
+# can replace with app.dependency_overrides. Modules that size pools, caches
+# and queues when they are imported copy their knobs from get_settings() into
+# module constants; those knobs are documented next to the code using them.
+#
+# Per-service, per-route and per-cache overrides (SEARCH_HTTP_TIMEOUT,
+# OFFERINGS_CACHE_TTL, COMPRESSED_CACHE_BACKEND, ...) have open-ended names
+# and are read through `override()`, which validates them the same way.
+
+ENV_PATH = os.path.join(os.path.dirname(__file__), "..", ".env")
+
+
+class Settings(BaseModel):
+    auth_service_url: Optional[str] = None
+    search_service_url: Optional[str] = None
+    upload_service_url: Optional[str] = None
+    video_composite_url: Optional[str] = None
+    # Resumable upload target for streamed video files
+    gcs_upload_url: Optional[str] = "https://storage.googleapis.com"
+    gcs_bucket_name: Optional[str] = None
+    # Credentials for that fallback, see utils/gcs_auth
+    gcs_auth: Literal["metadata", "service_account", "none"] = "metadata"
+    gcs_credentials_file: Optional[str] = None
+    google_application_credentials: Optional[str] = None
+
+    admin_token: Optional[str] = None
+    auth_verify_mode: Literal["remote", "local"] = "remote"
+    firebase_project_id: Optional[str] = None
+
+    # Open pooled connections (DNS, TCP, TLS) to every downstream at startup
+    startup_prewarm: bool = False
+    prewarm_connections: int = 2
+    prewarm_timeout: float = 2.0
+    # Boot time we expect to stay under; reported by /healthz
+    startup_budget_ms: float = 1500.0
+
+    # Downstream HTTP pools (utils/http_client)
+    http_max_connections: int = Field(200, ge=1)
+    http_max_keepalive: int = Field(50, ge=0)
+    http_keepalive_expiry: float = Field(30.0, ge=0)
+    http_timeout: float = Field(5.0, gt=0)
+    http_connect_timeout: Optional[float] = Field(None, gt=0)
+    coalesce_gets: bool = True
+    downstream_accept_encoding: Optional[str] = None
+
+    # Concurrency limits and load shedding (utils/concurrency)
+    downstream_max_concurrency: int = Field(100, ge=1)
+    downstream_max_queue: int = Field(200, ge=0)
+    downstream_queue_timeout: float = Field(1.0, ge=0)
+
+    # Retries and hedging (utils/retry)
+    retry_max: int = Field(2, ge=0)
+    retry_backoff_base_ms: float = Field(50, ge=0)
+    retry_backoff_max_ms: float = Field(1000, ge=0)
+    retry_budget_ratio: float = Field(0.1, ge=0)
+    retry_budget_min_per_sec: float = Field(5, ge=0)
+    hedge_enabled: bool = False
+    hedge_delay_ms: Optional[float] = Field(None, ge=0)
+
+    # Circuit breakers and adaptive timeouts (utils/circuit_breaker)
+    breaker_window_seconds: float = Field(30, gt=0)
+    breaker_min_calls: int = Field(20, ge=1)
+    breaker_error_rate: float = Field(0.5, gt=0, le=1)
+    breaker_open_seconds: float = Field(10, gt=0)
+    breaker_half_open_probes: int = Field(3, ge=1)
+    adaptive_timeouts: bool = True
+    adaptive_timeout_multiplier: float = Field(3, gt=0)
+    adaptive_timeout_min: float = Field(1.0, gt=0)
+
+    # Caches (utils/cache, utils/response_cache, utils/auth, resources/auth_resource)
+    cache_backend: Literal["memory", "sqlite"] = "memory"
+    cache_sqlite_path: Optional[str] = None
+    cache_sqlite_lease: float = Field(10, gt=0)
+    cache_sqlite_busy_ms: float = Field(50, ge=0)
+    catalog_cache_ttl: float = Field(60, ge=0)
+    catalog_cache_max_stale: float = Field(86400, ge=0)
+    user_cache_ttl: float = Field(60, ge=0)
+    user_cache_size: int = Field(2048, ge=1)
+    token_cache_ttl: float = Field(300, ge=0)
+    token_negative_ttl: float = Field(10, ge=0)
+    token_cache_size: int = Field(10000, ge=1)
+
+    # Search page cache (utils/page_cache)
+    search_page_cache: bool = False
+    search_block_size: int = Field(100, ge=1)
+    search_page_ttl: float = Field(30, ge=0)
+    search_prefetch_at: float = Field(0.75, ge=0, le=1)
+    search_page_cache_size: int = Field(2048, ge=1)
+
+    # Video and dashboard endpoints (resources/video_resource, dashboard_resource)
+    video_batch_max: int = Field(100, ge=1)
+    video_batch_concurrency: int = Field(10, ge=1)
+    search_passthrough: bool = False
+    search_fields_upstream: bool = False
+    projection_plans: int = Field(256, ge=1)
+    projection_max_fields: int = Field(32, ge=1)
+    dashboard_user_timeout: float = Field(2, gt=0)
+    dashboard_offerings_timeout: float = Field(3, gt=0)
+    dashboard_videos_timeout: float = Field(3, gt=0)
+    dashboard_videos_limit: int = Field(20, ge=1)
+
+    # Resumable uploads (resources/upload_resource, utils/resumable)
+    upload_max_bytes: int = Field(10 * 1024 ** 3, ge=1)
+    upload_session_ttl: float = Field(7 * 86400, gt=0)  # GCS sessions last a week
+    upload_chunk_size: int = Field(8 * 1024 * 1024, ge=1)
+    upload_chunk_retries: int = Field(3, ge=0)
+    upload_chunk_timeout: float = Field(120, gt=0)
+
+    # Response compression (utils/compression)
+    compress_min_bytes: int = Field(1024, ge=0)
+    compress_level: Optional[int] = Field(None, ge=0, le=11)
+    compress_thread_bytes: int = Field(262144, ge=0)
+    compress_rules: Optional[str] = None
+    compressed_cache_size: int = Field(512, ge=1)
+    compressed_cache_ttl: float = Field(3600, ge=0)
+
+    # Local Firebase verification (utils/firebase)
+    firebase_certs_url: str = (
+        "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+    )
+    firebase_certs_file: Optional[str] = None
+    firebase_clock_skew: int = Field(5, ge=0)
+
+    # Logging and tracing (utils/log, utils/tracing)
+    log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
+    log_payload_max: int = Field(256, ge=0)
+    log_sample_rates: Optional[str] = None
+    trace_sample_rate: float = Field(0.0, ge=0, le=1)
+    trace_follow_upstream: bool = False
+    trace_exporter: Literal["file", "otlp", "none"] = "none"
+    trace_file: str = "traces.jsonl"
+    trace_otlp_endpoint: str = "http://localhost:4318/v1/traces"
+    trace_service_name: str = "composite"
+
+    # Profiling (utils/profiling)
+    profiling: bool = False
+    profile_top: int = Field(40, ge=1)
+    profile_keep: int = Field(20, ge=1)
+    profile_sample_interval_ms: float = Field(5, gt=0)
+    profile_sample_max_seconds: float = Field(60, gt=0)
+    slow_request_ms: float = Field(0, ge=0)
+    slow_request_keep: int = Field(50, ge=1)
+
+    # Professor typeahead index (utils/prof_index)
+    prof_index: bool = True
+    prof_index_refresh: float = Field(60, gt=0)
+    prof_suggest_scan: int = Field(5000, ge=1)
+
+    @field_validator(
+        "auth_service_url", "search_service_url", "upload_service_url", "video_composite_url",
+        "gcs_upload_url",
+    )
+    @classmethod
+    def _url(cls, value):
+        value = (value or "").strip().rstrip("/")
+        if not value:
+            return None
+        if not value.startswith(("http://", "https://")):
+            raise ValueError(f"expected an http(s) URL, got {value!r}")
+        return value
+
+    @field_validator("auth_verify_mode", "gcs_auth", "cache_backend", "trace_exporter", mode="before")
+    @classmethod
+    def _lower(cls, value):
+        return value.lower() if isinstance(value, str) else value
+
+    @field_validator("log_level", mode="before")
+    @classmethod
+    def _upper(cls, value):
+        return value.upper() if isinstance(value, str) else value
+
+    def is_admin_token(self, token):
+        """
+        Constant-time comparison of `token` with ADMIN_TOKEN; False when
+        either is missing.
+        """
+        if not self.admin_token or token is None:
+            return False
+        return hmac.compare_digest(token.encode(), self.admin_token.encode())
+
+    def service_url(self, env_name):
+        """
+        URL by its environment variable name, e.g. "SEARCH_SERVICE_URL".
+        """
+        return getattr(self, env_name.lower())
+
+
+class SettingsError(ValueError):
+    pass
+
+
+def override(env_name, cast=str, default=None):
+    """
+    Value of an open-ended override such as SEARCH_HTTP_TIMEOUT, converted
+    with `cast`; `default` when it is unset or empty. A value that does not
+    convert raises SettingsError naming the variable.
+    """
+    get_settings()  # make sure .env has been loaded
+    value = os.environ.get(env_name)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        raise SettingsError(f"{env_name}: expected {cast.__name__}, got {value!r}") from None
+
+
+def _load_dotenv():
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=ENV_PATH)
+
+
+@lru_cache(maxsize=None)
+def get_settings():
+    _load_dotenv()
+    values = {
+        name: os.environ[name.upper()]
+        for name in Settings.model_fields
+        if os.environ.get(name.upper())
+    }
+    try:
+        return Settings(**values)
+    except ValidationError as e:
+        raise SettingsError(_describe(e)) from None
+
+
+def _describe(error):
+    """
+    One line per bad variable, by its environment name.
+    """
+    lines = ["Invalid settings:"]
+    for item in error.errors():
+        name = str(item["loc"][0]).upper() if item["loc"] else "?"
+        lines.append(f"  {name}={item.get('input')!r}: {item['msg']}")
+    return "\n".join(lines)
@@ -0,0 +1,45 @@
+import asyncio
+
+# ---------------------------------------------------------
+# Single-flight request coalescing
+# ---------------------------------------------------------
+# Concurrent callers asking for the same key share one in-flight call and its
+# result. The call runs as its own task, so one caller disconnecting (and
+# being cancelled) does not fail everyone else waiting on it.
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._inflight = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    async def do(self, key, fn):
+        """
+        Runs `fn()` (a coroutine function) once per key at a time; callers
+        arriving while it is in flight await the same result.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.collapsed += 1
+
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        self._inflight.pop(key, None)
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "inflight": len(self._inflight),
+        }
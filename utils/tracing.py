@@ -0,0 +1,411 @@
+import abc
+import contextvars
+import json
+import queue
+import random
+import threading
+import time
+from utils.log import get_logger, trace_id_var
+from utils.settings import get_settings
+
+logger = get_logger("tracing")
+
+# ---------------------------------------------------------
+# Distributed tracing (W3C Trace Context)
+# ---------------------------------------------------------
+# Every request continues the trace of an incoming `traceparent` header or
+# starts a new one. The route, each downstream call (one span per attempt,
+# so retries and hedges show up separately) and verify_token get a span, and
+# downstream calls carry our `traceparent` so Auth, Search, Upload and the
+# video composite can join the same trace.
+#
+# Sampling is decided once per trace at the edge by TRACE_SAMPLE_RATE; an
+# incoming sampled flag is only followed with TRACE_FOLLOW_UPSTREAM=1 (any
+# client can set it). Unsampled requests still propagate ids but record
+# nothing. Finished spans are exported by a
+# background thread, never on the event loop.
+#
+# TRACE_SAMPLE_RATE     fraction of new traces recorded (default 0.0)
+# TRACE_FOLLOW_UPSTREAM "1" records traces the caller marked as sampled
+# TRACE_EXPORTER        "file" (JSON lines), "otlp" (OTLP/HTTP JSON) or "none"
+#                       (default: spans are propagated, not recorded)
+# TRACE_FILE            output of the file exporter (default traces.jsonl)
+# TRACE_OTLP_ENDPOINT   e.g. http://localhost:4318/v1/traces
+# TRACE_SERVICE_NAME    resource service.name (default "composite")
+
+_settings = get_settings()
+TRACE_SAMPLE_RATE = _settings.trace_sample_rate
+TRACE_FOLLOW_UPSTREAM = _settings.trace_follow_upstream
+TRACE_EXPORTER = _settings.trace_exporter
+TRACE_FILE = _settings.trace_file
+TRACE_OTLP_ENDPOINT = _settings.trace_otlp_endpoint
+TRACE_SERVICE_NAME = _settings.trace_service_name
+TRACE_BATCH_SIZE = 256
+TRACE_FLUSH_SECONDS = 1.0
+
+SERVER = "server"
+CLIENT = "client"
+INTERNAL = "internal"
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+_exporter = None
+# Called with every finished span, sampled or not (see utils.profiling)
+_span_hook = None
+
+
+def _new_id(nbytes):
+    return "%0*x" % (nbytes * 2, random.getrandbits(nbytes * 8) or 1)
+
+
+def parse_traceparent(value):
+    """
+    (trace_id, parent_id, sampled) from a traceparent header, or None if it
+    is missing or malformed.
+    """
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff":
+        return None
+    trace_id, parent_id, flags = parts[1], parts[2], parts[3]
+    if len(trace_id) != 32 or len(parent_id) != 16 or len(flags) != 2:
+        return None
+    try:
+        int(trace_id, 16), int(parent_id, 16)
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, sampled
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "sampled", "name", "kind",
+        "start_ns", "end_ns", "attributes", "error",
+    )
+
+    def __init__(self, name, trace_id, parent_id, sampled, kind=INTERNAL, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set(self, key, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def end(self, error=None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = repr(error)
+        if self.sampled and _exporter is not None:
+            _exporter.submit(self)
+        if _span_hook is not None:
+            _span_hook(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class span:
+    """
+    Child span of the current one, as a context manager:
+
+        with tracing.span("verify_token", mode="local") as s:
+            s.set("cache", "hit")
+
+    Outside a request (no current span) it is a cheap no-op.
+    """
+
+    __slots__ = ("name", "kind", "attributes", "_span", "_token")
+
+    def __init__(self, name, kind=INTERNAL, **attributes):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self._span = None
+        self._token = None
+
+    def __enter__(self):
+        parent = current_span.get()
+        if parent is None:
+            self._span = _NOOP
+            return _NOOP
+        self._span = Span(
+            self.name, parent.trace_id, parent.span_id, parent.sampled, self.kind,
+            self.attributes if parent.sampled else None,
+        )
+        self._token = current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            current_span.reset(self._token)
+            self._span.end(exc)
+        return False
+
+
+class _NoopSpan:
+    sampled = False
+    traceparent = None
+
+    def set(self, key, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def inject(headers):
+    """
+    Adds the current span's traceparent to outgoing headers (a new dict).
+    """
+    current = current_span.get()
+    if current is None:
+        return headers
+    return {**(headers or {}), "traceparent": current.traceparent}
+
+
+class TracingMiddleware:
+    """
+    Pure ASGI middleware that opens the server span of every request and
+    echoes its traceparent on the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                incoming = parse_traceparent(value.decode("latin-1"))
+                break
+
+        if incoming is not None:
+            trace_id, parent_id, upstream_sampled = incoming
+        else:
+            trace_id, parent_id, upstream_sampled = _new_id(16), None, False
+        if TRACE_FOLLOW_UPSTREAM and upstream_sampled:
+            sampled = True
+        else:
+            sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+        root = Span(scope["path"], trace_id, parent_id, sampled, SERVER)
+        token = current_span.set(root)
+        trace_token = trace_id_var.set(trace_id)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceparent", root.traceparent.encode("latin-1"))
+                ]
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            current_span.reset(token)
+            trace_id_var.reset(trace_token)
+            if sampled:
+                route = scope.get("route")
+                root.name = f"{scope['method']} {route.path if route is not None else scope['path']}"
+                root.attributes.update({
+                    "http.method": scope["method"],
+                    "http.target": scope["path"],
+                    "http.status_code": status["code"],
+                })
+            root.end(error)
+
+
+# ---------------------------------------------------------
+# Exporters
+# ---------------------------------------------------------
+
+
+class _Exporter(abc.ABC):
+    """
+    Batches finished spans on a queue and writes them from a daemon thread.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self.exported = 0
+        self.failed = 0
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, span):
+        self._queue.put(span)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        batch = []
+        while True:
+            try:
+                # Flush a partial batch after TRACE_FLUSH_SECONDS of quiet
+                item = self._queue.get(timeout=TRACE_FLUSH_SECONDS if batch else None)
+            except queue.Empty:
+                item = False
+            if item:
+                batch.append(item)
+                if len(batch) < TRACE_BATCH_SIZE:
+                    continue
+            if batch:
+                try:
+                    self.export(batch)
+                    self.exported += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    logger.warning("Exporting %d spans failed: %r", len(batch), e)
+                batch = []
+            if item is None:
+                return
+
+    @abc.abstractmethod
+    def export(self, spans):
+        """
+        Writes one batch of finished spans; runs on the exporter thread.
+        """
+
+
+class FileExporter(_Exporter):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, "a") as f:
+            for s in spans:
+                f.write(json.dumps(s.to_dict(), default=str) + "\n")
+
+
+_OTLP_KINDS = {INTERNAL: 1, SERVER: 2, CLIENT: 3}
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter(_Exporter):
+    """
+    OTLP/HTTP with the JSON encoding, accepted by the OpenTelemetry
+    Collector and most tracing backends.
+    """
+
+    def __init__(self, endpoint):
+        super().__init__()
+        self.endpoint = endpoint
+
+    def export(self, spans):
+        import urllib.request
+
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}},
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": "composite"},
+                "spans": [self._span(s) for s in spans],
+            }],
+        }]}
+        req = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=5):
+            pass
+
+    @staticmethod
+    def _span(s):
+        span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": _OTLP_KINDS[s.kind],
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            span["parentSpanId"] = s.parent_id
+        return span
+
+
+def set_span_hook(fn):
+    """
+    Installs `fn(span)` to be called as each span ends; None removes it.
+    """
+    global _span_hook
+    _span_hook = fn
+
+
+def setup_tracing():
+    """
+    Starts the configured exporter. With TRACE_EXPORTER=none spans are still
+    propagated downstream but not recorded.
+    """
+    global _exporter
+    if _exporter is not None or TRACE_EXPORTER == "none":
+        return
+    if TRACE_EXPORTER == "otlp":
+        _exporter = OtlpExporter(TRACE_OTLP_ENDPOINT)
+    else:
+        _exporter = FileExporter(TRACE_FILE)
+    _exporter.start()
+
+
+def shutdown_tracing():
+    """
+    Flushes pending spans and stops the exporter thread.
+    """
+    global _exporter
+    if _exporter is not None:
+        _exporter.stop()
+        _exporter = None